@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import Cliente, DocumentoCliente, Pratiche, ProfiloUtente, Lead, Consulente, NotaLead
+from django.urls import reverse
+from .models import (
+    Cliente, DocumentoCliente, Pratiche, ProfiloUtente, Lead, Consulente, NotaLead,
+    LeadArchivio, NotaLeadArchivio, Cancellazione, FiltroSalvato, genera_token_calendario,
+)
 
 @admin.register(Cliente)
 class ClienteAdmin(admin.ModelAdmin):
@@ -22,6 +26,15 @@ class PraticheAdmin(admin.ModelAdmin):
 class ProfiloUtenteAdmin(admin.ModelAdmin):
     list_display = ("utente", "ruolo")
     list_filter = ("ruolo",)
+    # si aggiorna solo con F() (revoca dei JWT): riscriverla dal form riporterebbe in vita token revocati
+    readonly_fields = ("versione_token",)
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            # niente versione_token nell'UPDATE: un incremento concorrente non va perso
+            obj.save(update_fields=[c for c in form.changed_data if c != "versione_token"])
+        else:
+            super().save_model(request, obj, form, change)
 
 @admin.register(Lead)
 class LeadAdmin(admin.ModelAdmin):
@@ -37,8 +50,64 @@ class NotaLeadAdmin(admin.ModelAdmin):
     raw_id_fields = ("lead", "autore")
 
 
+class SolaLetturaAdmin(admin.ModelAdmin):
+    """Tabelle popolate solo dal codice (archivio lead, tombstone): non modificabili da admin."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LeadArchivio)
+class LeadArchivioAdmin(SolaLetturaAdmin):
+    list_display = ("id", "nome", "cognome", "stato", "convertito", "consulente", "creato_il", "archiviato_il")
+    list_filter = ("stato", "convertito", "consulente", "archiviato_il")
+    search_fields = ("nome", "cognome", "telefono", "email")
+
+
+@admin.register(NotaLeadArchivio)
+class NotaLeadArchivioAdmin(SolaLetturaAdmin):
+    list_display = ("id", "lead", "autore", "creato_il")
+    search_fields = ("testo", "lead__nome", "lead__cognome")
+    raw_id_fields = ("lead", "autore")
+
+
+@admin.register(Cancellazione)
+class CancellazioneAdmin(SolaLetturaAdmin):
+    list_display = ("id", "modello", "oggetto_id", "eliminato_il")
+    list_filter = ("modello",)
+    search_fields = ("oggetto_id",)
+
+
+@admin.register(FiltroSalvato)
+class FiltroSalvatoAdmin(admin.ModelAdmin):
+    list_display = ("nome", "utente", "stato_slug", "memorizza_risultati", "creato_il")
+    list_filter = ("memorizza_risultati",)
+    search_fields = ("nome", "utente__username")
+
+
 @admin.register(Consulente)
 class ConsulenteAdmin(admin.ModelAdmin):
-    list_display = ("nome", "is_active", "creato_il")
+    list_display = ("nome", "is_active", "creato_il", "link_calendario")
     list_filter = ("is_active",)
-    search_fields = ("nome",)
\ No newline at end of file
+    search_fields = ("nome",)
+    readonly_fields = ("link_calendario",)
+    actions = ["rigenera_token_calendario"]
+
+    @admin.display(description="Feed calendario (.ics)")
+    def link_calendario(self, obj):
+        if not obj.pk:
+            return "—"
+        return reverse("consulente_calendario_ics", args=[obj.calendario_token])
+
+    @admin.action(description="Rigenera link calendario (invalida quello vecchio)")
+    def rigenera_token_calendario(self, request, queryset):
+        for consulente in queryset:
+            consulente.calendario_token = genera_token_calendario()
+            consulente.save(update_fields=["calendario_token"])
+        self.message_user(request, f"Link calendario rigenerati: {queryset.count()}.")
\ No newline at end of file
@@ -0,0 +1,147 @@
+# crm/api/autenticazione.py
+"""
+JWT con claim di ruolo: `ruolo` + `rt` (istante di emissione del claim).
+Con il claim fresco i controlli di permesso non interrogano ProfiloUtente.
+
+Ogni token porta anche `attivo` (User.is_active) e `tv` (ProfiloUtente.versione_token).
+Revocare i token di un utente = incrementarne la versione (revoca_token_utente):
+la versione corrente sta in cache, il DB si legge solo al primo accesso / a cache scaduta.
+
+JWTAuthenticationStateless (opzionale, API_JWT_STATELESS=True) si fida dei claim
+e non carica User/ProfiloUtente: la view riceve un UtenteToken, che legge la riga
+User solo se serve davvero (`request.user.utente`).
+"""
+import time
+
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from crm.ruoli import RUOLO_CACHE_TTL, applica_claim, ruolo_per_id, ruolo_utente
+
+
+# ==============================
+# Versione token (revoca)
+# ==============================
+
+def _chiave_versione(user_id) -> str:
+    return f"crm:token_versione:{user_id}"
+
+
+def versione_token(user_id) -> int:
+    """Versione corrente dei token dell'utente; -1 se l'utente non ha profilo."""
+    versione = cache.get(_chiave_versione(user_id))
+    if versione is None:
+        from crm.models import ProfiloUtente
+
+        versione = ProfiloUtente.objects.filter(utente_id=user_id).values_list("versione_token", flat=True).first()
+        versione = -1 if versione is None else versione
+        cache.set(_chiave_versione(user_id), versione, RUOLO_CACHE_TTL)
+    return versione
+
+
+def revoca_token_utente(user_id) -> int:
+    """Invalida tutti i JWT (access e refresh) già emessi all'utente."""
+    from crm.models import ProfiloUtente
+
+    ProfiloUtente.objects.filter(utente_id=user_id).update(versione_token=F("versione_token") + 1)
+    cache.delete(_chiave_versione(user_id))
+    return versione_token(user_id)
+
+
+def _verifica_versione(token) -> None:
+    if "tv" not in token:
+        return  # token emessi prima dei claim di versione: scadono da soli
+    if token["tv"] != versione_token(token[api_settings.USER_ID_CLAIM]):
+        raise AuthenticationFailed("Token revocato.", code="token_revoked")
+
+
+# ==============================
+# Emissione
+# ==============================
+
+def _aggiungi_claim_ruolo(token, ruolo: str) -> None:
+    token["ruolo"] = ruolo
+    token["rt"] = int(time.time())
+
+
+class TokenConRuoloSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token["attivo"] = user.is_active
+        token["tv"] = versione_token(user.pk)
+        if user.is_superuser:
+            token["is_superuser"] = True
+        _aggiungi_claim_ruolo(token, ruolo_utente(user))
+        return token
+
+
+class TokenRefreshConRuoloSerializer(TokenRefreshSerializer):
+    """Il nuovo access token porta il ruolo attuale, non quello copiato dal refresh token."""
+
+    def validate(self, attrs):
+        try:
+            _verifica_versione(RefreshToken(attrs["refresh"]))
+        except AuthenticationFailed as exc:
+            raise InvalidToken(exc.detail) from exc
+        data = super().validate(attrs)
+        access = AccessToken(data["access"], verify=False)
+        _aggiungi_claim_ruolo(access, ruolo_per_id(access[api_settings.USER_ID_CLAIM]))
+        data["access"] = str(access)
+        return data
+
+
+# ==============================
+# Autenticazione
+# ==============================
+
+class JWTAuthenticationConRuolo(JWTAuthentication):
+    def get_user(self, validated_token):
+        _verifica_versione(validated_token)
+        user = super().get_user(validated_token)
+        if "ruolo" in validated_token:
+            applica_claim(user, validated_token["ruolo"], validated_token.get("rt"))
+        return user
+
+
+class UtenteToken(TokenUser):
+    """Utente ricostruito dai claim del JWT; `utente` carica il modello User su richiesta."""
+
+    @cached_property
+    def is_active(self) -> bool:
+        return self.token.get("attivo", True)
+
+    @cached_property
+    def utente(self):
+        from django.contrib.auth import get_user_model
+
+        return get_user_model().objects.get(**{api_settings.USER_ID_FIELD: self.id})
+
+    @property
+    def profiloutente(self):
+        return self.utente.profiloutente
+
+
+class JWTAuthenticationStateless(JWTAuthenticationConRuolo):
+    """Nessuna query per richiesta: bastano firma, claim `attivo` e versione in cache."""
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken("Il token non contiene l'identificativo utente.")
+        if "tv" not in validated_token or "ruolo" not in validated_token:
+            # token senza i claim necessari: percorso classico con lettura dal DB
+            return super().get_user(validated_token)
+        if not validated_token.get("attivo", True):
+            raise AuthenticationFailed("Utente non attivo.", code="user_inactive")
+        _verifica_versione(validated_token)
+
+        user = UtenteToken(validated_token)
+        applica_claim(user, validated_token["ruolo"], validated_token.get("rt"))
+        return user
@@ -0,0 +1,127 @@
+# crm/api/espansioni.py
+"""
+?expand=a,b per l'API: relazioni annidate senza N+1.
+
+Ogni espansione dichiara il campo JSON, il serializer annidato e come caricarla
+(select_related per le FK, Prefetch per le relazioni inverse): il queryset della
+view viene costruito di conseguenza, quindi le query per pagina restano costanti
+(1 + una per ogni relazione prefetchata) qualunque sia la dimensione della pagina.
+
+`conteggi` aggiunge num_<relazione> come annotazioni (subquery COUNT), senza
+caricare i figli.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable
+
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+EXPAND_PARAM = "expand"
+CONTEGGI = "conteggi"
+
+
+@dataclass(frozen=True)
+class Espansione:
+    campo: str                      # chiave nel JSON
+    serializer: type
+    relazione: str                  # nome della relazione sul modello
+    many: bool = False
+    ordinamento: tuple = ()
+    conteggio: str | None = None    # nome dell'annotazione con `conteggi`
+    # filtro per utente sui figli (es. documenti riservati agli admin)
+    filtra: Callable | None = None
+
+
+def espansioni_richieste(request, disponibili: dict) -> list[str]:
+    valore = request.query_params.get(EXPAND_PARAM, "")
+    richieste = [e.strip() for e in valore.split(",") if e.strip()]
+    sconosciute = sorted(set(richieste) - set(disponibili) - {CONTEGGI})
+    if sconosciute:
+        raise ValidationError({EXPAND_PARAM: f"Espansioni non disponibili: {', '.join(sconosciute)}."})
+    return list(dict.fromkeys(richieste))
+
+
+def _figli(modello, espansione: Espansione, request):
+    rel = modello._meta.get_field(espansione.relazione)
+    qs = rel.related_model.objects.all()
+    if espansione.filtra is not None:
+        qs = espansione.filtra(request, qs)
+    return rel, qs
+
+
+class EspansioniViewMixin:
+    """Da mettere prima di CampiSparsiViewMixin: `espansioni` = {nome: Espansione}."""
+
+    espansioni: dict = {}
+
+    def espansioni_attive(self) -> list[str]:
+        """Solo sulle letture: le risposte di create/update restano piatte."""
+        if not hasattr(self, "_espansioni_attive"):
+            lettura = self.request is not None and self.request.method in SAFE_METHODS
+            self._espansioni_attive = espansioni_richieste(self.request, self.espansioni) if lettura else []
+        return self._espansioni_attive
+
+    def colonne_sempre(self) -> set[str]:
+        # le FK da seguire con select_related non possono restare differite da .only()
+        colonne = super().colonne_sempre()
+        return colonne | {
+            self.espansioni[n].relazione for n in self.espansioni_attive()
+            if n in self.espansioni and not self.espansioni[n].many
+        }
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        attive = self.espansioni_attive()
+        for nome in attive:
+            if nome == CONTEGGI:
+                continue
+            espansione = self.espansioni[nome]
+            if not espansione.many:
+                qs = qs.select_related(espansione.relazione)
+                continue
+            _, figli = _figli(qs.model, espansione, self.request)
+            if espansione.ordinamento:
+                figli = figli.order_by(*espansione.ordinamento)
+            qs = qs.prefetch_related(Prefetch(espansione.relazione, queryset=figli))
+
+        if CONTEGGI in attive:
+            for espansione in self.espansioni.values():
+                if not espansione.conteggio:
+                    continue
+                rel, figli = _figli(qs.model, espansione, self.request)
+                fk = rel.field.name
+                conteggio = (
+                    figli.filter(**{fk: OuterRef("pk")}).order_by().values(fk).annotate(n=Count("pk")).values("n")
+                )
+                qs = qs.annotate(**{espansione.conteggio: Coalesce(Subquery(conteggio), 0)})
+        return qs
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["espansioni"] = self.espansioni_attive()
+        return context
+
+
+class EspansioniSerializerMixin:
+    """Aggiunge i campi annidati / conteggi richiesti con ?expand= (dopo il filtro ?fields=)."""
+
+    espansioni: dict = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        attive = self.context.get("espansioni", ())
+        for nome in attive:
+            if nome == CONTEGGI:
+                continue
+            espansione = self.espansioni[nome]
+            sorgente = {"source": espansione.relazione} if espansione.relazione != espansione.campo else {}
+            self.fields[espansione.campo] = espansione.serializer(many=espansione.many, read_only=True, **sorgente)
+        if CONTEGGI in attive:
+            for espansione in self.espansioni.values():
+                if espansione.conteggio:
+                    self.fields[espansione.conteggio] = serializers.IntegerField(read_only=True)
@@ -0,0 +1,131 @@
+# crm/api/paginazione.py
+"""
+Paginazione a cursore e campi sparsi per l'API.
+
+- PaginazioneCursore: keyset su (colonna di ordinamento, id) tramite crm.paginazione,
+  niente OFFSET né COUNT(*). ?cursor=... per spostarsi, ?page_size=N (max 200).
+- ?fields=a,b,c: il serializer espone solo quei campi e il queryset legge solo
+  le colonne necessarie (.only()).
+"""
+from __future__ import annotations
+
+from rest_framework import filters
+from rest_framework.pagination import BasePagination
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from crm.paginazione import pagina_keyset
+
+
+def ordinamento_keyset(request, queryset, view) -> list[str]:
+    """
+    Ordinamento della lista: quello di ?ordering= (se la view usa OrderingFilter)
+    oppure `view.ordinamento_keyset`; in coda l'id come spareggio univoco.
+    """
+    ordinamento = None
+    if any(issubclass(b, filters.OrderingFilter) for b in getattr(view, "filter_backends", [])):
+        if request.query_params.get(filters.OrderingFilter.ordering_param):
+            ordinamento = filters.OrderingFilter().get_ordering(request, queryset, view)
+    ordinamento = list(ordinamento or getattr(view, "ordinamento_keyset", ["-id"]))
+    if not any(o.lstrip("-") in ("id", "pk") for o in ordinamento):
+        ordinamento.append("-id" if ordinamento[0].startswith("-") else "id")
+    return ordinamento
+
+
+class PaginazioneCursore(BasePagination):
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = "page_size"
+    cursor_query_param = "cursor"
+
+    def get_page_size(self, request) -> int:
+        try:
+            richiesta = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(richiesta, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.pagina = pagina_keyset(
+            queryset,
+            ordinamento_keyset(request, queryset, view),
+            cursore=request.query_params.get(self.cursor_query_param),
+            per_page=self.get_page_size(request),
+        )
+        return list(self.pagina)
+
+    def _link(self, cursore):
+        if cursore is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursore)
+
+    def get_next_link(self):
+        return self._link(self.pagina.cursore_succ)
+
+    def get_previous_link(self):
+        return self._link(self.pagina.cursore_prec)
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+# ==============================
+# ?fields= (campi sparsi)
+# ==============================
+
+FIELDS_PARAM = "fields"
+
+
+def campi_richiesti(request) -> set[str] | None:
+    """Campi chiesti con ?fields=a,b (solo letture); None = tutti."""
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    valore = request.query_params.get(FIELDS_PARAM, "")
+    campi = {c.strip() for c in valore.split(",") if c.strip()}
+    return campi or None
+
+
+class CampiSparsiSerializerMixin:
+    """Da mettere prima di ModelSerializer: toglie i campi non richiesti (id resta sempre)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        campi = campi_richiesti(self.context.get("request"))
+        if campi:
+            for nome in set(self.fields) - campi - {"id"}:
+                self.fields.pop(nome)
+
+
+class CampiSparsiViewMixin:
+    """Con ?fields= carica solo le colonne che servono (campi richiesti + ordinamento + pk)."""
+
+    def colonne_sempre(self) -> set[str]:
+        """Colonne da caricare comunque (le sottoclassi/mixin possono aggiungerne)."""
+        return set()
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        campi = campi_richiesti(self.request)
+        if not campi:
+            return qs
+        concreti = {f.name for f in qs.model._meta.concrete_fields}
+        ordinamento = {o.lstrip("-") for o in ordinamento_keyset(self.request, qs, self)}
+        colonne = (campi | ordinamento | self.colonne_sempre()) & concreti
+        return qs.only("pk", *sorted(colonne))
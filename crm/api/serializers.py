@@ -1,12 +1,113 @@
 from rest_framework import serializers
-from crm.models import Cliente, Lead
+from crm.models import Cliente, Consulente, DocumentoCliente, Lead, Nota, Pratiche, chiave_naturale_lead
+from crm.ruoli import is_admin
+from .espansioni import Espansione, EspansioniSerializerMixin
+from .paginazione import CampiSparsiSerializerMixin
+
+
+# --- Modelli annidati (solo lettura, per ?expand=) ---
+
+class ConsulenteSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Consulente
+        fields = ("id", "nome", "is_active")
+
+
+class DocumentoSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DocumentoCliente
+        fields = ("id", "categoria", "descrizione", "file", "caricato_il")
+
+
+class PraticaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Pratiche
+        fields = ("id", "titolo", "descrizione", "importo", "pratica_attiva", "data_creazione", "aggiornata_il")
+
+
+class NotaSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Nota
+        fields = ("id", "autore", "testo", "creata_il")
+
+
+def _documenti_visibili(request, qs):
+    # "Privato Admin" solo per gli admin, come nella scheda cliente
+    if request is None or not is_admin(request.user):
+        qs = qs.exclude(categoria=DocumentoCliente.Categoria.CONTRATTI)
+    return qs
+
+
+# `note` è già un campo di Cliente: le note operatori annidate escono come `note_entries`
+ESPANSIONI_CLIENTE = {
+    "consulente": Espansione("consulente", ConsulenteSerializer, "consulente"),
+    "documenti": Espansione(
+        "documenti", DocumentoSerializer, "documenti", many=True,
+        ordinamento=("-caricato_il",), conteggio="num_documenti", filtra=_documenti_visibili,
+    ),
+    "pratiche": Espansione(
+        "pratiche", PraticaSerializer, "pratiche", many=True,
+        ordinamento=("-data_creazione",), conteggio="num_pratiche",
+    ),
+    "note": Espansione(
+        "note_entries", NotaSerializer, "note_entries", many=True,
+        ordinamento=("-creata_il",), conteggio="num_note",
+    ),
+}
+
+
+class ClienteSerializer(EspansioniSerializerMixin, CampiSparsiSerializerMixin, serializers.ModelSerializer):
+    espansioni = ESPANSIONI_CLIENTE
 
-class ClienteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cliente
         fields = "__all__"
 
-class LeadSerializer(serializers.ModelSerializer):
+class LeadSerializer(CampiSparsiSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Lead
         fields = "__all__"
+
+
+class LeadUpsertListSerializer(serializers.ListSerializer):
+    """
+    Valida ogni riga per conto suo: le righe valide proseguono anche se altre hanno errori.
+    validated_data -> [(indice, dati)]; errori per riga in `errori_righe`.
+    Le righe la cui chiave naturale esiste già sono aggiornamenti: validazione parziale,
+    basta inviare la chiave e i campi da cambiare.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({"non_field_errors": ["Serve un array di lead."]})
+        if self.max_length is not None and len(data) > self.max_length:
+            raise serializers.ValidationError(
+                {"non_field_errors": [f"Al massimo {self.max_length} lead per richiesta."]}
+            )
+        chiavi = [
+            chiave_naturale_lead(str(riga.get("telefono") or ""), str(riga.get("email") or ""))
+            if isinstance(riga, dict) else None
+            for riga in data
+        ]
+        esistenti = set(
+            Lead.objects.filter(chiave_naturale__in={c for c in chiavi if c}).values_list("chiave_naturale", flat=True)
+        )
+        parziale = type(self.child)(partial=True, context=self.context)
+
+        self.errori_righe = {}
+        valide = []
+        for indice, riga in enumerate(data):
+            figlio = parziale if chiavi[indice] in esistenti else self.child
+            try:
+                valide.append((indice, figlio.run_validation(riga)))
+            except serializers.ValidationError as exc:
+                self.errori_righe[indice] = exc.detail
+        return valide
+
+
+class RichiamoSerializer(serializers.Serializer):
+    """Voce della coda richiami (vedi crm.services.richiami_in_scadenza)."""
+    tipo = serializers.CharField()
+    scadenza = serializers.DateTimeField()
+    scaduto = serializers.BooleanField()
+    lead = LeadSerializer()
@@ -0,0 +1,108 @@
+# crm/api/sincronizzazione.py
+"""
+Sincronizzazione incrementale per i client dell'API: GET .../changes/?since=<cursore>
+
+Risposta:
+  results   record creati/modificati dopo il cursore (stesso serializer della lista)
+  deleted   id da rimuovere: eliminati (tombstone Cancellazione) o usciti dal
+            queryset della view (es. lead archiviati)
+  since     cursore da ripassare alla chiamata successiva
+  has_more  True se restano altre modifiche: richiamare subito con il nuovo cursore
+
+Senza `since` si parte dall'inizio (sincronizzazione completa a blocchi).
+I tombstone durano CANCELLAZIONI_RETENTION_GIORNI (comando pulisci_cancellazioni):
+un cursore emesso prima di allora riceve 410 e il client deve ripartire senza `since`.
+Le modifiche degli ultimi SYNC_MARGINE secondi vengono lasciate alla chiamata
+successiva: un salvataggio con timestamp già assegnato ma non ancora committato
+non va perso dietro al cursore.
+"""
+from __future__ import annotations
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from crm.models import Cancellazione
+from crm.paginazione import codifica_cursore, decodifica_cursore, pagina_keyset
+
+SYNC_MARGINE = timedelta(seconds=5)
+SYNC_PAGE_SIZE = 200
+SYNC_MAX_PAGE_SIZE = 1000
+
+
+class CursoreScaduto(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = "Cursore più vecchio della retention delle cancellazioni: sincronizzare da capo (senza since)."
+    default_code = "cursore_scaduto"
+
+
+class SincronizzazioneMixin:
+    """Aggiunge l'azione `changes` a un ModelViewSet con campo `aggiornato_il`."""
+
+    campo_aggiornamento = "aggiornato_il"
+
+    @action(detail=False, methods=["get"], url_path="changes")
+    def changes(self, request):
+        cursore_mod, cursore_canc = self._leggi_since(request.query_params.get("since"))
+        try:
+            per_page = int(request.query_params.get("page_size", SYNC_PAGE_SIZE))
+        except (TypeError, ValueError):
+            per_page = SYNC_PAGE_SIZE
+        per_page = max(1, min(per_page, SYNC_MAX_PAGE_SIZE))
+
+        modello = self.get_queryset().model
+        limite = timezone.now() - SYNC_MARGINE
+        campo = self.campo_aggiornamento
+
+        # 1) righe modificate, su tutta la tabella: quelle fuori dal queryset della view vanno tra le eliminate
+        chiavi = modello._default_manager.filter(**{f"{campo}__lte": limite}).only("pk", campo)
+        modificate = pagina_keyset(chiavi, [campo, "id"], cursore=cursore_mod, per_page=per_page)
+        ids = [obj.pk for obj in modificate]
+        visibili = {obj.pk: obj for obj in self.get_queryset().filter(pk__in=ids)}
+        results = self.get_serializer([visibili[pk] for pk in ids if pk in visibili], many=True).data
+        deleted = [pk for pk in ids if pk not in visibili]
+
+        # 2) tombstone
+        tombstone = Cancellazione.objects.filter(
+            modello=modello._meta.label_lower, eliminato_il__lte=limite,
+        ).only("id", "oggetto_id", "eliminato_il")
+        cancellate = pagina_keyset(tombstone, ["eliminato_il", "id"], cursore=cursore_canc, per_page=per_page)
+        deleted += [c.oggetto_id for c in cancellate]
+
+        if modificate.oggetti:
+            ultima = modificate.oggetti[-1]
+            cursore_mod = codifica_cursore([getattr(ultima, campo), ultima.pk])
+        if cancellate.oggetti:
+            ultima = cancellate.oggetti[-1]
+            cursore_canc = codifica_cursore([ultima.eliminato_il, ultima.pk])
+
+        return Response({
+            "results": results,
+            "deleted": deleted,
+            # con l'ora di emissione: dopo la retention i tombstone intermedi possono non esserci più
+            "since": codifica_cursore([cursore_mod, cursore_canc, limite]),
+            "has_more": modificate.ha_succ or cancellate.ha_succ,
+        })
+
+    @staticmethod
+    def _leggi_since(since):
+        if not since:
+            return None, None
+        decodificato = decodifica_cursore(since)
+        # 2 valori: cursori emessi prima che contenessero l'ora di emissione, accettati così come sono
+        if not decodificato or len(decodificato[0]) not in (2, 3):
+            raise ValidationError({"since": "Cursore non valido."})
+        cursore_mod, cursore_canc, *emesso = decodificato[0]
+        if emesso:
+            emesso_il = parse_datetime(str(emesso[0]))
+            if emesso_il is None:
+                raise ValidationError({"since": "Cursore non valido."})
+            if emesso_il < timezone.now() - timedelta(days=settings.CANCELLAZIONI_RETENTION_GIORNI):
+                raise CursoreScaduto()
+        return cursore_mod, cursore_canc
@@ -0,0 +1,90 @@
+# crm/api/throttling.py
+"""
+Limiti di richieste per l'API: token bucket per utente (o IP se anonimo) e per endpoint,
+con lo stato nella cache di Django.
+
+Tassi in REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"], formato DRF "N/periodo":
+N è la capienza del secchio, che si ricarica di N gettoni per periodo.
+Chiavi cercate nell'ordine: "<scope>:<ruolo>", "<scope>", "<ruolo>", "default"
+(scope = `throttle_scope` della view, ruolo = admin/operatore/legale/anonimo).
+
+Gli anonimi sono identificati dall'IP secondo REST_FRAMEWORK["NUM_PROXIES"]
+(variabile API_NUM_PROXIES): con None DRF userebbe X-Forwarded-For così come
+arriva, e un client potrebbe cambiare secchio a ogni richiesta.
+
+Ogni richiesta consuma `throttle_costi[azione]` gettoni (default 1) più
+`throttle_costo_ricerca` se usa ?search=. Se il secchio è vuoto: 429 con Retry-After.
+Get/set sulla cache non sono atomici: con molte richieste concorrenti dello stesso
+utente il limite è approssimato per eccesso di poche unità.
+"""
+from __future__ import annotations
+
+import math
+import time
+
+from django.core.cache import cache as default_cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from crm.ruoli import ruolo_utente
+
+PERIODI = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def leggi_tasso(tasso: str | None) -> tuple[float, float] | None:
+    """"120/min" -> (capienza 120, ricarica 2 gettoni/s); None = senza limite."""
+    if not tasso:
+        return None
+    numero, periodo = tasso.split("/")
+    capienza = float(numero)
+    return capienza, capienza / PERIODI[periodo[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    cache = default_cache
+    scope_predefinito = "api"
+
+    def allow_request(self, request, view):
+        identita, ruolo = self._identita(request)
+        scope = getattr(view, "throttle_scope", None) or self.scope_predefinito
+        tasso = self._tasso(scope, ruolo)
+        if tasso is None:
+            return True
+        capienza, ricarica = tasso
+        costo = min(self._costo(request, view), capienza)
+
+        chiave = f"crm:throttle:{scope}:{identita}"
+        ora = time.time()
+        gettoni, ultimo = self.cache.get(chiave, (capienza, ora))
+        gettoni = min(capienza, gettoni + (ora - ultimo) * ricarica)
+        if gettoni < costo:
+            self.attesa = (costo - gettoni) / ricarica
+            return False
+        # scade quando il secchio sarebbe comunque tornato pieno
+        self.cache.set(chiave, (gettoni - costo, ora), math.ceil(capienza / ricarica) + 1)
+        return True
+
+    def wait(self):
+        return getattr(self, "attesa", None)
+
+    def _identita(self, request) -> tuple[str, str]:
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            ruolo = "admin" if user.is_superuser else (ruolo_utente(user) or "operatore")
+            return f"u{user.pk}", ruolo
+        return f"ip{self.get_ident(request)}", "anonimo"
+
+    @staticmethod
+    def _tasso(scope: str, ruolo: str):
+        tassi = api_settings.DEFAULT_THROTTLE_RATES or {}
+        for chiave in (f"{scope}:{ruolo}", scope, ruolo, "default"):
+            if chiave in tassi:
+                return leggi_tasso(tassi[chiave])
+        return None
+
+    @staticmethod
+    def _costo(request, view) -> int:
+        costo = getattr(view, "throttle_costi", {}).get(getattr(view, "action", None), 1)
+        if request.query_params.get(api_settings.SEARCH_PARAM):
+            costo += getattr(view, "throttle_costo_ricerca", 0)
+        return costo
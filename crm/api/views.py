@@ -1,25 +1,52 @@
 from rest_framework import viewsets, filters, permissions, status
+from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView as _TokenRefreshView
 from crm.models import Cliente, Lead
-from .serializers import ClienteSerializer, LeadSerializer
+from crm.ruoli import ruolo_utente
+from crm.services import parametri_richiami, richiami_in_scadenza, upsert_lead
+from crm.versioni import FIGLI_CLIENTE, FIGLI_LEAD, VersioneAPIMixin
+from .espansioni import EspansioniViewMixin
+from .paginazione import CampiSparsiViewMixin
+from .serializers import ESPANSIONI_CLIENTE, ClienteSerializer, LeadSerializer, LeadUpsertListSerializer, RichiamoSerializer
+from .sincronizzazione import SincronizzazioneMixin
+
+
+# Righe massime per POST /api/leads/bulk/
+LEAD_BULK_MAX = 5000
+
+
+# Login e refresh JWT con limite dedicato (scope "token") contro i tentativi a raffica
+class TokenView(TokenObtainPairView):
+    throttle_scope = "token"
+
+
+class TokenRefreshView(_TokenRefreshView):
+    throttle_scope = "token"
 
 
 class IsOperatore(permissions.BasePermission):
     def has_permission(self, request, view):
         u = request.user
-        return u.is_authenticated and (
-            hasattr(u, "profiloutente") and u.profiloutente.ruolo in ["operatore", "admin"]
-        )
+        return u.is_authenticated and ruolo_utente(u) in ["operatore", "admin"]
 
 
-class ClienteViewSet(viewsets.ModelViewSet):
+class ClienteViewSet(
+    VersioneAPIMixin, SincronizzazioneMixin, EspansioniViewMixin, CampiSparsiViewMixin, viewsets.ModelViewSet,
+):
     queryset = Cliente.objects.all()
     serializer_class = ClienteSerializer
     permission_classes = [permissions.IsAuthenticated]
+    ordinamento_keyset = ["-data_creazione", "-id"]
+    figli_versione = FIGLI_CLIENTE
+    # ?expand=consulente,documenti,pratiche,note,conteggi
+    espansioni = ESPANSIONI_CLIENTE
+    throttle_scope = "clienti"
+    throttle_costi = {"changes": 5}
+    throttle_costo_ricerca = 5
 
     def destroy(self, request, *args, **kwargs):
-        prof = getattr(request.user, "profiloutente", None)
-        if not prof or prof.ruolo != "admin":
+        if ruolo_utente(request.user) != "admin":
             return Response(
                 {"detail": "Solo gli admin possono eliminare clienti."},
                 status=status.HTTP_403_FORBIDDEN,
@@ -27,10 +54,54 @@ class ClienteViewSet(viewsets.ModelViewSet):
         return super().destroy(request, *args, **kwargs)
 
 
-class LeadViewSet(viewsets.ModelViewSet):
+class LeadViewSet(VersioneAPIMixin, SincronizzazioneMixin, CampiSparsiViewMixin, viewsets.ModelViewSet):
     queryset = Lead.objects.filter(is_archiviato=False).order_by("-creato_il")
     serializer_class = LeadSerializer
     permission_classes = [IsOperatore]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ["nome", "cognome", "email", "telefono"]
     ordering_fields = ["nome", "cognome", "creato_il", "stato"]
+    ordinamento_keyset = ["-creato_il", "-id"]
+    figli_versione = FIGLI_LEAD
+    throttle_scope = "leads"
+    # ?search= fa icontains su quattro colonne; il bulk vale fino a 5000 righe
+    throttle_costi = {"changes": 5, "bulk": 50}
+    throttle_costo_ricerca = 5
+
+    @action(detail=False, methods=["get"])
+    def richiami(self, request):
+        """
+        GET /api/leads/richiami/?minuti=30&consulente=<id>
+        Lead con richiamo/appuntamento in scadenza, ordinati per scadenza.
+        Niente long-poll qui, di proposito: le view DRF sono sincrone e un'attesa di 25 s
+        terrebbe occupato un thread per client; i client API interrogano a intervalli
+        (la pagina HTML usa il long-poll async di lead_richiami_attendi).
+        """
+        richiami = richiami_in_scadenza(**parametri_richiami(request.query_params))
+        return Response(RichiamoSerializer(richiami, many=True).data)
+
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk(self, request):
+        """
+        POST /api/leads/bulk/  [ {...lead...}, ... ]
+        Upsert sulla chiave naturale (telefono normalizzato, altrimenti email).
+        Risponde con un esito per riga, nello stesso ordine dell'input.
+        """
+        serializer = LeadUpsertListSerializer(
+            child=LeadSerializer(), data=request.data, max_length=LEAD_BULK_MAX,
+            context=self.get_serializer_context(),
+        )
+        serializer.is_valid(raise_exception=True)
+        valide = serializer.validated_data
+
+        esiti = [None] * (len(valide) + len(serializer.errori_righe))
+        for indice, errori in serializer.errori_righe.items():
+            esiti[indice] = {"status": "error", "errors": errori}
+        for (indice, _), esito in zip(valide, upsert_lead([dati for _, dati in valide])):
+            esiti[indice] = esito
+
+        conteggi = {"created": 0, "updated": 0, "skipped": 0, "error": 0}
+        for indice, esito in enumerate(esiti):
+            esito["index"] = indice
+            conteggi[esito["status"]] += 1
+        return Response({"results": esiti, **conteggi})
@@ -0,0 +1,92 @@
+# crm/cache.py
+"""
+Cache applicativa: chiavi per namespace con invalidazione a versione.
+
+Ogni namespace (es. "consulenti", "notifiche", "lead") ha un numero di versione in
+cache; le chiavi lo includono, quindi `invalida(ns)` rende vecchie in un colpo
+tutte le voci del namespace senza doverle elencare (scadono da sole col TTL).
+
+    consulenti = ricorda("consulenti", "attivi", calcola=lambda: list(qs))
+    invalida_dopo_commit("consulenti")     # nei signal / servizi che scrivono
+
+Il backend è quello di settings.CACHES (vedi CACHE_URL): con più worker serve
+una cache condivisa (file o Redis), altrimenti ogni processo invalida solo la propria.
+Senza `timeout` esplicito le voci durano il TIMEOUT del backend (CACHE_TTL).
+"""
+from __future__ import annotations
+
+import time
+from functools import wraps
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+PREFISSO = "crm"
+
+# distingue "non in cache" da un valore None memorizzato
+_ASSENTE = object()
+
+
+def _chiave_versione(namespace: str) -> str:
+    return f"{PREFISSO}:ns:{namespace}"
+
+
+def versione(namespace: str) -> int:
+    chiave = _chiave_versione(namespace)
+    v = cache.get(chiave)
+    if v is None:
+        # parte dall'orologio: se la chiave versione viene espulsa, le voci
+        # scritte con la versione precedente non tornano valide
+        cache.add(chiave, int(time.time() * 1000), None)
+        v = cache.get(chiave)
+    return v
+
+
+def chiave(namespace: str, *parti) -> str:
+    return f"{PREFISSO}:{namespace}:v{versione(namespace)}:" + ":".join(str(p) for p in parti)
+
+
+def ricorda(namespace: str, *parti, calcola, timeout=DEFAULT_TIMEOUT):
+    """Valore in cache per (namespace, parti); se manca lo calcola e lo salva."""
+    k = chiave(namespace, *parti)
+    valore = cache.get(k, _ASSENTE)
+    if valore is _ASSENTE:
+        valore = calcola()
+        cache.set(k, valore, timeout)
+    return valore
+
+
+def memorizzata(namespace: str, timeout=DEFAULT_TIMEOUT):
+    """Decoratore: memorizza il risultato per argomenti posizionali (hashabili e stampabili)."""
+
+    def decoratore(funzione):
+        @wraps(funzione)
+        def wrapper(*args):
+            return ricorda(namespace, funzione.__name__, *args, calcola=lambda: funzione(*args), timeout=timeout)
+
+        wrapper.senza_cache = funzione
+        return wrapper
+
+    return decoratore
+
+
+def cache_condivisa() -> bool:
+    """False con la cache in memoria (o dummy): ogni processo ha la sua e non vede le invalidazioni degli altri."""
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+def invalida(*namespaces: str) -> None:
+    for namespace in namespaces:
+        try:
+            cache.incr(_chiave_versione(namespace))
+        except ValueError:
+            # versione mai letta o espulsa: la prossima lettura ne crea una nuova
+            pass
+
+
+def invalida_dopo_commit(*namespaces: str) -> None:
+    """Da usare dentro le scritture: prima del commit gli altri processi leggerebbero ancora i dati vecchi."""
+    transaction.on_commit(lambda: invalida(*namespaces))
@@ -0,0 +1,80 @@
+# crm/calendario.py
+"""
+Feed iCalendar (RFC 5545) degli appuntamenti per consulente.
+Generato a mano: ci servono solo VEVENT semplici, niente dipendenze extra.
+"""
+from __future__ import annotations
+
+from datetime import timedelta, timezone as dt_timezone
+
+DURATA_APPUNTAMENTO = timedelta(hours=1)
+
+
+def _escape(testo: str) -> str:
+    return (
+        (testo or "")
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def _piega(riga: str) -> str:
+    """Spezza le righe oltre 75 ottetti (continuazione = CRLF + spazio)."""
+    raw = riga.encode("utf-8")
+    if len(raw) <= 75:
+        return riga
+    parti = []
+    while raw:
+        limite = 75 if not parti else 74
+        taglio = raw[:limite]
+        # non spezzare un carattere UTF-8 multi-byte
+        while taglio and (raw[len(taglio):len(taglio) + 1] or b"\x00")[0] & 0xC0 == 0x80:
+            taglio = taglio[:-1]
+        parti.append(taglio.decode("utf-8"))
+        raw = raw[len(taglio):]
+    return "\r\n ".join(parti)
+
+
+def _utc(dt) -> str:
+    return dt.astimezone(dt_timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def genera_ics(consulente, leads, *, dominio: str, url_lead=None) -> str:
+    """
+    VCALENDAR con un VEVENT per ogni lead con appuntamento_previsto.
+    `url_lead(lead)` (opzionale) restituisce l'URL assoluto della scheda lead.
+    """
+    righe = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Debiti Stop//Appuntamenti//IT",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(f'Appuntamenti {consulente.nome}')}",
+    ]
+    for lead in leads:
+        inizio = lead.appuntamento_previsto
+        nome = f"{lead.nome or ''} {lead.cognome or ''}".strip() or f"Lead #{lead.pk}"
+        dettagli = [
+            f"Telefono: {lead.telefono}" if lead.telefono else "",
+            f"Email: {lead.email}" if lead.email else "",
+            f"Stato: {lead.get_stato_operativo_display()}",
+        ]
+        righe += [
+            "BEGIN:VEVENT",
+            f"UID:lead-{lead.pk}-appuntamento@{dominio}",
+            f"DTSTAMP:{_utc(lead.aggiornato_il)}",
+            f"LAST-MODIFIED:{_utc(lead.aggiornato_il)}",
+            f"DTSTART:{_utc(inizio)}",
+            f"DTEND:{_utc(inizio + DURATA_APPUNTAMENTO)}",
+            f"SUMMARY:{_escape(f'Consulenza: {nome}')}",
+            f"DESCRIPTION:{_escape(chr(10).join(d for d in dettagli if d))}",
+        ]
+        if url_lead:
+            righe.append(f"URL:{url_lead(lead)}")
+        righe.append("END:VEVENT")
+    righe.append("END:VCALENDAR")
+    return "\r\n".join(_piega(r) for r in righe) + "\r\n"
@@ -1,5 +1,8 @@
 # crea la Notifica per la Sidebar
-from .models import Notifica
+from .costanti import STATO_SLUG_MAP
+from .eventi import sse_attivo
+from .ruoli import is_admin, ruolo_utente
+from .services import conta_notifiche_non_lette, conteggi_lead_per_stato, marca_stato_lettura, notifiche_recenti
 
 
 # Slug URL -> (slug, label) per sidebar Lead – positivi sopra, negativi sotto, "Attività non di competenza" ultima
@@ -19,17 +22,25 @@ SIDEBAR_LEAD_STATI = [
 ]
 
 
+def stati_lead_con_conteggi() -> list[tuple[str, str, int]]:
+    """(slug, label, numero di lead) per la sidebar; conteggi da un GROUP BY in cache."""
+    conteggi = conteggi_lead_per_stato()
+    return [(slug, label, conteggi.get(STATO_SLUG_MAP[slug], 0)) for slug, label in SIDEBAR_LEAD_STATI]
+
+
 def notifiche_sidebar(request):
     """
     Espone:
-      - notifiche_sidebar: le ultime 10 notifiche ordinate per data
-      - notifiche_unread_count: conteggio non lette
+      - notifiche_sidebar: le ultime 10 notifiche (lista in cache), con `letta` per l'utente corrente
+      - notifiche_unread_count: conteggio non lette dell'utente corrente
+      - sidebar_lead_stati: (slug, label, conteggio) degli stati lead
+      - sse_attivo: se aprire il canale eventi (solo sotto ASGI)
     """
     if not request.user.is_authenticated:
-        return {"sidebar_lead_stati": SIDEBAR_LEAD_STATI}
+        return {"sidebar_lead_stati": [(slug, label, None) for slug, label in SIDEBAR_LEAD_STATI]}
     try:
-        qs = Notifica.objects.order_by("-created_at")[:10]
-        unread = Notifica.objects.filter(is_read=False).count()
+        qs = marca_stato_lettura(request.user, notifiche_recenti(10))
+        unread = conta_notifiche_non_lette(request.user)
     except Exception:
         qs = []
         unread = 0
@@ -37,5 +48,15 @@ def notifiche_sidebar(request):
     return {
         "notifiche_sidebar": qs,
         "notifiche_unread_count": unread,
-        "sidebar_lead_stati": SIDEBAR_LEAD_STATI,
-    }
\ No newline at end of file
+        "sidebar_lead_stati": stati_lead_con_conteggi(),
+        "sse_attivo": sse_attivo(request),
+    }
+
+
+def ruolo(request):
+    """Ruolo dell'utente per i template, senza rileggere ProfiloUtente (vedi crm/ruoli.py)."""
+    user = getattr(request, "user", None)
+    return {
+        "ruolo_utente": ruolo_utente(user),
+        "utente_is_admin": is_admin(user),
+    }
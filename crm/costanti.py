@@ -0,0 +1,18 @@
+# crm/costanti.py
+"""Costanti condivise tra view e context processor (qui per non importare crm.views dai template)."""
+
+# Slug URL -> stato_operativo Lead (lead_lista_stato, sidebar)
+STATO_SLUG_MAP = {
+    "nuovo": "nuovo",
+    "no-risposta": "no_risposta",
+    "segreteria": "segreteria",
+    "non-fascia-oraria": "non_fascia_oraria",
+    "ha-staccato-lui": "ha_staccato_lui",
+    "consulenza-effettuata": "consulenza_eff",
+    "attesa-contatti": "attesa_contatti",
+    "non-contattare": "non_contattare",
+    "numero-errato": "numero_errato",
+    "blocco-chiamate": "blocco_chiamate",
+    "cliente-non-interessato": "cliente_non_interessato",
+    "non-competenza": "non_competenza",
+}
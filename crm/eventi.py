@@ -0,0 +1,101 @@
+# crm/eventi.py
+"""
+Broker pub/sub in-process per il canale Server-Sent Events.
+
+Ogni connessione SSE si iscrive con una coda asyncio legata al proprio event loop;
+`pubblica()` può essere chiamata da codice sincrono (signal, servizi, thread del
+threadpool ASGI) e consegna con call_soon_threadsafe. Una connessione ferma in
+attesa non costa query né CPU.
+
+Il broker vive nel processo: con più worker ogni processo consegna gli eventi
+generati al proprio interno.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import threading
+from dataclasses import dataclass, field
+
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+CODA_MAX = 100
+
+
+def sse_attivo(request) -> bool:
+    """Il canale eventi funziona solo sotto ASGI: lì lo stream async viene inviato man mano."""
+    return isinstance(request, ASGIRequest)
+
+
+@dataclass(frozen=True)
+class Evento:
+    id: int
+    tipo: str
+    dati: dict
+
+    def sse(self) -> str:
+        """Formato text/event-stream (una riga data: con il JSON)."""
+        payload = json.dumps(self.dati, cls=DjangoJSONEncoder, separators=(",", ":"))
+        return f"id: {self.id}\nevent: {self.tipo}\ndata: {payload}\n\n"
+
+
+@dataclass(eq=False)
+class Iscrizione:
+    loop: asyncio.AbstractEventLoop
+    coda: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=CODA_MAX))
+
+    def _consegna(self, evento: Evento) -> None:
+        # client lento: si perde l'evento più vecchio, non si blocca chi pubblica
+        if self.coda.full():
+            self.coda.get_nowait()
+        self.coda.put_nowait(evento)
+
+    async def prossimo(self, timeout: float) -> Evento | None:
+        try:
+            return await asyncio.wait_for(self.coda.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._iscrizioni: set[Iscrizione] = set()
+        self._sequenza = itertools.count(1)
+
+    def iscrivi(self) -> Iscrizione:
+        """Da chiamare dentro l'event loop della connessione."""
+        iscrizione = Iscrizione(loop=asyncio.get_running_loop())
+        with self._lock:
+            self._iscrizioni.add(iscrizione)
+        return iscrizione
+
+    def disiscrivi(self, iscrizione: Iscrizione) -> None:
+        with self._lock:
+            self._iscrizioni.discard(iscrizione)
+
+    @property
+    def connessioni(self) -> int:
+        return len(self._iscrizioni)
+
+    def pubblica(self, tipo: str, dati: dict) -> None:
+        evento = Evento(id=next(self._sequenza), tipo=tipo, dati=dati)
+        with self._lock:
+            iscrizioni = list(self._iscrizioni)
+        for iscrizione in iscrizioni:
+            try:
+                iscrizione.loop.call_soon_threadsafe(iscrizione._consegna, evento)
+            except RuntimeError:
+                # loop chiuso: connessione morta senza passare dal finally
+                self.disiscrivi(iscrizione)
+
+
+broker = Broker()
+
+
+def pubblica_dopo_commit(tipo: str, dati: dict) -> None:
+    """Pubblica solo a transazione confermata (niente eventi per righe poi annullate)."""
+    transaction.on_commit(lambda: broker.pubblica(tipo, dati))
@@ -1,6 +1,9 @@
 from django import forms
+from django.core.exceptions import ValidationError
+from django.forms.models import ModelChoiceIterator
 from django.forms.widgets import ClearableFileInput  
-from .models import Cliente, DocumentoCliente, Pratiche, Nota, Lead, Consulente, SchedaConsulenza
+from .models import Cliente, DocumentoCliente, Pratiche, Nota, Lead, SchedaConsulenza
+from .riferimenti import RIFERIMENTI, elenco
 
 
 # ===== Widget per upload multiplo =====
@@ -9,6 +12,54 @@ class MultiFileInput(ClearableFileInput):
     allow_multiple_selected = True
 
 
+# ===== Scelte dai dati di riferimento in cache (crm/riferimenti.py) =====
+class RiferimentoChoiceIterator(ModelChoiceIterator):
+    """Come ModelChoiceIterator, ma sulla lista in cache invece che sul queryset."""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in elenco(self.field.riferimento):
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(elenco(self.field.riferimento)) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(elenco(self.field.riferimento))
+
+
+class RiferimentoChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField per i dati di riferimento: il render non interroga il DB, la
+    validazione nemmeno se la cache è condivisa (vedi riferimenti.elenco). Le sottoclassi indicano `riferimento` (chiave di RIFERIMENTI);
+    si usa da Meta.field_classes.
+    """
+    iterator = RiferimentoChoiceIterator
+    riferimento = ""
+
+    def __init__(self, queryset=None, **kwargs):
+        # il queryset resta coerente con l'elenco (admin, has_changed, ...)
+        super().__init__(RIFERIMENTI[self.riferimento].queryset(), **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        chiave = self.to_field_name or "pk"
+        if isinstance(value, self.queryset.model):
+            value = getattr(value, chiave)
+        for obj in elenco(self.riferimento, convalida=True):
+            if str(getattr(obj, chiave)) == str(value):
+                return obj
+        raise ValidationError(
+            self.error_messages["invalid_choice"], code="invalid_choice", params={"value": value}
+        )
+
+
+class ConsulenteAttivoField(RiferimentoChoiceField):
+    riferimento = "consulenti_attivi"
+
+
 # =========================
 # Cliente
 # =========================
@@ -38,12 +89,12 @@ class ClienteForm(forms.ModelForm):
             "documenti_inviati": forms.CheckboxInput(attrs={"class": "toggle toggle-primary"}),
             "perizia_inviata": forms.CheckboxInput(attrs={"class": "toggle toggle-primary"}),
         }
+        field_classes = {"consulente": ConsulenteAttivoField}
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         field = self.fields.get("consulente")
         if field is not None:
-            field.queryset = Consulente.objects.filter(is_active=True).order_by("nome")
             field.required = False
             field.empty_label = "Seleziona consulente"
 
@@ -164,13 +215,13 @@ class LeadForm(forms.ModelForm):
                 attrs={"type": "text", "class": "input input-bordered w-full", "placeholder": "Data e Ora"}
             ),
         }
+        field_classes = {"consulente": ConsulenteAttivoField}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         field = self.fields.get("consulente")
         if field is not None:
-            field.queryset = Consulente.objects.filter(is_active=True).order_by("nome")
             field.required = False
 
         for fname in ("nome", "cognome"):
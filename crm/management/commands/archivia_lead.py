@@ -0,0 +1,34 @@
+# crm/management/commands/archivia_lead.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from crm.services import archivia_lead, lead_archiviabili
+
+
+class Command(BaseCommand):
+    help = (
+        "Sposta in archivio (LeadArchivio/NotaLeadArchivio) i lead archiviati, convertiti "
+        "o negativi non modificati da almeno N giorni, con le loro note."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--giorni", type=int, default=settings.LEAD_ARCHIVIO_GIORNI,
+            help="Età minima in giorni dall'ultima modifica (default: LEAD_ARCHIVIO_GIORNI).",
+        )
+        parser.add_argument("--batch", type=int, default=500, help="Lead per transazione.")
+        parser.add_argument("--dry-run", action="store_true", help="Conta soltanto, non sposta nulla.")
+
+    def handle(self, *args, giorni, batch, dry_run, **options):
+        prima_di = timezone.now() - timedelta(days=giorni)
+
+        if dry_run:
+            n = lead_archiviabili(prima_di).count()
+            self.stdout.write(f"{n} lead da archiviare (modificati prima del {prima_di:%d/%m/%Y}).")
+            return
+
+        n_lead, n_note = archivia_lead(prima_di=prima_di, batch=max(1, batch))
+        self.stdout.write(self.style.SUCCESS(f"Archiviati {n_lead} lead e {n_note} note."))
@@ -0,0 +1,103 @@
+# crm/management/commands/prova_carico_client_lenti.py
+import asyncio
+import ssl
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Prova di carico: apre N connessioni concorrenti verso un URL e le tiene aperte "
+        "leggendo lentamente (client lenti). Misura quante ne regge un singolo processo "
+        "(es. /eventi/ o lo zip documenti sotto ASGI)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="URL completo, es. http://127.0.0.1:8000/eventi/")
+        parser.add_argument("--connessioni", type=int, default=200, help="Client concorrenti.")
+        parser.add_argument("--durata", type=float, default=30.0, help="Secondi per cui tenere aperta ogni connessione.")
+        parser.add_argument("--byte-al-secondo", type=int, default=512, help="Velocità di lettura di ogni client.")
+        parser.add_argument("--cookie", default="", help="Header Cookie, es. 'sessionid=...'.")
+
+    def handle(self, *args, url, connessioni, durata, byte_al_secondo, cookie, **options):
+        parti = urlsplit(url)
+        if parti.scheme not in ("http", "https") or not parti.hostname:
+            raise CommandError("URL non valido: serve http(s)://host[:porta]/percorso")
+
+        risultati = asyncio.run(self._prova(parti, max(1, connessioni), durata, max(1, byte_al_secondo), cookie))
+
+        ttfb = sorted(risultati["ttfb"])
+        righe = [
+            ("Connessioni richieste", connessioni),
+            ("Risposte ricevute", len(ttfb)),
+            (f"Tenute per {durata:g}s", risultati["tenute"]),
+            ("Chiuse dal server prima", risultati["chiuse"]),
+            ("Errori/timeout", risultati["errori"]),
+        ]
+        if risultati["stati"]:
+            righe.append(("Status HTTP", ", ".join(f"{k}: {v}" for k, v in sorted(risultati["stati"].items()))))
+        if ttfb:
+            p95 = ttfb[min(len(ttfb) - 1, int(len(ttfb) * 0.95))]
+            righe.append((
+                "Primo byte (s)",
+                f"mediana {statistics.median(ttfb):.3f} · p95 {p95:.3f} · max {ttfb[-1]:.3f}",
+            ))
+        for etichetta, valore in righe:
+            self.stdout.write(f"{etichetta + ':':<25}{valore}")
+
+    async def _prova(self, parti, connessioni, durata, byte_al_secondo, cookie):
+        risultati = {"ttfb": [], "tenute": 0, "chiuse": 0, "errori": 0, "stati": {}}
+        porta = parti.port or (443 if parti.scheme == "https" else 80)
+        contesto = ssl.create_default_context() if parti.scheme == "https" else None
+        percorso = parti.path or "/"
+        if parti.query:
+            percorso += f"?{parti.query}"
+        richiesta = (
+            f"GET {percorso} HTTP/1.1\r\nHost: {parti.netloc}\r\n"
+            "Accept: */*\r\nConnection: keep-alive\r\n"
+            + (f"Cookie: {cookie}\r\n" if cookie else "")
+            + "\r\n"
+        ).encode()
+
+        await asyncio.gather(*(
+            self._client(parti.hostname, porta, contesto, richiesta, durata, byte_al_secondo, risultati)
+            for _ in range(connessioni)
+        ))
+        return risultati
+
+    async def _client(self, host, porta, contesto, richiesta, durata, byte_al_secondo, risultati):
+        inizio = time.monotonic()
+        fine = inizio + durata
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, porta, ssl=contesto), 10)
+            writer.write(richiesta)
+            await writer.drain()
+
+            riga = await asyncio.wait_for(reader.readline(), durata)
+            if not riga:
+                risultati["chiuse"] += 1
+                return
+            risultati["ttfb"].append(time.monotonic() - inizio)
+            stato = riga.split(b" ", 2)[1].decode() if riga.count(b" ") >= 1 else "?"
+            risultati["stati"][stato] = risultati["stati"].get(stato, 0) + 1
+
+            # client lento: pochi byte al secondo finché dura la prova
+            while (restante := fine - time.monotonic()) > 0:
+                try:
+                    blocco = await asyncio.wait_for(reader.read(byte_al_secondo), restante)
+                except asyncio.TimeoutError:
+                    break
+                if not blocco:
+                    risultati["chiuse"] += 1
+                    return
+                await asyncio.sleep(min(1.0, max(0.0, fine - time.monotonic())))
+            risultati["tenute"] += 1
+        except (OSError, asyncio.TimeoutError):
+            risultati["errori"] += 1
+        finally:
+            if writer is not None:
+                writer.close()
@@ -0,0 +1,76 @@
+# crm/management/commands/prova_scala_ricerca.py
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from crm import ricerca
+from crm.cache import invalida
+from crm.models import Lead
+
+NOMI = ["Mario", "Marco", "Maria", "Luca", "Giulia", "Anna", "Paolo", "Martina", "Matteo", "Marta"]
+COGNOMI = ["Rossi", "Russo", "Ferrari", "Esposito", "Bianchi", "Romano", "Colombo", "Ricci", "Marino", "Greco"]
+QUERY = ["zappacosta", "gianfranco zapacosta", "mario rossi", "mar", "esempio"]
+
+
+class _Annulla(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Prova di scala della ricerca a trigrammi: crea N lead fittizi (nomi comuni, un solo "
+        "'Gianfranco Zappacosta'), li indicizza e misura le query di lead_lista. Tutto in una "
+        "transazione annullata alla fine: il DB resta com'era."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lead", type=int, default=50000, help="Lead fittizi da creare.")
+        parser.add_argument("--query", action="append", help="Testo da cercare (ripetibile).")
+
+    def handle(self, *args, lead, query, **options):
+        try:
+            with transaction.atomic():
+                self._prova(max(1, lead), query or QUERY)
+                raise _Annulla
+        except _Annulla:
+            pass
+        finally:
+            # frequenze dei trigrammi calcolate sui lead fittizi
+            invalida("ricerca")
+
+    def _prova(self, n, testi):
+        casuale = random.Random(1)
+        creati = Lead.objects.bulk_create(
+            (
+                Lead(
+                    nome=casuale.choice(NOMI),
+                    cognome=casuale.choice(COGNOMI) + (str(i) if i % 7 == 0 else ""),
+                    email=f"utente{i}@esempio.it",
+                    telefono=f"3{casuale.randrange(10**8, 10**9)}",
+                )
+                for i in range(n)
+            ),
+            batch_size=2000,
+        )
+        creati.append(Lead.objects.create(nome="Gianfranco", cognome="Zappacosta", telefono="3471112223"))
+        inizio = time.perf_counter()
+        ricerca.indicizza_ids(Lead, [l.pk for l in creati], batch=2000)
+        self.stdout.write(f"{len(creati)} lead indicizzati in {time.perf_counter() - inizio:.1f}s")
+
+        for testo in testi:
+            for giro in ("fredda", "calda"):
+                inizio = time.perf_counter()
+                qs, rilevanza = ricerca.filtra_ricerca(Lead.objects.filter(is_archiviato=False), testo)
+                totale = qs.count()
+                if rilevanza is not None:
+                    qs = qs.annotate(_rilevanza=rilevanza).order_by("-_rilevanza", "-creato_il", "pk")
+                else:
+                    qs = qs.order_by("-creato_il")
+                list(qs[:20])
+                durata = (time.perf_counter() - inizio) * 1000
+                self.stdout.write(
+                    f"{testo!r:<26} {giro:<7} risultati {totale:>7}  "
+                    f"rilevanza {'sì' if rilevanza is not None else 'no':<3} {durata:8.1f} ms"
+                )
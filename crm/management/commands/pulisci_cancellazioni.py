@@ -0,0 +1,33 @@
+# crm/management/commands/pulisci_cancellazioni.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from crm.models import Cancellazione
+from crm.services import pulisci_cancellazioni
+
+
+class Command(BaseCommand):
+    help = (
+        "Cancella a blocchi i tombstone delle cancellazioni (usati dagli endpoint changes dell'API) "
+        "più vecchi di CANCELLAZIONI_RETENTION_GIORNI. I client fermi da più tempo ricevono 410 "
+        "e ripartono da una sincronizzazione completa."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=1000, help="Righe cancellate per blocco.")
+        parser.add_argument("--dry-run", action="store_true", help="Conta soltanto, non cancella nulla.")
+
+    def handle(self, *args, batch, dry_run, **options):
+        # la retention viene solo dalle settings: è la stessa che `changes` usa per rifiutare i cursori vecchi
+        prima_di = timezone.now() - timedelta(days=settings.CANCELLAZIONI_RETENTION_GIORNI)
+
+        if dry_run:
+            n = Cancellazione.objects.filter(eliminato_il__lt=prima_di).count()
+            self.stdout.write(f"{n} tombstone da cancellare (prima del {prima_di:%d/%m/%Y}).")
+            return
+
+        n = pulisci_cancellazioni(prima_di=prima_di, batch=max(1, batch))
+        self.stdout.write(self.style.SUCCESS(f"Cancellati {n} tombstone."))
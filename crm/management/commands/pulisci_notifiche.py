@@ -0,0 +1,40 @@
+# crm/management/commands/pulisci_notifiche.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from crm.services import notifiche_da_pulire, pulisci_notifiche_lette
+
+
+class Command(BaseCommand):
+    help = (
+        "Cancella a blocchi le notifiche già lette da tutti gli utenti attivi più vecchie della "
+        "retention configurata, e comunque quelle oltre la retention massima."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--giorni", type=int, default=settings.NOTIFICHE_RETENTION_GIORNI,
+            help="Retention in giorni per le notifiche lette (default: NOTIFICHE_RETENTION_GIORNI).",
+        )
+        parser.add_argument(
+            "--max-giorni", type=int, default=settings.NOTIFICHE_RETENTION_MAX_GIORNI,
+            help="Età oltre la quale si cancella comunque (default: NOTIFICHE_RETENTION_MAX_GIORNI).",
+        )
+        parser.add_argument("--batch", type=int, default=1000, help="Righe cancellate per blocco.")
+        parser.add_argument("--dry-run", action="store_true", help="Conta soltanto, non cancella nulla.")
+
+    def handle(self, *args, giorni, max_giorni, batch, dry_run, **options):
+        adesso = timezone.now()
+        prima_di = adesso - timedelta(days=giorni)
+        max_prima_di = adesso - timedelta(days=max_giorni)
+
+        if dry_run:
+            n = notifiche_da_pulire(prima_di=prima_di, max_prima_di=max_prima_di).count()
+            self.stdout.write(f"{n} notifiche da cancellare (lette e create prima del {prima_di:%d/%m/%Y}).")
+            return
+
+        n = pulisci_notifiche_lette(prima_di=prima_di, max_prima_di=max_prima_di, batch=max(1, batch))
+        self.stdout.write(self.style.SUCCESS(f"Cancellate {n} notifiche."))
@@ -0,0 +1,23 @@
+# crm/management/commands/ricostruisci_indice_ricerca.py
+from django.core.management.base import BaseCommand
+
+from crm.models import Cliente, Lead
+from crm.ricerca import chiave_modello, indicizza_ids
+
+
+class Command(BaseCommand):
+    help = (
+        "Ricostruisce l'indice a trigrammi (IndiceRicerca) di lead e clienti usato dalla "
+        "ricerca nelle liste. Serve solo se l'indice è stato alterato a mano o dopo "
+        "scritture che non passano da save() / upsert_lead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=500, help="Oggetti per blocco.")
+
+    def handle(self, *args, batch, **options):
+        for modello in (Lead, Cliente):
+            ids = modello.objects.order_by("pk").values_list("pk", flat=True)
+            n = indicizza_ids(modello, ids, batch=max(1, batch))
+            self.stdout.write(f"{chiave_modello(modello)}: {n} trigrammi.")
+        self.stdout.write(self.style.SUCCESS("Indice di ricerca ricostruito."))
@@ -0,0 +1,57 @@
+# crm/middleware.py
+import time
+
+from django.contrib.auth.middleware import get_user
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject, empty
+
+from .ruoli import CLAIM_DURATA, SESSIONE_CHIAVE, applica_claim, firma_claim_sessione, leggi_claim_sessione
+
+
+class RuoloSessioneMiddleware(MiddlewareMixin):
+    """
+    Claim di ruolo firmato in sessione (vedi crm/ruoli.py).
+    In ingresso lo applica all'utente della richiesta, senza forzarne il caricamento;
+    in uscita lo riscrive solo se manca, è cambiato o ha superato metà della durata.
+    Va messo dopo AuthenticationMiddleware.
+    """
+
+    def process_request(self, request):
+        request.user = request._crm_utente_sessione = SimpleLazyObject(
+            lambda: self._con_claim(request, get_user(request))
+        )
+
+        auser_originale = request.auser
+
+        async def auser():
+            user = await auser_originale()
+            if user.is_authenticated and not hasattr(user, "_crm_claim_ruolo"):
+                claim = leggi_claim_sessione(await request.session.aget(SESSIONE_CHIAVE), user.pk)
+                if claim:
+                    applica_claim(user, *claim)
+            return user
+
+        request.auser = auser
+
+    @staticmethod
+    def _con_claim(request, user):
+        if user.is_authenticated and not hasattr(user, "_crm_claim_ruolo"):
+            claim = leggi_claim_sessione(request.session.get(SESSIONE_CHIAVE), user.pk)
+            if claim:
+                applica_claim(user, *claim)
+        return user
+
+    def process_response(self, request, response):
+        # solo se l'utente di sessione è stato davvero caricato e non sostituito
+        # (login/logout, o utente del JWT impostato da DRF sulle chiamate API)
+        user = getattr(request, "user", None)
+        if user is None or user is not getattr(request, "_crm_utente_sessione", None):
+            return response
+        user = user._wrapped if user._wrapped is not empty else getattr(request, "_acached_user", None)
+        ruolo = getattr(user, "_crm_ruolo", None)
+        if ruolo is None or not user.is_authenticated:
+            return response
+        claim = leggi_claim_sessione(request.session.get(SESSIONE_CHIAVE), user.pk)
+        if claim is None or claim[0] != ruolo or time.time() - float(claim[1] or 0) > CLAIM_DURATA / 2:
+            request.session[SESSIONE_CHIAVE] = firma_claim_sessione(user.pk, ruolo)
+        return response
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0037_cliente_fase_separata'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['richiamare_il', 'consulente', 'is_archiviato'], name='crm_lead_richiamo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['appuntamento_previsto', 'consulente', 'is_archiviato'], name='crm_lead_appunt_idx'),
+        ),
+    ]
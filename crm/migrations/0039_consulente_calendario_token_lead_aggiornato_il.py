@@ -0,0 +1,44 @@
+import secrets
+
+import crm.models
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def genera_token_esistenti(apps, schema_editor):
+    Consulente = apps.get_model("crm", "Consulente")
+    for consulente in Consulente.objects.filter(calendario_token__isnull=True):
+        consulente.calendario_token = secrets.token_urlsafe(32)
+        consulente.save(update_fields=["calendario_token"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0038_lead_indici_richiami"),
+    ]
+
+    operations = [
+        # token: prima nullable, poi popolato, poi unique
+        migrations.AddField(
+            model_name="consulente",
+            name="calendario_token",
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(genera_token_esistenti, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="consulente",
+            name="calendario_token",
+            field=models.CharField(default=crm.models.genera_token_calendario, editable=False, max_length=64, unique=True),
+        ),
+        migrations.AddField(
+            model_name="lead",
+            name="aggiornato_il",
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name="lead",
+            index=models.Index(fields=["consulente", "appuntamento_previsto"], name="crm_lead_cons_appunt_idx"),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0039_consulente_calendario_token_lead_aggiornato_il'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeadArchivio',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('nome', models.CharField(max_length=100)),
+                ('cognome', models.CharField(max_length=100)),
+                ('telefono', models.CharField(blank=True, max_length=20, null=True)),
+                ('email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('creditore_legale', models.CharField(blank=True, choices=[('banca_ifis', 'Banca Ifis'), ('mb_credit', 'MB Credit'), ('kruk', 'Kruk'), ('itacapital', 'Itacapital'), ('cherry_bank', 'Cherry Bank'), ('marathon_spv', 'Marathon SPV'), ('prelios', 'Prelios'), ('kerdos', 'Kerdos'), ('intrum', 'Intrum'), ('altro', 'Altro')], default='', max_length=30)),
+                ('creditore_legale_altro', models.CharField(blank=True, max_length=120, null=True)),
+                ('stato', models.CharField(choices=[('in_corso', 'In corso'), ('negativo', 'Esito negativo'), ('positivo', 'Esito positivo')], default='in_corso', max_length=20)),
+                ('stato_operativo', models.CharField(choices=[('nuovo', 'Nuovo'), ('no_risposta', 'Senza risposta'), ('segreteria', 'Segreteria'), ('non_fascia_oraria', 'Non fascia oraria'), ('ha_staccato_lui', 'Ha staccato lui'), ('consulenza_eff', 'Consulenza effettuata'), ('attesa_contatti', 'Attesa contatti cliente'), ('non_contattare', 'Non contattare'), ('numero_errato', 'Numero errato'), ('blocco_chiamate', 'Blocco chiamate'), ('cliente_non_interessato', 'Cliente non interessato'), ('non_competenza', 'Attività non di competenza')], default='nuovo', max_length=30)),
+                ('appuntamento_previsto', models.DateTimeField(blank=True, null=True)),
+                ('motivazione_negativa', models.TextField(blank=True, null=True)),
+                ('note_operatori', models.TextField(blank=True, null=True)),
+                ('provenienza', models.CharField(blank=True, choices=[('tiktok', 'TikTok'), ('meta', 'Meta (Facebook/Instagram)'), ('google', 'Google'), ('passaparola', 'Passaparola')], default='', max_length=20)),
+                ('primo_contatto', models.DateTimeField(blank=True, null=True)),
+                ('convertito', models.BooleanField(default=False)),
+                ('convertito_il', models.DateTimeField(blank=True, null=True)),
+                ('is_archiviato', models.BooleanField(default=False)),
+                ('creato_il', models.DateTimeField()),
+                ('aggiornato_il', models.DateTimeField()),
+                ('richiamare_il', models.DateTimeField(blank=True, null=True)),
+                ('ricontatti_count', models.PositiveIntegerField(default=0)),
+                ('archiviato_il', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('consulente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leads_archiviati', to='crm.consulente')),
+                ('convertito_cliente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='da_lead_archiviati', to='crm.cliente')),
+                ('convertito_da', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Lead archiviato',
+                'verbose_name_plural': 'Lead archiviati',
+                'ordering': ('-archiviato_il',),
+            },
+        ),
+        migrations.CreateModel(
+            name='NotaLeadArchivio',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('testo', models.TextField()),
+                ('creato_il', models.DateTimeField()),
+                ('autore', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('lead', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='note_entries', to='crm.leadarchivio')),
+            ],
+            options={
+                'ordering': ('-creato_il',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='leadarchivio',
+            index=models.Index(fields=['cognome', 'nome'], name='crm_leadarch_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leadarchivio',
+            index=models.Index(fields=['telefono'], name='crm_leadarch_tel_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notaleadarchivio',
+            index=models.Index(fields=['lead', '-creato_il'], name='crm_notaleadarch_lead_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0040_archivio_lead'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notifica',
+            index=models.Index(fields=['is_read', 'created_at'], name='crm_notifica_letta_data_idx'),
+        ),
+    ]
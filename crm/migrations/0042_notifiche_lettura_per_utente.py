@@ -0,0 +1,85 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+# oltre questo numero di notifiche lette sopra il watermark niente eccezioni per utente
+# (sarebbero utenti × notifiche righe): restano da leggere, "segna tutte" le sistema
+ECCEZIONI_MAX = 200
+
+
+def inizializza_letture(apps, schema_editor):
+    """
+    Riporta lo stato globale is_read su ogni utente: watermark subito prima della
+    prima notifica non letta; le lette successive diventano eccezioni solo se poche.
+    """
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split("."))
+    Notifica = apps.get_model("crm", "Notifica")
+    NotificaLettura = apps.get_model("crm", "NotificaLettura")
+    NotificaLetta = apps.get_model("crm", "NotificaLetta")
+
+    prima_non_letta = (
+        Notifica.objects.filter(is_read=False).order_by("pk").values_list("pk", flat=True).first()
+    )
+    if prima_non_letta is None:
+        watermark = Notifica.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+    else:
+        watermark = prima_non_letta - 1
+    lette_oltre = list(
+        Notifica.objects.filter(is_read=True, pk__gt=watermark).values_list("pk", flat=True)[:ECCEZIONI_MAX + 1]
+    )
+    if len(lette_oltre) > ECCEZIONI_MAX:
+        lette_oltre = []
+
+    utenti = list(User.objects.values_list("pk", flat=True))
+    NotificaLettura.objects.bulk_create(
+        [NotificaLettura(utente_id=user_id, letto_fino_a=watermark) for user_id in utenti], batch_size=1000,
+    )
+    if lette_oltre:
+        NotificaLetta.objects.bulk_create(
+            [NotificaLetta(utente_id=user_id, notifica_id=pk) for user_id in utenti for pk in lette_oltre],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('crm', '0041_notifica_indice_letta_data'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificaLettura',
+            fields=[
+                ('utente', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='notifiche_lettura', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('letto_fino_a', models.BigIntegerField(default=0)),
+                ('aggiornato_il', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NotificaLetta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notifica', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='crm.notifica')),
+                ('utente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='notificaletta',
+            constraint=models.UniqueConstraint(fields=('utente', 'notifica'), name='crm_notificaletta_unica'),
+        ),
+        migrations.RunPython(inizializza_letture, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='notifica',
+            name='crm_notifica_letta_data_idx',
+        ),
+        migrations.RemoveField(
+            model_name='notifica',
+            name='is_read',
+        ),
+    ]
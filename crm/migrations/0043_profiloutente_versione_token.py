@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0042_notifiche_lettura_per_utente'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profiloutente',
+            name='versione_token',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0043_profiloutente_versione_token'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['data_creazione', 'id'], name='crm_cliente_creato_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['creato_il', 'id'], name='crm_lead_creato_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:27
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def inizializza_aggiornato_il(apps, schema_editor):
+    """Per i clienti esistenti l'ultima modifica nota è la creazione."""
+    Cliente = apps.get_model("crm", "Cliente")
+    Cliente.objects.update(aggiornato_il=F("data_creazione"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0044_indici_lista_api'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='aggiornato_il',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(inizializza_aggiornato_il, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='Cancellazione',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modello', models.CharField(max_length=50)),
+                ('oggetto_id', models.BigIntegerField()),
+                ('eliminato_il', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['modello', 'eliminato_il', 'id'], name='crm_cancellazione_feed_idx')],
+            },
+        ),
+    ]
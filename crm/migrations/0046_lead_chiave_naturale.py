@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:31
+
+import re
+
+from django.db import migrations, models
+
+
+def chiave_naturale_lead(telefono, email):
+    """Copia congelata di crm.models.chiave_naturale_lead com'era in questa migrazione."""
+    cifre = re.sub(r"\D", "", telefono or "")
+    if cifre.startswith("0039"):
+        cifre = cifre[4:]
+    elif cifre.startswith("39") and len(cifre) > 10:
+        cifre = cifre[2:]
+    if cifre:
+        return f"t:{cifre}"
+    email = (email or "").strip().lower()
+    return f"e:{email}" if email else None
+
+
+def calcola_chiavi(apps, schema_editor):
+    """Chiave ai lead esistenti; a parità di chiave la tiene il lead più vecchio."""
+    Lead = apps.get_model("crm", "Lead")
+    viste = set()
+    da_aggiornare = []
+    for pk, telefono, email in Lead.objects.order_by("pk").values_list("pk", "telefono", "email").iterator():
+        chiave = chiave_naturale_lead(telefono, email)
+        if chiave and chiave not in viste:
+            viste.add(chiave)
+            da_aggiornare.append(Lead(pk=pk, chiave_naturale=chiave))
+    Lead.objects.bulk_update(da_aggiornare, ["chiave_naturale"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0045_sincronizzazione_api'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='chiave_naturale',
+            field=models.CharField(blank=True, editable=False, max_length=160, null=True, unique=True),
+        ),
+        migrations.RunPython(calcola_chiavi, migrations.RunPython.noop),
+    ]
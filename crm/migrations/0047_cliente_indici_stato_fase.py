@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0046_lead_chiave_naturale'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['stato', 'data_creazione', 'id'], name='crm_cliente_stato_creato_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cliente',
+            index=models.Index(fields=['fase', 'data_creazione', 'id'], name='crm_cliente_fase_creato_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0047_cliente_indici_stato_fase'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FiltroSalvato',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=80)),
+                ('stato_slug', models.CharField(blank=True, default='', max_length=40)),
+                ('parametri', models.TextField(blank=True, default='')),
+                ('memorizza_risultati', models.BooleanField(default=False)),
+                ('creato_il', models.DateTimeField(auto_now_add=True)),
+                ('utente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='filtri_salvati', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['nome'],
+                'constraints': [models.UniqueConstraint(fields=('utente', 'nome'), name='crm_filtro_salvato_nome_uniq')],
+            },
+        ),
+    ]
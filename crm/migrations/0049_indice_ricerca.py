@@ -0,0 +1,70 @@
+# Generated by Django 5.2.7 on 2026-10-19 17:47
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# Copia congelata di crm.ricerca com'era in questa migrazione: cambiare la
+# normalizzazione in seguito richiede un ricostruisci_indice_ricerca, non questa.
+N = 3
+BORDO = "_"
+CAMPI_RICERCA = {
+    "lead": ("nome", "cognome", "email", "telefono"),
+    "cliente": ("nome", "cognome", "email", "telefono"),
+}
+_NON_ALFANUMERICI = re.compile(r"[^0-9a-z]+")
+
+
+def parole(testo):
+    if not testo:
+        return []
+    testo = unicodedata.normalize("NFKD", str(testo)).encode("ascii", "ignore").decode().lower()
+    return [p for p in _NON_ALFANUMERICI.split(testo) if p]
+
+
+def ngrammi_campi(valori):
+    risultato = set()
+    for valore in valori:
+        for p in parole(valore):
+            p = BORDO * (N - 1) + p + BORDO
+            risultato.update(p[i:i + N] for i in range(len(p) - N + 1))
+    return risultato
+
+
+def popola_indice(apps, schema_editor):
+    """Trigrammi di lead e clienti esistenti (poi li mantengono signal e servizi)."""
+    IndiceRicerca = apps.get_model("crm", "IndiceRicerca")
+    for chiave, nome_modello in (("lead", "Lead"), ("cliente", "Cliente")):
+        modello = apps.get_model("crm", nome_modello)
+        righe = []
+        for pk, *valori in modello.objects.order_by("pk").values_list("pk", *CAMPI_RICERCA[chiave]).iterator():
+            righe.extend(IndiceRicerca(modello=chiave, oggetto_id=pk, ngramma=g) for g in ngrammi_campi(valori))
+            if len(righe) >= 5000:
+                IndiceRicerca.objects.bulk_create(righe)
+                righe = []
+        IndiceRicerca.objects.bulk_create(righe)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0048_filtro_salvato'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndiceRicerca',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modello', models.CharField(max_length=20)),
+                ('oggetto_id', models.PositiveBigIntegerField()),
+                ('ngramma', models.CharField(max_length=3)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['modello', 'oggetto_id'], name='crm_indice_ricerca_ogg_idx')],
+                'constraints': [models.UniqueConstraint(fields=('modello', 'ngramma', 'oggetto_id'), name='crm_indice_ricerca_uniq')],
+            },
+        ),
+        migrations.RunPython(popola_indice, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0049_indice_ricerca'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leadarchivio',
+            name='consulenza_effettuata',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='leadarchivio',
+            name='in_acquisizione',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='leadarchivio',
+            name='messaggio_inviato',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='leadarchivio',
+            name='no_risposta',
+            field=models.BooleanField(default=False),
+        ),
+    ]
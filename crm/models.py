@@ -2,6 +2,8 @@
 from __future__ import annotations
 
 import os
+import re
+import secrets
 import time
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -12,10 +14,21 @@ from django.utils.text import slugify
 
 
 # --- CONSULENTI ---
+def genera_token_calendario() -> str:
+    return secrets.token_urlsafe(32)
+
+
 class Consulente(models.Model):
     nome = models.CharField(max_length=120, unique=True)
     is_active = models.BooleanField(default=True)
     creato_il = models.DateTimeField(auto_now_add=True)
+    # token segreto del feed iCalendar degli appuntamenti (URL senza login)
+    calendario_token = models.CharField(
+        max_length=64,
+        unique=True,
+        default=genera_token_calendario,
+        editable=False,
+    )
 
     class Meta:
         ordering = ["nome"]
@@ -87,12 +100,23 @@ class Cliente(models.Model):
         help_text="Consulente assegnato al cliente",
     )
     data_creazione = models.DateTimeField(auto_now_add=True)
+    # N.B. con save(update_fields=...) va incluso esplicitamente
+    aggiornato_il = models.DateTimeField(auto_now=True, db_index=True)
 
     # Flag istanza
     istanza_visibilita = models.BooleanField(default=False, verbose_name="Istanza di visibilità")
     documenti_inviati = models.BooleanField(default=False)
     perizia_inviata = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # lista API a cursore (data_creazione, id)
+            models.Index(fields=["data_creazione", "id"], name="crm_cliente_creato_idx"),
+            # liste per stato / fase ordinate per data (clienti_attivi, clienti_legali, ...)
+            models.Index(fields=["stato", "data_creazione", "id"], name="crm_cliente_stato_creato_idx"),
+            models.Index(fields=["fase", "data_creazione", "id"], name="crm_cliente_fase_creato_idx"),
+        ]
+
     def __str__(self) -> str:
         return f"{self.nome} {self.cognome}"
     
@@ -205,10 +229,30 @@ class ProfiloUtente(models.Model):
     )
     utente = models.OneToOneField(User, on_delete=models.CASCADE)
     ruolo = models.CharField(max_length=20, choices=RUOLI, default="operatore")
+    # claim `tv` dei JWT: incrementarla revoca tutti i token già emessi all'utente
+    versione_token = models.PositiveIntegerField(default=0)
+
+    # campi sincronizzati dal salvataggio di User (versione_token si aggiorna solo con F())
+    CAMPI_SINCRONIZZATI = ("ruolo",)
 
     def __str__(self) -> str:
         return f"{self.utente.username} - {self.ruolo}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        istanza = super().from_db(db, field_names, values)
+        istanza._valori_caricati = {c: getattr(istanza, c) for c in cls.CAMPI_SINCRONIZZATI if c in field_names}
+        return istanza
+
+    def campi_modificati(self) -> list[str]:
+        """Campi sincronizzati cambiati in memoria rispetto a quanto letto dal DB."""
+        caricati = getattr(self, "_valori_caricati", {})
+        return [c for c, v in caricati.items() if getattr(self, c) != v]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._valori_caricati = {c: getattr(self, c) for c in self.CAMPI_SINCRONIZZATI}
+
 
 # --- NOTE OPERATORI ---
 class Nota(models.Model):
@@ -227,6 +271,22 @@ class Nota(models.Model):
 
 
 # --- LEAD ---
+def chiave_naturale_lead(telefono, email) -> str | None:
+    """
+    Chiave di deduplica per gli upsert dall'API: telefono normalizzato (solo cifre,
+    senza prefisso +39/0039), altrimenti email in minuscolo.
+    """
+    cifre = re.sub(r"\D", "", telefono or "")
+    if cifre.startswith("0039"):
+        cifre = cifre[4:]
+    elif cifre.startswith("39") and len(cifre) > 10:
+        cifre = cifre[2:]
+    if cifre:
+        return f"t:{cifre}"
+    email = (email or "").strip().lower()
+    return f"e:{email}" if email else None
+
+
 class Lead(models.Model):
     class Provenienza(models.TextChoices):
         TIKTOK = "tiktok", "TikTok"
@@ -326,6 +386,8 @@ class Lead(models.Model):
     )
     is_archiviato = models.BooleanField(default=False)
     creato_il = models.DateTimeField(auto_now_add=True)
+    # N.B. con save(update_fields=...) va incluso esplicitamente
+    aggiornato_il = models.DateTimeField(auto_now=True, db_index=True)
 
     # Flag operativi (TEMPORANEI: li lasciamo per migrazione dati, poi li rimuoviamo)
     consulenza_effettuata = models.BooleanField(default=False)
@@ -336,16 +398,36 @@ class Lead(models.Model):
     richiamare_il = models.DateTimeField(null=True, blank=True)
     ricontatti_count = models.PositiveIntegerField(default=0, help_text="Numero di ricontatti senza risposta")
 
+    # vedi chiave_naturale_lead; NULL se la chiave appartiene già a un altro lead
+    chiave_naturale = models.CharField(max_length=160, null=True, blank=True, unique=True, editable=False)
+
     class Meta:
         indexes = [
             models.Index(fields=["stato"]),
             models.Index(fields=["stato_operativo"]),  # nuovo indice
             models.Index(fields=["convertito", "is_archiviato"]),
+            # coda richiami: range sulla scadenza, già nell'ordine della coda; consulente/archiviato
+            # (dopo la colonna di range) filtrano le voci lette ma non restringono la scansione
+            models.Index(fields=["richiamare_il", "consulente", "is_archiviato"], name="crm_lead_richiamo_idx"),
+            models.Index(fields=["appuntamento_previsto", "consulente", "is_archiviato"], name="crm_lead_appunt_idx"),
+            # feed calendario per consulente
+            models.Index(fields=["consulente", "appuntamento_previsto"], name="crm_lead_cons_appunt_idx"),
+            # lista API a cursore (creato_il, id)
+            models.Index(fields=["creato_il", "id"], name="crm_lead_creato_idx"),
         ]
 
     def __str__(self) -> str:
         return f"{self.nome} {self.cognome} ({self.get_stato_display()})"
 
+    def save(self, *args, **kwargs):
+        chiave = chiave_naturale_lead(self.telefono, self.email)
+        if chiave != self.chiave_naturale:
+            occupata = chiave and Lead.objects.filter(chiave_naturale=chiave).exclude(pk=self.pk).exists()
+            self.chiave_naturale = None if occupata else chiave
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "chiave_naturale"}
+        super().save(*args, **kwargs)
+
 
 class NotaLead(models.Model):
     """Note operatori multiple per lead (cronologia)."""
@@ -374,6 +456,130 @@ class NotaLead(models.Model):
         return f"Nota lead #{self.pk} · {self.lead_id}"
 
 
+# --- FILTRI SALVATI (lead_lista) ---
+class FiltroSalvato(models.Model):
+    """
+    Combinazione di filtri di lead_lista salvata da un operatore.
+    `parametri` è la querystring dei filtri, ordinamento compreso (senza pagina); con
+    `memorizza_risultati` gli id risultanti restano in cache per pochi minuti
+    e lo scorrimento delle pagine legge i lead per pk.
+    """
+    utente = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+        related_name="filtri_salvati",
+    )
+    nome = models.CharField(max_length=80)
+    stato_slug = models.CharField(max_length=40, blank=True, default="")
+    parametri = models.TextField(blank=True, default="")
+    memorizza_risultati = models.BooleanField(default=False)
+    creato_il = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["nome"]
+        constraints = [
+            models.UniqueConstraint(fields=["utente", "nome"], name="crm_filtro_salvato_nome_uniq"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.nome} ({self.utente})"
+
+
+# --- ARCHIVIO LEAD ---
+class LeadArchivio(models.Model):
+    """
+    Lead spostati fuori da crm_lead dal comando `archivia_lead` (sola lettura).
+    Stesso id e stessi nomi di campo del Lead originale.
+    """
+    id = models.BigIntegerField(primary_key=True)
+
+    nome = models.CharField(max_length=100)
+    cognome = models.CharField(max_length=100)
+    telefono = models.CharField(max_length=20, blank=True, null=True)
+    email = models.EmailField(blank=True, null=True)
+    creditore_legale = models.CharField(max_length=30, choices=CreditoreLegale.choices, blank=True, default="")
+    creditore_legale_altro = models.CharField(max_length=120, blank=True, null=True)
+
+    stato = models.CharField(max_length=20, choices=Lead.STATO_CHOICES, default="in_corso")
+    stato_operativo = models.CharField(max_length=30, choices=Lead.StatoOperativo.choices, default=Lead.StatoOperativo.NUOVO)
+    appuntamento_previsto = models.DateTimeField(blank=True, null=True)
+    motivazione_negativa = models.TextField(blank=True, null=True)
+    note_operatori = models.TextField(blank=True, null=True)
+    provenienza = models.CharField(max_length=20, choices=Lead.Provenienza.choices, blank=True, default="")
+    consulente = models.ForeignKey(
+        Consulente,
+        null=True, blank=True,
+        on_delete=models.SET_NULL,
+        related_name="leads_archiviati",
+    )
+    primo_contatto = models.DateTimeField(null=True, blank=True)
+
+    convertito = models.BooleanField(default=False)
+    convertito_il = models.DateTimeField(null=True, blank=True)
+    convertito_da = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True, blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+    )
+    convertito_cliente = models.ForeignKey(
+        "Cliente",
+        null=True, blank=True,
+        on_delete=models.SET_NULL,
+        related_name="da_lead_archiviati",
+    )
+    is_archiviato = models.BooleanField(default=False)
+    creato_il = models.DateTimeField()
+    aggiornato_il = models.DateTimeField()
+    consulenza_effettuata = models.BooleanField(default=False)
+    no_risposta = models.BooleanField(default=False)
+    messaggio_inviato = models.BooleanField(default=False)
+    in_acquisizione = models.BooleanField(default=False)
+    richiamare_il = models.DateTimeField(null=True, blank=True)
+    ricontatti_count = models.PositiveIntegerField(default=0)
+
+    archiviato_il = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        ordering = ("-archiviato_il",)
+        verbose_name = "Lead archiviato"
+        verbose_name_plural = "Lead archiviati"
+        indexes = [
+            models.Index(fields=["cognome", "nome"], name="crm_leadarch_nome_idx"),
+            models.Index(fields=["telefono"], name="crm_leadarch_tel_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.nome} {self.cognome} (archivio)"
+
+
+class NotaLeadArchivio(models.Model):
+    """Note dei lead archiviati (copiate da NotaLead, stesso id)."""
+    id = models.BigIntegerField(primary_key=True)
+    lead = models.ForeignKey(
+        LeadArchivio,
+        on_delete=models.CASCADE,
+        related_name="note_entries",
+    )
+    autore = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+    )
+    testo = models.TextField()
+    creato_il = models.DateTimeField()
+
+    class Meta:
+        ordering = ("-creato_il",)
+        indexes = [
+            models.Index(fields=["lead", "-creato_il"], name="crm_notaleadarch_lead_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"Nota archivio #{self.pk} · {self.lead_id}"
+
+
 # --- NOTIFICHE ---
 UserModel = get_user_model()
 
@@ -402,7 +608,6 @@ class Notifica(models.Model):
 
     testo = models.CharField(max_length=500, blank=True)
     payload = models.JSONField(blank=True, null=True)
-    is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self) -> str:
@@ -410,6 +615,76 @@ class Notifica(models.Model):
         return f"[{self.get_tipo_display()}] {base}"
 
 
+class NotificaLettura(models.Model):
+    """
+    Stato di lettura per utente: tutte le notifiche con id <= letto_fino_a sono lette.
+    Le notifiche oltre il watermark lette una per una stanno in NotificaLetta.
+    """
+    utente = models.OneToOneField(
+        UserModel, on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="notifiche_lettura",
+    )
+    letto_fino_a = models.BigIntegerField(default=0)
+    aggiornato_il = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.utente} · letto fino a #{self.letto_fino_a}"
+
+
+class NotificaLetta(models.Model):
+    """Eccezioni sparse: notifiche sopra il watermark dell'utente già segnate come lette."""
+    utente = models.ForeignKey(UserModel, on_delete=models.CASCADE, related_name="+")
+    notifica = models.ForeignKey(Notifica, on_delete=models.CASCADE, related_name="+")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["utente", "notifica"], name="crm_notificaletta_unica"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.utente} · notifica #{self.notifica_id}"
+
+
+# --- CANCELLAZIONI (tombstone per la sincronizzazione API) ---
+class Cancellazione(models.Model):
+    """
+    Traccia dei record eliminati, letta dagli endpoint `.../changes/` dell'API
+    per comunicare ai client le righe da rimuovere (vedi crm/api/sincronizzazione.py).
+    """
+    modello = models.CharField(max_length=50)  # _meta.label_lower, es. "crm.lead"
+    oggetto_id = models.BigIntegerField()
+    eliminato_il = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["modello", "eliminato_il", "id"], name="crm_cancellazione_feed_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.modello} #{self.oggetto_id} eliminato il {self.eliminato_il:%d/%m/%Y %H:%M}"
+
+
+# --- INDICE DI RICERCA (trigrammi, vedi crm/ricerca.py) ---
+class IndiceRicerca(models.Model):
+    """Un trigramma distinto di nome/cognome/email/telefono di un Lead o Cliente."""
+    modello = models.CharField(max_length=20)
+    oggetto_id = models.PositiveBigIntegerField()
+    ngramma = models.CharField(max_length=3)
+
+    class Meta:
+        constraints = [
+            # ricerca: (modello, ngramma) -> oggetto_id direttamente dall'indice
+            models.UniqueConstraint(fields=["modello", "ngramma", "oggetto_id"], name="crm_indice_ricerca_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["modello", "oggetto_id"], name="crm_indice_ricerca_ogg_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.modello}#{self.oggetto_id}: {self.ngramma}"
+
+
 # --- SCHEDA DI CONSULENZA ---
 class SchedaConsulenza(models.Model):
     cliente = models.ForeignKey(
@@ -0,0 +1,121 @@
+# crm/paginazione.py
+"""
+Paginazione keyset (a cursore) per liste lunghe.
+Invece di OFFSET filtra "dopo l'ultima riga vista" sulle colonne di ordinamento,
+così ogni pagina è una range scan sull'indice, anche in fondo alla lista.
+"""
+from __future__ import annotations
+
+import base64
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class _EncoderCursore(DjangoJSONEncoder):
+    """Come DjangoJSONEncoder ma senza troncare i microsecondi (il confronto deve essere esatto)."""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+@dataclass
+class PaginaKeyset:
+    oggetti: list = field(default_factory=list)
+    cursore_succ: str | None = None
+    cursore_prec: str | None = None
+
+    @property
+    def ha_succ(self) -> bool:
+        return self.cursore_succ is not None
+
+    @property
+    def ha_prec(self) -> bool:
+        return self.cursore_prec is not None
+
+    def __iter__(self):
+        return iter(self.oggetti)
+
+    def __len__(self):
+        return len(self.oggetti)
+
+
+def codifica_cursore(valori: list, indietro: bool = False) -> str:
+    dati = {"v": valori, "p": 1} if indietro else {"v": valori}
+    raw = json.dumps(dati, cls=_EncoderCursore, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decodifica_cursore(cursore: str | None) -> tuple[list, bool] | None:
+    """Ritorna (valori, indietro) oppure None se il cursore manca o non è valido."""
+    if not cursore:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursore + "=" * (-len(cursore) % 4))
+        dati = json.loads(raw)
+        return list(dati["v"]), bool(dati.get("p"))
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def _condizione_dopo(campi: list[tuple[str, bool]], valori: list) -> Q:
+    """(a, b, c) "dopo" (va, vb, vc) rispettando la direzione di ogni colonna."""
+    condizione = Q()
+    uguali = Q()
+    for (nome, desc), valore in zip(campi, valori):
+        confronto = Q(**{f"{nome}__{'lt' if desc else 'gt'}": valore})
+        condizione |= uguali & confronto
+        uguali &= Q(**{nome: valore})
+    return condizione
+
+
+def pagina_keyset(qs, ordinamento: list[str], *, cursore: str | None = None, per_page: int = 20) -> PaginaKeyset:
+    """
+    `ordinamento` come in order_by (es. ["-created_at", "-id"]); l'ultima colonna
+    deve essere univoca (tipicamente la pk). I valori nel cursore vengono riconvertiti
+    con to_python del campo del modello.
+    """
+    campi = [(o.lstrip("-"), o.startswith("-")) for o in ordinamento]
+    decodificato = decodifica_cursore(cursore)
+    indietro = False
+
+    if decodificato:
+        valori, indietro = decodificato
+        try:
+            if len(valori) != len(campi):
+                raise ValidationError("cursore non valido")
+            valori = [qs.model._meta.get_field(nome).to_python(v) for (nome, _), v in zip(campi, valori)]
+        except ValidationError:
+            decodificato, indietro = None, False
+        else:
+            # andando indietro si legge "prima" della prima riga: stessa condizione a direzioni invertite
+            verso = [(nome, desc != indietro) for nome, desc in campi]
+            qs = qs.filter(_condizione_dopo(verso, valori))
+
+    if indietro:
+        ordine = [o[1:] if o.startswith("-") else f"-{o}" for o in ordinamento]
+    else:
+        ordine = ordinamento
+    righe = list(qs.order_by(*ordine)[: per_page + 1])
+    altre = len(righe) > per_page
+    righe = righe[:per_page]
+    if indietro:
+        righe.reverse()
+
+    def _chiave(obj):
+        return [getattr(obj, nome) for nome, _ in campi]
+
+    pagina = PaginaKeyset(oggetti=righe)
+    if righe:
+        # in avanti: c'è un "dopo" se abbiamo letto una riga in più; un "prima" se siamo arrivati con un cursore
+        if (altre and not indietro) or (indietro and decodificato):
+            pagina.cursore_succ = codifica_cursore(_chiave(righe[-1]))
+        if (altre and indietro) or (decodificato and not indietro):
+            pagina.cursore_prec = codifica_cursore(_chiave(righe[0]), indietro=True)
+    return pagina
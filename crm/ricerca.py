@@ -0,0 +1,245 @@
+# crm/ricerca.py
+"""
+Ricerca per sottostringa su nome, cognome, email e telefono con un indice a trigrammi.
+
+`?q=` nelle liste era un OR di quattro LIKE '%...%': sempre una scansione completa.
+IndiceRicerca tiene, per ogni Lead / Cliente, i trigrammi distinti dei campi
+normalizzati (minuscole, senza accenti né punteggiatura), con i bordi di parola
+("__r", "_ro", ..., "si_") come pg_trgm; la lista filtra per pk sulla subquery
+dell'indice con gli id che condividono abbastanza trigrammi con la query.
+
+- sottostringa: trovato se ha tutti i trigrammi interni della query (come il vecchio LIKE)
+- tolleranza ai refusi: oppure almeno RICERCA_SOGLIA dei trigrammi con bordi ("rosi" -> Rossi)
+- rilevanza: numero di trigrammi in comune (parola intera prima di prefisso e refuso)
+- selettività: il GROUP BY sull'indice legge solo gli oggetti che hanno almeno uno dei
+  trigrammi più rari della query (filtro a prefisso: chi supera la soglia ne ha per
+  forza uno), non le liste enormi di trigrammi come "__m"; i risultati non cambiano
+- rilevanza solo se i candidati sono al massimo RICERCA_RILEVANZA_MAX (stima dalle
+  frequenze, senza query): oltre, la lista resta sul suo ordinamento invece di una
+  subquery per ogni riga
+- query con parole tutte più corte di 3 caratteri: si torna ai LIKE
+- azioni massive: `esatta=True`, solo sottostringhe vere (niente refusi)
+
+L'indice si aggiorna dai signal (save/delete) e da upsert_lead; per ricostruirlo:
+`python manage.py ricostruisci_indice_ricerca`.
+"""
+from __future__ import annotations
+
+import math
+import re
+import unicodedata
+
+from django.core.cache import cache
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .cache import chiave as chiave_cache
+
+N = 3
+RICERCA_SOGLIA = 0.6
+# candidati stimati oltre i quali non si ordina per rilevanza
+RICERCA_RILEVANZA_MAX = 5000
+# filtro a prefisso solo se i trigrammi rari pesano al massimo 1/4 delle voci da contare
+RICERCA_PREFILTRO_RAPPORTO = 4
+# frequenze dei trigrammi: servono solo a scegliere i più rari, possono essere vecchie
+RICERCA_FREQUENZE_TTL = 60 * 60
+
+# modello -> campi indicizzati
+CAMPI_RICERCA = {
+    "lead": ("nome", "cognome", "email", "telefono"),
+    "cliente": ("nome", "cognome", "email", "telefono"),
+}
+
+_NON_ALFANUMERICI = re.compile(r"[^0-9a-z]+")
+# fuori dall'alfabeto delle parole normalizzate; non uno spazio (MySQL PAD SPACE ignora quelli finali)
+BORDO = "_"
+
+
+def parole(testo: str | None) -> list[str]:
+    """'Niccolò D'Amico' -> ['niccolo', 'd', 'amico']."""
+    if not testo:
+        return []
+    testo = unicodedata.normalize("NFKD", str(testo)).encode("ascii", "ignore").decode().lower()
+    return [p for p in _NON_ALFANUMERICI.split(testo) if p]
+
+
+def ngrammi(testo: str | None, *, bordi: bool = True) -> set[str]:
+    """Trigrammi delle parole; con `bordi` anche quelli di inizio/fine parola (ciò che si indicizza)."""
+    risultato = set()
+    for p in parole(testo):
+        if bordi:
+            p = BORDO * (N - 1) + p + BORDO
+        risultato.update(p[i:i + N] for i in range(len(p) - N + 1))
+    return risultato
+
+
+def ngrammi_campi(valori) -> set[str]:
+    """Trigrammi di più campi (ogni campo per conto suo: niente trigrammi a cavallo)."""
+    risultato = set()
+    for valore in valori:
+        risultato |= ngrammi(valore)
+    return risultato
+
+
+def chiave_modello(modello) -> str:
+    return modello._meta.model_name
+
+
+# ==============================
+# Aggiornamento dell'indice
+# ==============================
+def indicizza(oggetto) -> None:
+    """Allinea l'indice di un oggetto: inserisce i trigrammi nuovi, toglie quelli spariti."""
+    from .models import IndiceRicerca
+
+    modello = chiave_modello(type(oggetto))
+    nuovi = ngrammi_campi(getattr(oggetto, c) for c in CAMPI_RICERCA[modello])
+    esistenti = set(
+        IndiceRicerca.objects.filter(modello=modello, oggetto_id=oggetto.pk).values_list("ngramma", flat=True)
+    )
+    if esistenti - nuovi:
+        IndiceRicerca.objects.filter(
+            modello=modello, oggetto_id=oggetto.pk, ngramma__in=esistenti - nuovi
+        ).delete()
+    if nuovi - esistenti:
+        IndiceRicerca.objects.bulk_create(
+            [IndiceRicerca(modello=modello, oggetto_id=oggetto.pk, ngramma=g) for g in nuovi - esistenti],
+            ignore_conflicts=True,
+        )
+
+
+def indicizza_ids(modello, ids, *, batch: int = 500) -> int:
+    """Ricostruisce l'indice per gli oggetti `ids` di `modello` (scritture massive, comando)."""
+    from .models import IndiceRicerca
+
+    chiave = chiave_modello(modello)
+    campi = CAMPI_RICERCA[chiave]
+    ids = list(ids)
+    totale = 0
+    for inizio in range(0, len(ids), batch):
+        blocco = ids[inizio:inizio + batch]
+        righe = [
+            IndiceRicerca(modello=chiave, oggetto_id=pk, ngramma=g)
+            for pk, *valori in modello._default_manager.filter(pk__in=blocco).values_list("pk", *campi)
+            for g in ngrammi_campi(valori)
+        ]
+        IndiceRicerca.objects.filter(modello=chiave, oggetto_id__in=blocco).delete()
+        IndiceRicerca.objects.bulk_create(righe, batch_size=2000)
+        totale += len(righe)
+    return totale
+
+
+def rimuovi(modello, pk) -> None:
+    from .models import IndiceRicerca
+
+    IndiceRicerca.objects.filter(modello=chiave_modello(modello), oggetto_id=pk).delete()
+
+
+# ==============================
+# Ricerca
+# ==============================
+def _voci_indice(modello, grammi):
+    from .models import IndiceRicerca
+
+    return IndiceRicerca.objects.filter(modello=chiave_modello(modello), ngramma__in=grammi)
+
+
+def _frequenze(modello, grammi) -> dict[str, int]:
+    """Oggetti per trigramma, in cache uno per uno: si contano solo quelli mai visti."""
+    chiavi = {g: chiave_cache("ricerca", "frequenza", chiave_modello(modello), g) for g in grammi}
+    trovate = cache.get_many(list(chiavi.values()))
+    frequenze = {g: trovate[k] for g, k in chiavi.items() if k in trovate}
+    mancanti = [g for g in grammi if g not in frequenze]
+    if mancanti:
+        contate = dict(
+            _voci_indice(modello, mancanti).values("ngramma").annotate(n=Count("id")).values_list("ngramma", "n")
+        )
+        nuove = {g: contate.get(g, 0) for g in mancanti}
+        cache.set_many({chiavi[g]: n for g, n in nuove.items()}, RICERCA_FREQUENZE_TTL)
+        frequenze.update(nuove)
+    return frequenze
+
+
+def _piu_rari(frequenze: dict, grammi, quanti: int) -> list[str]:
+    return sorted(grammi, key=lambda g: (frequenze.get(g, 0), g))[:quanti]
+
+
+def candidati(modello, q: str, *, esatta: bool = False):
+    """
+    (subquery, stima): subquery degli id di `modello` compatibili con `q` (da usare in
+    pk__in, così i filtri della lista si applicano nella stessa query) e un massimo dei
+    suoi id; None se la query non ha trigrammi (parole tutte sotto i 3 caratteri): in
+    quel caso l'indice non serve.
+    Con `esatta` contano solo i trigrammi interni, tutti presenti (niente refusi).
+
+    Il conteggio per oggetto si fa solo su chi ha uno dei trigrammi più rari (se lo sono davvero):
+    - tutti gli interni presenti -> c'è anche il più raro degli interni;
+    - almeno `soglia` su `len(grammi)` -> c'è almeno uno dei `len(grammi) - soglia + 1` più rari.
+    """
+    interni = ngrammi(q, bordi=False)
+    if not interni:
+        return None
+    grammi = interni if esatta else ngrammi(q)
+    frequenze = _frequenze(modello, grammi)
+    rari = set(_piu_rari(frequenze, interni, 1))
+    if not esatta:
+        soglia = math.ceil(len(grammi) * RICERCA_SOGLIA)
+        rari.update(_piu_rari(frequenze, grammi, len(grammi) - soglia + 1))
+    # ogni candidato ha almeno uno dei trigrammi rari
+    stima = sum(frequenze[g] for g in rari)
+    voci = _voci_indice(modello, grammi)
+    # se anche i più rari sono comuni (es. "esempio" in tutte le email) il filtro non toglie nulla
+    if stima * RICERCA_PREFILTRO_RAPPORTO <= sum(frequenze.values()):
+        voci = voci.filter(oggetto_id__in=_voci_indice(modello, rari).values("oggetto_id"))
+    if esatta:
+        voci = voci.values("oggetto_id").annotate(n=Count("id")).filter(n=len(interni))
+    else:
+        voci = (
+            voci.values("oggetto_id")
+            .annotate(n=Count("id"), n_interni=Count("id", filter=Q(ngramma__in=interni)))
+            .filter(Q(n__gte=soglia) | Q(n_interni=len(interni)))
+        )
+    return voci.values("oggetto_id"), stima
+
+
+def rilevanza(modello, q: str):
+    """Trigrammi in comune con `q` per ogni riga (subquery correlata, per order_by)."""
+    return Coalesce(
+        Subquery(
+            _voci_indice(modello, ngrammi(q))
+            .filter(oggetto_id=OuterRef("pk"))
+            .values("oggetto_id")
+            .annotate(n=Count("id"))
+            .values("n")
+        ),
+        0,
+    )
+
+
+def _contiene(modello, termine: str) -> Q:
+    condizione = Q()
+    for campo in CAMPI_RICERCA[chiave_modello(modello)]:
+        condizione |= Q(**{f"{campo}__icontains": termine})
+    return condizione
+
+
+def filtra_ricerca(qs, q: str, *, esatta: bool = False):
+    """
+    Applica la ricerca `q` a un queryset di Lead / Cliente.
+    Ritorna (qs filtrato, espressione di rilevanza per order_by o None).
+    Rilevanza None anche con più di RICERCA_RILEVANZA_MAX candidati stimati.
+
+    `esatta` (scritture massive): ogni parola di `q` deve comparire così com'è in
+    uno dei campi; l'indice restringe solo le righe da controllare con i LIKE.
+    """
+    modello = qs.model
+    trovati = candidati(modello, q, esatta=esatta)
+    if trovati is None:
+        return qs.filter(_contiene(modello, q)), None
+    ids, stima = trovati
+    qs = qs.filter(pk__in=ids)
+    if esatta:
+        for termine in q.split():
+            qs = qs.filter(_contiene(modello, termine))
+        return qs, None
+    return qs, rilevanza(modello, q) if stima <= RICERCA_RILEVANZA_MAX else None
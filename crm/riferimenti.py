@@ -0,0 +1,54 @@
+# crm/riferimenti.py
+"""
+Dati di riferimento: tabelle piccole lette in quasi ogni pagina e form
+(oggi i consulenti), tenute in cache come lista di oggetti.
+
+Ogni elenco ha un namespace di crm/cache.py: i signal lo invalidano a ogni
+save/delete del modello (vedi signals.CACHE_DA_INVALIDARE). Per i form c'è
+RiferimentoChoiceField in crm/forms.py, che prende scelte e validazione da qui.
+
+Le letture che validano un input (`convalida=True`) usano la cache solo se è
+condivisa: con la cache in memoria un processo non vede le invalidazioni degli
+altri e accetterebbe, es., un consulente appena disattivato per tutto il TTL.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+from .cache import cache_condivisa, ricorda
+from .models import Consulente
+
+TTL_RIFERIMENTI = 3600
+
+
+@dataclass(frozen=True)
+class Riferimento:
+    namespace: str
+    modello: type
+    filtro: tuple = ()          # coppie (lookup, valore)
+    ordinamento: tuple = ()
+
+    def queryset(self):
+        return self.modello._default_manager.filter(**dict(self.filtro)).order_by(*self.ordinamento)
+
+
+RIFERIMENTI = {
+    "consulenti": Riferimento("consulenti", Consulente, ordinamento=("nome",)),
+    "consulenti_attivi": Riferimento("consulenti", Consulente, filtro=(("is_active", True),), ordinamento=("nome",)),
+}
+
+
+def elenco(nome: str, *, convalida: bool = False) -> list:
+    riferimento = RIFERIMENTI[nome]
+    if convalida and not cache_condivisa():
+        return list(riferimento.queryset())
+    return ricorda(riferimento.namespace, nome, calcola=lambda: list(riferimento.queryset()), timeout=TTL_RIFERIMENTI)
+
+
+def per_pk(nome: str, *, convalida: bool = False) -> dict:
+    return {obj.pk: obj for obj in elenco(nome, convalida=convalida)}
+
+
+def consulenti_attivi() -> list[Consulente]:
+    """Consulenti attivi per menu a tendina e filtri, ordinati per nome."""
+    return elenco("consulenti_attivi")
@@ -0,0 +1,115 @@
+# crm/ruoli.py
+"""
+Risoluzione del ruolo utente (ProfiloUtente.ruolo) senza query a ogni controllo.
+
+Ordine di lookup:
+  1. memo sull'oggetto utente (vale per tutta la richiesta)
+  2. cache `crm:ruolo:<id>`, aggiornata in scrittura quando il profilo cambia
+  3. claim firmato in sessione / nel JWT, se emesso da meno di CLAIM_DURATA
+  4. database (il risultato va in cache)
+
+Un cambio di ruolo è visibile subito dove la cache è condivisa; altrimenti
+dopo al massimo RUOLO_CACHE_TTL / CLAIM_DURATA secondi.
+"""
+from __future__ import annotations
+
+import time
+
+from django.core import signing
+from django.core.cache import cache
+
+RUOLI_PORTALE = ("admin", "operatore", "legale")
+
+RUOLO_CACHE_TTL = 5 * 60
+CLAIM_DURATA = 5 * 60
+
+SESSIONE_CHIAVE = "_crm_ruolo"
+SESSIONE_SALT = "crm.ruoli.sessione"
+
+
+def _chiave_cache(user_id) -> str:
+    return f"crm:ruolo:{user_id}"
+
+
+def _dal_database(user_id) -> str:
+    from .models import ProfiloUtente
+
+    return ProfiloUtente.objects.filter(utente_id=user_id).values_list("ruolo", flat=True).first() or ""
+
+
+def ruolo_utente(user) -> str:
+    """Ruolo del profilo ('admin', 'operatore', 'legale') oppure '' se assente / anonimo."""
+    if not getattr(user, "is_authenticated", False):
+        return ""
+    ruolo = getattr(user, "_crm_ruolo", None)
+    if ruolo is not None:
+        return ruolo
+
+    ruolo = cache.get(_chiave_cache(user.pk))
+    if ruolo is None:
+        ruolo = getattr(user, "_crm_claim_ruolo", None)
+        if ruolo is None:
+            ruolo = _dal_database(user.pk)
+            cache.set(_chiave_cache(user.pk), ruolo, RUOLO_CACHE_TTL)
+    user._crm_ruolo = ruolo
+    return ruolo
+
+
+def ruolo_per_id(user_id) -> str:
+    ruolo = cache.get(_chiave_cache(user_id))
+    if ruolo is None:
+        ruolo = _dal_database(user_id)
+        cache.set(_chiave_cache(user_id), ruolo, RUOLO_CACHE_TTL)
+    return ruolo
+
+
+def aggiorna_ruolo_in_cache(user_id, ruolo: str | None) -> None:
+    """Da chiamare quando il profilo cambia: la cache prevale sui claim già emessi."""
+    cache.set(_chiave_cache(user_id), ruolo or "", RUOLO_CACHE_TTL)
+
+
+def applica_claim(user, ruolo, emesso_il) -> None:
+    """Registra sull'utente un ruolo dichiarato in un claim, se abbastanza recente."""
+    try:
+        fresco = time.time() - float(emesso_il) <= CLAIM_DURATA
+    except (TypeError, ValueError):
+        return
+    if fresco and isinstance(ruolo, str):
+        user._crm_claim_ruolo = ruolo
+
+
+# --- Predicati usati da view e permessi API ---
+
+def has_portal_access(user) -> bool:
+    if not getattr(user, "is_authenticated", False):
+        return False
+    return user.is_superuser or ruolo_utente(user) in RUOLI_PORTALE
+
+
+def is_admin(user) -> bool:
+    if not getattr(user, "is_authenticated", False):
+        return False
+    return user.is_superuser or ruolo_utente(user) == "admin"
+
+
+def is_operatore(user) -> bool:
+    return getattr(user, "is_authenticated", False) and ruolo_utente(user) in ("operatore", "legale")
+
+
+# --- Claim firmato in sessione ---
+
+def leggi_claim_sessione(valore, user_id):
+    """(ruolo, emesso_il) dal valore firmato in sessione, se valido e dello stesso utente."""
+    if not valore:
+        return None
+    try:
+        dati = signing.loads(valore, salt=SESSIONE_SALT, max_age=CLAIM_DURATA)
+    except signing.BadSignature:
+        return None
+    if str(dati.get("u")) != str(user_id):
+        return None
+    return dati.get("r"), dati.get("t")
+
+
+def firma_claim_sessione(user_id, ruolo: str) -> str:
+    return signing.dumps({"u": user_id, "r": ruolo, "t": int(time.time())}, salt=SESSIONE_SALT)
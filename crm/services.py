@@ -1,10 +1,21 @@
 # crm/services.py
 from __future__ import annotations
-from django.db import transaction
+from collections import defaultdict
+from datetime import timedelta
+from heapq import merge
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, Q
 from django.utils import timezone
 from django.utils.text import capfirst
 import os
-from .models import Cliente, Lead, Notifica
+from .cache import invalida_dopo_commit, memorizzata, ricorda
+from .eventi import pubblica_dopo_commit
+from .ricerca import indicizza_ids
+from .models import (
+    chiave_naturale_lead,
+    Cancellazione, Cliente, Lead, LeadArchivio, NotaLead, NotaLeadArchivio,
+    Notifica, NotificaLetta, NotificaLettura, SchedaConsulenza,
+)
 
 @transaction.atomic
 def converti_lead_in_cliente(lead: Lead, user=None) -> Cliente:
@@ -40,10 +51,426 @@ def converti_lead_in_cliente(lead: Lead, user=None) -> Cliente:
     lead.convertito_da = user if user and getattr(user, "is_authenticated", False) else None
     lead.convertito_cliente = cliente
     lead.stato = "positivo"
-    lead.save(update_fields=["convertito", "convertito_il", "convertito_da", "convertito_cliente", "stato"])
+    lead.save(update_fields=["convertito", "convertito_il", "convertito_da", "convertito_cliente", "stato", "aggiornato_il"])
 
     return cliente
 
+# Dimensione dei blocchi per le azioni massive sui lead
+AZIONI_MASSA_CHUNK = 1000
+
+
+def aggiorna_lead_in_massa(qs, *, chunk_size: int = AZIONI_MASSA_CHUNK, **valori) -> int:
+    """
+    Applica `valori` ai lead di `qs` con UPDATE set-based, a blocchi di `chunk_size` pk
+    (niente IN enormi né lock lunghi su selezioni molto grandi).
+    Ritorna il numero di lead aggiornati.
+    """
+    if not valori:
+        return 0
+
+    base = qs.order_by("pk").values_list("pk", flat=True)
+    totale = 0
+    ultimo_pk = 0
+    while True:
+        # keyset sul pk: avanza anche se l'UPDATE fa uscire i lead dal filtro
+        pks = list(base.filter(pk__gt=ultimo_pk)[:chunk_size])
+        if not pks:
+            break
+        with transaction.atomic():
+            # .update() non tocca i campi auto_now; ora per blocco: un timestamp preso all'inizio
+            # finirebbe dietro al cursore `changes` dei client per i blocchi confermati dopo SYNC_MARGINE
+            valori_blocco = {"aggiornato_il": timezone.now(), **valori}
+            totale += Lead.objects.filter(pk__in=pks).update(**valori_blocco)
+            # .update() non emette post_save: un evento per blocco ai client SSE
+            pubblica_dopo_commit("lead_massa", {"ids": pks, "campi": sorted(valori_blocco)})
+            invalida_dopo_commit("lead")
+        ultimo_pk = pks[-1]
+    return totale
+
+# Dimensione dei blocchi (una transazione ciascuno) per l'upsert massivo dei lead
+UPSERT_LEAD_BATCH = 500
+
+
+def upsert_lead(righe: list[dict], *, batch: int = UPSERT_LEAD_BATCH) -> list[dict]:
+    """
+    Crea o aggiorna lead sulla chiave naturale (chiave_naturale_lead: telefono/email).
+    `righe` sono dati già validati, nell'ordine della richiesta. Per ogni blocco di
+    `batch` righe: una transazione e un bulk_create(update_conflicts=True) per ogni
+    insieme di campi presenti, così i campi non inviati non vengono sovrascritti.
+
+    Ritorna un esito per riga: {"id", "status": "created" | "updated" | "skipped"}
+    oppure {"status": "error", "errors": {...}}.
+    """
+    esiti: list[dict | None] = [None] * len(righe)
+    chiavi = [chiave_naturale_lead(dati.get("telefono"), dati.get("email")) for dati in righe]
+    for i, chiave in enumerate(chiavi):
+        if chiave is None:
+            esiti[i] = {"status": "error", "errors": {"non_field_errors": ["Serve il telefono o l'email."]}}
+
+    # MySQL/MariaDB: ON DUPLICATE KEY UPDATE scatta su qualunque chiave univoca, niente target
+    conflitto = {"unique_fields": ["chiave_naturale"]} if connection.features.supports_update_conflicts_with_target else {}
+
+    valide = [i for i, esito in enumerate(esiti) if esito is None]
+    for inizio in range(0, len(valide), batch):
+        blocco = valide[inizio:inizio + batch]
+        # stessa chiave più volte nel blocco: vale l'ultima riga
+        per_chiave = {chiavi[i]: i for i in blocco}
+
+        with transaction.atomic():
+            esistenti = set(
+                Lead.objects.filter(chiave_naturale__in=per_chiave).values_list("chiave_naturale", flat=True)
+            )
+            gruppi = defaultdict(list)
+            for chiave, i in per_chiave.items():
+                gruppi[frozenset(righe[i])].append(Lead(**righe[i], chiave_naturale=chiave))
+            for campi, leads in gruppi.items():
+                Lead.objects.bulk_create(
+                    leads,
+                    update_conflicts=True,
+                    update_fields=sorted(campi | {"aggiornato_il"}),
+                    **conflitto,
+                )
+            ids = dict(Lead.objects.filter(chiave_naturale__in=per_chiave).values_list("chiave_naturale", "pk"))
+            # bulk_create non passa dai signal: indice di ricerca aggiornato qui
+            indicizza_ids(Lead, ids.values())
+            # bulk_create non emette post_save: un evento per blocco ai client SSE
+            pubblica_dopo_commit("lead_massa", {
+                "ids": sorted(ids.values()),
+                "campi": sorted(set().union(*gruppi)),
+            })
+            invalida_dopo_commit("lead")
+
+        for i in blocco:
+            chiave = chiavi[i]
+            if per_chiave[chiave] != i:
+                esiti[i] = {"id": ids[chiave], "status": "skipped"}
+            else:
+                esiti[i] = {"id": ids[chiave], "status": "updated" if chiave in esistenti else "created"}
+    return esiti
+
+RICHIAMI_MINUTI_DEFAULT = 30
+
+
+def parametri_richiami(params) -> dict:
+    """
+    ?minuti= (1..1440) e ?consulente=<id> della coda richiami, come kwargs per
+    richiami_in_scadenza. Condiviso da pagina HTML, long-poll e API.
+    """
+    try:
+        minuti = max(1, min(int(params.get("minuti", RICHIAMI_MINUTI_DEFAULT)), 24 * 60))
+    except (TypeError, ValueError):
+        minuti = RICHIAMI_MINUTI_DEFAULT
+    consulente_id = (params.get("consulente") or "").strip()
+    return {"minuti": minuti, "consulente_id": int(consulente_id) if consulente_id.isdigit() else None}
+
+
+def richiami_in_scadenza(*, minuti: int = RICHIAMI_MINUTI_DEFAULT, consulente_id=None, arretrati_ore: int = 24, limite: int = 200) -> list[dict]:
+    """
+    Coda richiami: lead non archiviati con `richiamare_il` o `appuntamento_previsto`
+    tra (ora - arretrati_ore) e (ora + minuti), ordinati per scadenza.
+    Una query per colonna (ognuna sul proprio indice), poi merge ordinato in Python.
+    Ritorna dict {lead, scadenza, tipo, scaduto}.
+    """
+    ora = timezone.now()
+    inizio = ora - timedelta(hours=arretrati_ore)
+    fine = ora + timedelta(minutes=minuti)
+
+    base = Lead.objects.filter(is_archiviato=False).select_related("consulente")
+    if consulente_id:
+        base = base.filter(consulente_id=consulente_id)
+
+    def _coda(campo, tipo):
+        qs = base.filter(**{f"{campo}__gte": inizio, f"{campo}__lte": fine}).order_by(campo, "pk")[:limite]
+        for lead in qs:
+            scadenza = getattr(lead, campo)
+            yield {"lead": lead, "scadenza": scadenza, "tipo": tipo, "scaduto": scadenza <= ora}
+
+    richiami = merge(
+        _coda("richiamare_il", "richiamo"),
+        _coda("appuntamento_previsto", "appuntamento"),
+        key=lambda r: (r["scadenza"], r["lead"].pk),
+    )
+    return list(richiami)[:limite]
+
+
+def lead_archiviabili(prima_di):
+    """
+    Lead archiviati, convertiti o con esito negativo, non modificati da `prima_di`.
+    Esclusi quelli con schede di consulenza (verrebbero cancellate in cascata).
+    """
+    return (
+        Lead.objects.filter(Q(is_archiviato=True) | Q(convertito=True) | Q(stato="negativo"))
+        .filter(aggiornato_il__lt=prima_di)
+        .exclude(Exists(SchedaConsulenza.objects.filter(lead=OuterRef("pk"))))
+    )
+
+
+# campi di Lead che non si archiviano: chiave_naturale si ricava da telefono/email
+LEAD_CAMPI_NON_ARCHIVIATI = {"chiave_naturale"}
+
+
+def archivia_lead(*, prima_di, batch: int = 500) -> tuple[int, int]:
+    """
+    Sposta i lead archiviabili (e le loro note) in LeadArchivio/NotaLeadArchivio,
+    un blocco di `batch` lead per transazione. Ritorna (lead archiviati, note archiviate).
+    """
+    campi_lead = [f.attname for f in LeadArchivio._meta.concrete_fields if f.name != "archiviato_il"]
+    campi_nota = [f.attname for f in NotaLeadArchivio._meta.concrete_fields]
+    # un campo di Lead senza colonna in archivio andrebbe perso alla cancellazione del lead
+    mancanti = (
+        {f.attname for f in Lead._meta.concrete_fields} - set(campi_lead) - LEAD_CAMPI_NON_ARCHIVIATI
+    ) | ({f.attname for f in NotaLead._meta.concrete_fields} - set(campi_nota))
+    if mancanti:
+        raise RuntimeError(f"Campi senza colonna in archivio: {', '.join(sorted(mancanti))}")
+
+    tot_lead = tot_note = 0
+    ultimo_pk = 0
+    while True:
+        pks = list(
+            lead_archiviabili(prima_di)
+            .filter(pk__gt=ultimo_pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:batch]
+        )
+        if not pks:
+            break
+        ultimo_pk = pks[-1]
+
+        with transaction.atomic():
+            # ricontrollo sotto lock: nel frattempo il lead può essere stato modificato
+            leads = list(lead_archiviabili(prima_di).select_for_update().filter(pk__in=pks))
+            if not leads:
+                continue
+            ids = [lead.pk for lead in leads]
+            note = list(NotaLead.objects.filter(lead_id__in=ids))
+
+            LeadArchivio.objects.bulk_create(
+                [LeadArchivio(**{c: getattr(lead, c) for c in campi_lead}) for lead in leads]
+            )
+            NotaLeadArchivio.objects.bulk_create(
+                [NotaLeadArchivio(**{c: getattr(n, c) for c in campi_nota}) for n in note]
+            )
+            Lead.objects.filter(pk__in=ids).delete()
+
+        tot_lead += len(ids)
+        tot_note += len(note)
+    return tot_lead, tot_note
+
+
+# ==============================
+# Report e contatori (in cache, vedi crm/cache.py)
+# ==============================
+# I contatori sono invalidati a ogni scrittura sui lead; il TTL è solo una rete di sicurezza
+LEAD_CONTEGGI_TTL = 60
+
+
+@memorizzata("lead", timeout=LEAD_CONTEGGI_TTL)
+def conteggi_lead_per_stato() -> dict[str, int]:
+    """Lead non archiviati per stato_operativo, con un solo GROUP BY."""
+    return dict(
+        Lead.objects.filter(is_archiviato=False)
+        .order_by()
+        .values_list("stato_operativo")
+        .annotate(n=Count("pk"))
+    )
+
+
+@memorizzata("lead", timeout=120)
+def statistiche_report_lead(oggi) -> dict:
+    """Numeri del report giornaliero lead per la data `oggi`."""
+    qs_oggi = Lead.objects.filter(is_archiviato=False, creato_il__date=oggi)
+
+    # Statistiche per stato (solo lead creati oggi)
+    stats = [(label, qs_oggi.filter(stato_operativo=val).count()) for val, label in Lead.StatoOperativo.choices]
+
+    # Trend ultimi 7 giorni (lead creati per giorno)
+    trend_labels = []
+    trend_values = []
+    for i in range(6, -1, -1):
+        d = oggi - timedelta(days=i)
+        cnt = Lead.objects.filter(is_archiviato=False, creato_il__date=d).count()
+        trend_labels.append(d.strftime("%d/%m"))
+        trend_values.append(cnt)
+
+    # Ieri per confronto
+    totale_ieri = trend_values[-2]
+    totale_oggi = trend_values[-1]
+    return {
+        "totale_oggi": totale_oggi,
+        "totale_attivi": Lead.objects.filter(is_archiviato=False).count(),
+        "stats_stato": stats,
+        "trend_labels": trend_labels,
+        "trend_values": trend_values,
+        "delta_ieri": totale_oggi - totale_ieri if totale_ieri else totale_oggi,
+        "totale_ieri": totale_ieri,
+    }
+
+
+# ==============================
+# Notifiche: stato di lettura per utente (watermark + eccezioni sparse)
+# ==============================
+def _ultima_notifica_id() -> int:
+    # sempre dal DB (una lettura sull'indice della pk): decide watermark ed ETag, una copia
+    # in cache di un altro processo farebbe fermare "segna tutte lette" prima dell'ultima
+    return Notifica.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+
+
+def notifiche_recenti(limite: int = 10) -> list:
+    """Ultime notifiche per la sidebar, uguali per tutti: lo stato di lettura si applica dopo (marca_stato_lettura)."""
+    return ricorda(
+        "notifiche", "recenti", limite,
+        calcola=lambda: list(Notifica.objects.order_by("-id")[:limite]),
+    )
+
+
+def lettura_notifiche(user) -> NotificaLettura:
+    """
+    Watermark dell'utente. Un utente nuovo parte da "tutto letto fino ad ora":
+    lo storico precedente al suo arrivo non gli compare come non letto.
+    """
+    lettura = getattr(user, "_lettura_notifiche", None)
+    if lettura is None:
+        lettura, _ = NotificaLettura.objects.get_or_create(
+            utente=user, defaults={"letto_fino_a": _ultima_notifica_id}  # calcolato solo alla creazione
+        )
+        user._lettura_notifiche = lettura
+    return lettura
+
+
+def notifiche_non_lette(user):
+    """QuerySet delle notifiche non lette: range sulla pk oltre il watermark, meno le eccezioni."""
+    watermark = lettura_notifiche(user).letto_fino_a
+    return Notifica.objects.filter(pk__gt=watermark).exclude(
+        pk__in=NotificaLetta.objects.filter(utente=user, notifica_id__gt=watermark).values("notifica_id")
+    )
+
+
+def conta_notifiche_non_lette(user) -> int:
+    """Due count su range indicizzati (pk e (utente, notifica)), nessuna join utenti × notifiche."""
+    watermark = lettura_notifiche(user).letto_fino_a
+    oltre = Notifica.objects.filter(pk__gt=watermark).count()
+    if not oltre:
+        return 0
+    eccezioni = NotificaLetta.objects.filter(utente=user, notifica_id__gt=watermark).count()
+    return max(0, oltre - eccezioni)
+
+
+def marca_stato_lettura(user, notifiche) -> list:
+    """Imposta `letta` su ogni notifica della pagina (una sola query per le eccezioni)."""
+    notifiche = list(notifiche)
+    watermark = lettura_notifiche(user).letto_fino_a
+    oltre = [n.pk for n in notifiche if n.pk > watermark]
+    lette = set(
+        NotificaLetta.objects.filter(utente=user, notifica_id__in=oltre).values_list("notifica_id", flat=True)
+    ) if oltre else set()
+    for n in notifiche:
+        n.letta = n.pk <= watermark or n.pk in lette
+    return notifiche
+
+
+def segna_notifica_letta(user, notifica_id: int) -> None:
+    lettura = lettura_notifiche(user)
+    if notifica_id <= lettura.letto_fino_a or not Notifica.objects.filter(pk=notifica_id).exists():
+        return
+    with transaction.atomic():
+        NotificaLetta.objects.bulk_create(
+            [NotificaLetta(utente=user, notifica_id=notifica_id)], ignore_conflicts=True
+        )
+        _compatta_letture(user, lettura)
+
+
+def _compatta_letture(user, lettura: NotificaLettura) -> None:
+    """
+    Fa avanzare il watermark finché le notifiche successive sono tutte tra le eccezioni,
+    poi elimina le eccezioni ormai coperte: il set resta sparso.
+    """
+    watermark = lettura.letto_fino_a
+    eccezioni = NotificaLetta.objects.filter(utente=user, notifica_id__gt=watermark)
+    prossima_non_letta = (
+        Notifica.objects.filter(pk__gt=watermark)
+        .exclude(pk__in=eccezioni.values("notifica_id"))
+        .order_by("pk")
+        .values_list("pk", flat=True)
+        .first()
+    )
+    if prossima_non_letta is None:
+        nuovo = eccezioni.order_by("-notifica_id").values_list("notifica_id", flat=True).first() or watermark
+    else:
+        nuovo = prossima_non_letta - 1
+    if nuovo > watermark:
+        _avanza_watermark(user, lettura, nuovo)
+
+
+def _avanza_watermark(user, lettura: NotificaLettura, nuovo: int) -> None:
+    lettura.letto_fino_a = nuovo
+    lettura.save(update_fields=["letto_fino_a", "aggiornato_il"])
+    NotificaLetta.objects.filter(utente=user, notifica_id__lte=nuovo).delete()
+
+
+def segna_tutte_notifiche_lette(user) -> None:
+    lettura = lettura_notifiche(user)
+    ultima = _ultima_notifica_id()
+    if ultima > lettura.letto_fino_a:
+        with transaction.atomic():
+            _avanza_watermark(user, lettura, ultima)
+
+
+def notifiche_da_pulire(*, prima_di, max_prima_di=None):
+    """
+    Notifiche create prima di `prima_di` e già lette da tutti gli utenti attivi
+    (id <= watermark minimo); con `max_prima_di` anche quelle più vecchie di quella data, lette o no.
+    """
+    watermark_minimo = (
+        NotificaLettura.objects.filter(utente__is_active=True)
+        .order_by("letto_fino_a")
+        .values_list("letto_fino_a", flat=True)
+        .first()
+    )
+    condizione = Q(created_at__lt=prima_di)
+    if watermark_minimo is not None:
+        condizione &= Q(pk__lte=watermark_minimo)
+    if max_prima_di is not None:
+        condizione |= Q(created_at__lt=max_prima_di)
+    return Notifica.objects.filter(condizione)
+
+
+def pulisci_notifiche_lette(*, prima_di, max_prima_di=None, batch: int = 1000) -> int:
+    """
+    Cancella le notifiche_da_pulire a blocchi di `batch` (transazioni brevi,
+    niente lock lunghi sulla tabella). Ritorna quante ne ha cancellate.
+    """
+    totale = 0
+    while True:
+        pks = list(
+            notifiche_da_pulire(prima_di=prima_di, max_prima_di=max_prima_di)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:batch]
+        )
+        if not pks:
+            break
+        _, per_modello = Notifica.objects.filter(pk__in=pks).delete()
+        totale += per_modello.get(Notifica._meta.label, 0)
+    if totale:
+        invalida_dopo_commit("notifiche")
+    return totale
+
+
+def pulisci_cancellazioni(*, prima_di, batch: int = 1000) -> int:
+    """
+    Cancella a blocchi i tombstone (Cancellazione) più vecchi di `prima_di`.
+    I cursori `changes` emessi prima di quella data non sono più validi (vedi sincronizzazione).
+    """
+    totale = 0
+    while True:
+        pks = list(
+            Cancellazione.objects.filter(eliminato_il__lt=prima_di).order_by("pk").values_list("pk", flat=True)[:batch]
+        )
+        if not pks:
+            break
+        totale += Cancellazione.objects.filter(pk__in=pks).delete()[0]
+    return totale
+
+
 # crm/services.py
 def notifica_documento_caricato(
     *, 
@@ -1,7 +1,17 @@
-from django.db.models.signals import post_save
+from django.db.models import Model
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import ProfiloUtente
+from django.utils import timezone
+from .api.autenticazione import revoca_token_utente
+from .cache import invalida_dopo_commit
+from .eventi import pubblica_dopo_commit
+from .models import (
+    Cancellazione, Cliente, Consulente, DocumentoCliente, Lead, Nota, NotaLead, Notifica, Pratiche, ProfiloUtente,
+    SchedaConsulenza,
+)
+from .ricerca import CAMPI_RICERCA, chiave_modello, indicizza, rimuovi
+from .ruoli import aggiorna_ruolo_in_cache
 
 @receiver(post_save, sender=User)
 def crea_profilo_utente(sender, instance, created, **kwargs):
@@ -9,5 +19,148 @@ def crea_profilo_utente(sender, instance, created, **kwargs):
         ProfiloUtente.objects.create(utente=instance)
 
 @receiver(post_save, sender=User)
-def salva_profilo_utente(sender, instance, **kwargs):
-    instance.profiloutente.save()
+def salva_profilo_utente(sender, instance, created, **kwargs):
+    # Scrive il profilo solo se è già caricato su questo User e qualche campo è cambiato:
+    # un salvataggio di User (es. last_login a ogni login) non costa query sul profilo.
+    if created:
+        return
+    profilo = instance._state.fields_cache.get("profiloutente")
+    if profilo is not None and (campi := profilo.campi_modificati()):
+        profilo.save(update_fields=campi)
+
+@receiver(post_init, sender=User)
+def ricorda_utente_attivo(sender, instance, **kwargs):
+    # is_active com'era alla lettura (User non è nostro: niente from_db come ProfiloUtente)
+    if "is_active" in instance.__dict__:
+        instance._attivo_caricato = instance.is_active
+
+@receiver(post_save, sender=User)
+def revoca_token_utente_disattivato(sender, instance, created, update_fields=None, **kwargs):
+    # i JWT portano il claim `attivo`: disattivare l'utente deve invalidarli, una volta sola
+    # (non a ogni salvataggio di un utente già inattivo, es. last_login o modifiche in admin)
+    if created or (update_fields is not None and "is_active" not in update_fields):
+        return
+    if not instance.is_active and getattr(instance, "_attivo_caricato", True):
+        revoca_token_utente(instance.pk)
+    instance._attivo_caricato = instance.is_active
+
+@receiver(post_save, sender=ProfiloUtente)
+def aggiorna_cache_ruolo(sender, instance, **kwargs):
+    # la cache prevale sui claim di ruolo già emessi (sessione / JWT)
+    aggiorna_ruolo_in_cache(instance.utente_id, instance.ruolo)
+
+@receiver(post_delete, sender=ProfiloUtente)
+def svuota_cache_ruolo(sender, instance, **kwargs):
+    aggiorna_ruolo_in_cache(instance.utente_id, "")
+
+
+# --- Eventi per il canale SSE (vedi crm/eventi.py) ---
+
+@receiver(post_save, sender=Notifica)
+def pubblica_notifica(sender, instance, created, **kwargs):
+    if created:
+        pubblica_dopo_commit("notifica", {
+            "id": instance.pk,
+            "tipo": instance.tipo,
+            "testo": instance.testo,
+            "cliente_id": instance.cliente_id,
+            "created_at": instance.created_at,
+        })
+
+@receiver(post_save, sender=Lead)
+def pubblica_lead(sender, instance, created, **kwargs):
+    pubblica_dopo_commit("lead", {
+        "id": instance.pk,
+        "nuovo": created,
+        "stato": instance.stato,
+        "stato_operativo": instance.stato_operativo,
+        "consulente_id": instance.consulente_id,
+        "is_archiviato": instance.is_archiviato,
+        "aggiornato_il": instance.aggiornato_il,
+    })
+
+@receiver(post_delete, sender=Lead)
+def pubblica_lead_eliminato(sender, instance, **kwargs):
+    pubblica_dopo_commit("lead", {"id": instance.pk, "eliminato": True})
+
+
+# --- Tombstone per la sincronizzazione API (vedi crm/api/sincronizzazione.py) ---
+
+@receiver(post_delete, sender=Cliente)
+@receiver(post_delete, sender=Lead)
+def registra_cancellazione(sender, instance, **kwargs):
+    Cancellazione.objects.create(modello=sender._meta.label_lower, oggetto_id=instance.pk)
+
+
+# --- Invalidazione della cache applicativa (vedi crm/cache.py) ---
+# Le scritture massive (update / bulk_create) invalidano dai servizi.
+
+CACHE_DA_INVALIDARE = {
+    Consulente: ("consulenti",),    # dati di riferimento, vedi crm/riferimenti.py
+    Notifica: ("notifiche",),
+    Lead: ("lead",),
+    # faccette di clienti_tutti (anche i filtri "con documenti" / "con pratiche")
+    Cliente: ("clienti",),
+    DocumentoCliente: ("clienti",),
+    Pratiche: ("clienti",),
+}
+
+
+def invalida_cache_modello(sender, **kwargs):
+    invalida_dopo_commit(*CACHE_DA_INVALIDARE[sender])
+
+
+for _modello in CACHE_DA_INVALIDARE:
+    post_save.connect(invalida_cache_modello, sender=_modello, dispatch_uid=f"cache_save_{_modello.__name__}")
+    post_delete.connect(invalida_cache_modello, sender=_modello, dispatch_uid=f"cache_delete_{_modello.__name__}")
+
+
+# --- Indice di ricerca a trigrammi (vedi crm/ricerca.py) ---
+
+@receiver(post_save, sender=Cliente)
+@receiver(post_save, sender=Lead)
+def aggiorna_indice_ricerca(sender, instance, update_fields=None, **kwargs):
+    # salvataggi parziali che non toccano i campi cercati (es. solo lo stato): niente da fare
+    if update_fields is not None and not set(update_fields) & set(CAMPI_RICERCA[chiave_modello(sender)]):
+        return
+    indicizza(instance)
+
+@receiver(post_delete, sender=Cliente)
+@receiver(post_delete, sender=Lead)
+def rimuovi_da_indice_ricerca(sender, instance, **kwargs):
+    rimuovi(sender, instance.pk)
+
+
+# --- Versione di Cliente / Lead (vedi crm/versioni.py) ---
+# Una modifica o cancellazione di un figlio sposta aggiornato_il del padre:
+# ETag dei dettagli e feed `changes` dell'API se ne accorgono.
+
+FIGLI_DA_TOCCARE = {
+    DocumentoCliente: ("cliente_id",),
+    Nota: ("cliente_id",),
+    Pratiche: ("cliente_id",),
+    NotaLead: ("lead_id",),
+    SchedaConsulenza: ("cliente_id", "lead_id"),
+}
+
+
+def _in_cascata(sender, origin) -> bool:
+    """True se il figlio viene eliminato perché si sta eliminando il padre."""
+    modello = type(origin) if isinstance(origin, Model) else getattr(origin, "model", None)
+    return modello is not None and not issubclass(modello, sender)
+
+
+def tocca_padre(sender, instance, **kwargs):
+    if _in_cascata(sender, kwargs.get("origin")):
+        return
+    adesso = timezone.now()
+    for attributo in FIGLI_DA_TOCCARE[sender]:
+        padre_id = getattr(instance, attributo)
+        if padre_id:
+            padre = Cliente if attributo == "cliente_id" else Lead
+            padre.objects.filter(pk=padre_id).update(aggiornato_il=adesso)
+
+
+for _figlio in FIGLI_DA_TOCCARE:
+    post_save.connect(tocca_padre, sender=_figlio, dispatch_uid=f"tocca_padre_save_{_figlio.__name__}")
+    post_delete.connect(tocca_padre, sender=_figlio, dispatch_uid=f"tocca_padre_delete_{_figlio.__name__}")
@@ -1,3 +1,796 @@
-from django.test import TestCase
+import math
+import random
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+
+from .models import (
+    Cancellazione, Cliente, Consulente, DocumentoCliente, FiltroSalvato, Lead, LeadArchivio, Nota, NotaLead, NotaLeadArchivio,
+    Notifica, Pratiche, ProfiloUtente,
+)
+from .paginazione import codifica_cursore
+from .ricerca import RICERCA_SOGLIA, candidati, filtra_ricerca, indicizza_ids, ngrammi, ngrammi_campi
+from .cache import ricorda
+from .forms import ConsulenteAttivoField
+from .riferimenti import consulenti_attivi
+from .services import (
+    LEAD_CAMPI_NON_ARCHIVIATI, aggiorna_lead_in_massa, archivia_lead, conta_notifiche_non_lette, lettura_notifiche,
+    segna_tutte_notifiche_lette,
+)
+
+
+# ==============================
+# Canale eventi (SSE)
+# ==============================
+class EventiSenzaASGITest(TestCase):
+    """Il client di test è WSGI: niente stream (verrebbe accumulato per sempre) né EventSource."""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser("admin", password="x")
+        self.client.force_login(self.user)
+
+    def test_stream_risponde_204(self):
+        response = self.client.get(reverse("eventi_stream"))
+        self.assertEqual(response.status_code, 204)
+
+    def test_pagine_senza_eventsource(self):
+        response = self.client.get(reverse("dashboard"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "new EventSource")
+
+
+# ==============================
+# Admin profilo utente
+# ==============================
+class ProfiloUtenteAdminTest(TestCase):
+    def test_versione_token_non_modificabile(self):
+        admin_user = User.objects.create_superuser("admin", password="x")
+        self.client.force_login(admin_user)
+        operatore = User.objects.create_user("op", password="x")
+        profilo, _ = ProfiloUtente.objects.get_or_create(utente=operatore)
+        ProfiloUtente.objects.filter(pk=profilo.pk).update(versione_token=F("versione_token") + 5)
+
+        url = reverse("admin:crm_profiloutente_change", args=[profilo.pk])
+        response = self.client.post(url, {"utente": operatore.pk, "ruolo": "legale", "versione_token": 0})
+
+        self.assertEqual(response.status_code, 302)
+        profilo.refresh_from_db()
+        self.assertEqual(profilo.ruolo, "legale")
+        self.assertEqual(profilo.versione_token, 5)
+
+
+# ==============================
+# Login e profilo utente
+# ==============================
+class LoginProfiloTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("op", password="password-di-prova")
+
+    def test_login_senza_query_sul_profilo(self):
+        # SELECT utente, creazione sessione (4), UPDATE last_login, salvataggio sessione (3):
+        # nessuna lettura/scrittura di ProfiloUtente
+        with self.assertNumQueries(9), CaptureQueriesContext(connection) as query:
+            response = self.client.post(reverse("login"), {"username": "op", "password": "password-di-prova"})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse([q["sql"] for q in query if "crm_profiloutente" in q["sql"]])
+
+    def test_salvataggio_user_senza_profilo_caricato(self):
+        with self.assertNumQueries(1):
+            self.user.save()
+
+    def test_ruolo_modificato_salvato_con_user(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.profiloutente.ruolo = "legale"
+        user.save()
+        self.assertEqual(ProfiloUtente.objects.get(utente=user).ruolo, "legale")
+        self.assertEqual(ProfiloUtente.objects.get(utente=user).campi_modificati(), [])
+
+
+# ==============================
+# API clienti: ?expand= e cache del dettaglio
+# ==============================
+class ClienteAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser("admin", password="x")
+        self.operatore = User.objects.create_user("op", password="x")
+        self.api = APIClient()
+
+    def crea_cliente(self, consulente=None):
+        cliente = Cliente.objects.create(nome="Mario", cognome="Rossi", consulente=consulente)
+        DocumentoCliente.objects.create(cliente=cliente, categoria=DocumentoCliente.Categoria.ANAGRAFICI, file="a.pdf")
+        DocumentoCliente.objects.create(cliente=cliente, categoria=DocumentoCliente.Categoria.CONTRATTI, file="c.pdf")
+        Pratiche.objects.create(cliente=cliente, titolo="Pratica")
+        Nota.objects.create(cliente=cliente, autore="op", testo="nota")
+        return cliente
+
+    def conta_query_lista(self):
+        self.api.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as query:
+            response = self.api.get("/api/clienti/", {"expand": "consulente,documenti,pratiche,note,conteggi"})
+        self.assertEqual(response.status_code, 200)
+        return len(query), response.data["results"]
+
+    def test_query_costanti_per_pagina(self):
+        consulente = Consulente.objects.create(nome="Anna")
+        self.crea_cliente(consulente)
+        query_uno, risultati = self.conta_query_lista()
+        self.assertEqual(len(risultati), 1)
+        for _ in range(9):
+            self.crea_cliente(consulente)
+        with self.assertNumQueries(query_uno):
+            self.api.get("/api/clienti/", {"expand": "consulente,documenti,pratiche,note,conteggi"})
+        _, risultati = self.conta_query_lista()
+        self.assertEqual(len(risultati), 10)
+        self.assertEqual(len(risultati[0]["documenti"]), 2)
+
+    @override_settings(API_CACHE_RISPOSTE_TTL=60)
+    def test_cache_dettaglio_separata_per_ruolo(self):
+        cliente = self.crea_cliente()
+        url = f"/api/clienti/{cliente.pk}/"
+
+        self.api.force_authenticate(self.admin)
+        risposta_admin = self.api.get(url, {"expand": "documenti"})
+        self.assertEqual(len(risposta_admin.data["documenti"]), 2)
+
+        self.api.force_authenticate(self.operatore)
+        risposta = self.api.get(url, {"expand": "documenti"})
+        self.assertEqual(len(risposta.data["documenti"]), 1)
+        self.assertNotEqual(risposta["ETag"], risposta_admin["ETag"])
+        # l'ETag dell'admin non vale per l'operatore: niente 304 sul corpo con i "Privato Admin"
+        risposta = self.api.get(url, {"expand": "documenti"}, HTTP_IF_NONE_MATCH=risposta_admin["ETag"])
+        self.assertEqual(risposta.status_code, 200)
+        self.assertEqual(len(risposta.data["documenti"]), 1)
+
+
+# ==============================
+# Lista clienti
+# ==============================
+class ClientiTuttiQueryTest(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser("admin", password="x"))
+        for i in range(100):
+            cliente = Cliente.objects.create(nome=f"Nome{i}", cognome=f"Cognome{i}")
+            DocumentoCliente.objects.create(cliente=cliente, file=f"d{i}a.pdf")
+            DocumentoCliente.objects.create(cliente=cliente, file=f"d{i}b.pdf")
+            Pratiche.objects.create(cliente=cliente, titolo=f"Pratica {i}")
+
+    # query per pagina, qualunque sia ?per=: sessione, utente, count, lettura notifiche,
+    # non lette, clienti con conteggi annotati; a cache vuota anche faccette e contatori sidebar
+    BUDGET_CACHE_VUOTA = 10
+    BUDGET_CACHE_CALDA = 6
+
+    def pagina(self, per, budget):
+        with self.assertNumQueries(budget):
+            response = self.client.get(reverse("clienti_tutti"), {"per": per})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["page_obj"]), per)
+        return response
+
+    def test_query_indipendenti_dalla_dimensione_pagina(self):
+        # primo accesso: crea lettura notifiche e scrive il ruolo in sessione
+        self.client.get(reverse("clienti_tutti"))
+        for per in (20, 100):
+            cache.clear()
+            response = self.pagina(per, self.BUDGET_CACHE_VUOTA)
+            self.pagina(per, self.BUDGET_CACHE_CALDA)
+        # conteggi annotati (num_documenti / num_pratiche) mostrati nella riga
+        self.assertContains(response, 'title="Documenti">2</span>', count=100)
+        self.assertContains(response, 'title="Pratiche">1</span>', count=100)
+
+
+class ListeClientiTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", password="x")
+        self.client.force_login(self.admin)
+
+    def test_cursore_avanti_e_indietro_con_date_uguali(self):
+        clienti = [Cliente.objects.create(nome="N", cognome=f"C{i}") for i in range(8)]
+        adesso = timezone.now()
+        # tre gruppi di date uguali: l'id decide l'ordine dentro il gruppo
+        for i, cliente in enumerate(clienti):
+            Cliente.objects.filter(pk=cliente.pk).update(data_creazione=adesso - timedelta(days=i // 3))
+        attesi = list(Cliente.objects.order_by("-data_creazione", "-id").values_list("pk", flat=True))
+
+        def pagina(cursore=None):
+            params = {"sort": "-data_creazione", "per": 3, **({"cursore": cursore} if cursore else {})}
+            response = self.client.get(reverse("clienti_tutti"), params)
+            return response.context["pagina"]
+
+        avanti, cursore = [], None
+        while True:
+            corrente = pagina(cursore)
+            avanti.append([c.pk for c in corrente])
+            if not corrente.ha_succ:
+                break
+            cursore = corrente.cursore_succ
+        self.assertEqual(avanti, [attesi[0:3], attesi[3:6], attesi[6:8]])
+
+        indietro = [avanti[-1]]
+        while corrente.ha_prec:
+            corrente = pagina(corrente.cursore_prec)
+            indietro.insert(0, [c.pk for c in corrente])
+        self.assertEqual(indietro, avanti)
+
+    def test_filtri_fissi_delle_viste(self):
+        for cognome, stato, fase in [("Alfa", "active", "legale"), ("Beta", "inactive", "istanza"), ("Gamma", "active", "")]:
+            Cliente.objects.create(nome="N", cognome=cognome, stato=stato, fase=fase)
+        # vista -> (cognomi attesi, query string che prova a scavalcare il filtro fisso)
+        viste = {
+            "clienti_legali": ({"Alfa"}, {"fase": "istanza"}),
+            "clienti_attivi": ({"Alfa", "Gamma"}, {"stato": "inactive"}),
+            "clienti_non_attivi": ({"Beta"}, {"stato": "active"}),
+        }
+        for nome, (attesi, scavalca) in viste.items():
+            for params in ({}, scavalca, {"sort": "cognome"}):
+                response = self.client.get(reverse(nome), params)
+                self.assertEqual({c.cognome for c in response.context["clienti"]}, attesi, (nome, params))
+
+        # clienti_possibili non ha un URL: chiamata diretta
+        from .views import clienti_possibili
+
+        request = RequestFactory().get("/", {"fase": "legale"})
+        request.user = self.admin
+        response = clienti_possibili(request)
+        self.assertContains(response, "Beta")
+        self.assertNotContains(response, "Alfa")
+        self.assertNotContains(response, "Gamma")
+
+
+# ==============================
+# Filtri salvati di lead_lista
+# ==============================
+class FiltroSalvatoTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser("admin", password="x")
+        self.client.force_login(self.user)
+        self.leads = [Lead.objects.create(nome=f"Nome{i}", cognome="Rossi", telefono=f"33300{i}") for i in range(3)]
+
+    def test_id_in_cache_senza_lead_archiviati(self):
+        filtro = FiltroSalvato.objects.create(
+            utente=self.user, nome="Rossi", parametri="q=rossi", memorizza_risultati=True,
+        )
+        url = reverse("lead_lista")
+        parametri = {"q": "rossi", "filtro": filtro.pk}
+        self.assertEqual(len(self.client.get(url, parametri).context["leads"]), 3)
+
+        # archiviato dopo che gli id sono in cache: non deve restare nella lista attiva
+        Lead.objects.filter(pk=self.leads[0].pk).update(is_archiviato=True)
+        leads = self.client.get(url, parametri).context["leads"]
+        self.assertEqual(sorted(l.pk for l in leads), sorted(l.pk for l in self.leads[1:]))
+
+
+    @mock.patch("crm.views.FILTRI_SALVATI_IDS_MAX", 2)
+    def test_in_cache_solo_le_prime_pagine(self):
+        from .views import _calcola_ids_filtro
+
+        ids, totale, _ = _calcola_ids_filtro(Lead.objects.order_by("pk"))
+        self.assertEqual((ids, totale), ([l.pk for l in self.leads[:2]], 3))
+
+        filtro = FiltroSalvato.objects.create(utente=self.user, nome="Tutti", memorizza_risultati=True)
+        url = reverse("lead_lista")
+        attesi = [l.pk for l in self.client.get(url, {"per": 3}).context["leads"]]
+
+        pagine = []
+        for page in (1, 2, 3):
+            response = self.client.get(url, {"filtro": filtro.pk, "per": 1, "page": page})
+            self.assertEqual(response.context["page_obj"].paginator.count, 3)
+            pagine += [l.pk for l in response.context["leads"]]
+        self.assertEqual(pagine, attesi)
+
+        with mock.patch("crm.views._calcola_ids_filtro") as calcola:
+            # la terza pagina è oltre gli id in cache: la legge dal queryset, senza ricalcolare la cache
+            response = self.client.get(url, {"filtro": filtro.pk, "per": 1, "page": 3})
+        calcola.assert_not_called()
+        self.assertEqual([l.pk for l in response.context["leads"]], attesi[2:])
+
+# ==============================
+# Ricerca a trigrammi (crm/ricerca.py)
+# ==============================
+class RicercaTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser("admin", password="x"))
+
+    def cerca(self, q, **kwargs):
+        qs, _ = filtra_ricerca(Lead.objects.all(), q, **kwargs)
+        return set(qs.values_list("cognome", flat=True))
+
+    def test_sottostringa(self):
+        Lead.objects.create(nome="Mario", cognome="Rossi", telefono="3331234567")
+        Lead.objects.create(nome="Luca", cognome="Bianchi", telefono="0612345")
+        Lead.objects.create(nome="Ugo", cognome="Verdi", telefono="3339998888")
+        self.assertEqual(self.cerca("ossi"), {"Rossi"})
+        self.assertEqual(self.cerca("1234"), {"Rossi", "Bianchi"})
+        self.assertEqual(self.cerca("mario rossi"), {"Rossi"})
+        # parole sotto i 3 caratteri: LIKE
+        self.assertEqual(self.cerca("ve"), {"Verdi"})
+
+    def test_refuso(self):
+        Lead.objects.create(nome="Mario", cognome="Rossi")
+        Lead.objects.create(nome="Luca", cognome="Bianchi")
+        self.assertEqual(self.cerca("rosi"), {"Rossi"})
+        self.assertEqual(self.cerca("rosi", esatta=True), set())
+
+    def test_nessun_limite_sui_candidati(self):
+        # 650 corrispondenze, le prime 100 (id più bassi) archiviate: la lista le conta tutte
+        # dopo i propri filtri, senza prendere prima i "migliori 500" dall'indice
+        leads = Lead.objects.bulk_create(
+            Lead(nome="Mario", cognome="Rossi", telefono=f"3{i:06d}", is_archiviato=i < 100) for i in range(650)
+        )
+        indicizza_ids(Lead, [l.pk for l in leads])
+        response = self.client.get(reverse("lead_lista"), {"q": "rossi"})
+        self.assertEqual(response.context["page_obj"].paginator.count, 550)
+        self.assertEqual(len(response.context["leads"]), 20)
+
+    def test_filtro_trigrammi_rari_stessi_risultati(self):
+        casuale = random.Random(1)
+        leads = Lead.objects.bulk_create(
+            Lead(
+                nome=casuale.choice(["Mario", "Maria", "Marco", "Luca"]),
+                cognome=casuale.choice(["Rossi", "Russo", "Marino", "Romano"]),
+                email=f"utente{i}@esempio.it",
+            )
+            for i in range(400)
+        )
+        leads.append(Lead.objects.create(nome="Gianfranco", cognome="Zappacosta"))
+        indicizza_ids(Lead, [l.pk for l in leads])
+
+        def attesi(q):
+            # la regola di candidati() applicata a tutti i lead, senza indice
+            interni, grammi = ngrammi(q, bordi=False), ngrammi(q)
+            trovati = set()
+            for lead in Lead.objects.all():
+                propri = ngrammi_campi([lead.nome, lead.cognome, lead.email, lead.telefono])
+                if len(grammi & propri) >= math.ceil(len(grammi) * RICERCA_SOGLIA) or interni <= propri:
+                    trovati.add(lead.pk)
+            return trovati
+
+        for q in ("zappacosta", "mario zappacosta", "gianfranco zapacosta", "mario rossi", "rosi", "mar", "esempio", "utente12"):
+            qs, _ = filtra_ricerca(Lead.objects.all(), q)
+            self.assertEqual(set(qs.values_list("pk", flat=True)), attesi(q), q)
+
+        # trigrammi rari: il conteggio per oggetto legge solo chi ne ha uno, non "__m" & co.
+        sql_rara = str(candidati(Lead, "mario zappacosta")[0].query)
+        self.assertEqual(sql_rara.count('FROM "crm_indicericerca"'), 2)
+        # tutti comuni: il filtro non servirebbe a nulla
+        self.assertEqual(str(candidati(Lead, "esempio")[0].query).count('FROM "crm_indicericerca"'), 1)
+
+        # troppi candidati stimati: niente subquery di rilevanza per riga
+        with mock.patch("crm.ricerca.RICERCA_RILEVANZA_MAX", 100):
+            self.assertIsNotNone(filtra_ricerca(Lead.objects.all(), "mario zappacosta")[1])
+            self.assertIsNone(filtra_ricerca(Lead.objects.all(), "esempio")[1])
+
+    def test_azioni_massa_solo_sottostringhe(self):
+        rossi = Lead.objects.create(nome="Mario", cognome="Rossi", telefono="3331234")
+        rossetti = Lead.objects.create(nome="Mario", cognome="Rossetti", telefono="3331299")
+        # la lista, tollerante ai refusi, li mostra entrambi
+        self.assertEqual(self.cerca("rossi"), {"Rossi", "Rossetti"})
+
+        for q in ("rossi", "3331234"):
+            Lead.objects.update(is_archiviato=False)
+            response = self.client.post(
+                reverse("lead_azioni_massa"),
+                {"tutti": "1", "filtri": f"q={q}", "azione": "archivia"},
+                HTTP_ACCEPT="application/json",
+            )
+            self.assertEqual(response.json(), {"aggiornati": 1})
+            self.assertTrue(Lead.objects.get(pk=rossi.pk).is_archiviato)
+            self.assertFalse(Lead.objects.get(pk=rossetti.pk).is_archiviato)
+
+
+# ==============================
+# Coda richiami
+# ==============================
+class RichiamiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser("admin", password="x")
+        self.anna = Consulente.objects.create(nome="Anna")
+        self.luca = Consulente.objects.create(nome="Luca")
+        tra_poco = timezone.now() + timedelta(minutes=10)
+        self.lead_anna = Lead.objects.create(nome="A", cognome="A", consulente=self.anna, richiamare_il=tra_poco)
+        Lead.objects.create(nome="B", cognome="B", consulente=self.luca, richiamare_il=tra_poco)
+        Lead.objects.create(nome="C", cognome="C", richiamare_il=timezone.now() + timedelta(hours=3))
+
+    def test_stessi_parametri_per_pagina_e_api(self):
+        self.client.force_login(self.user)
+        api = APIClient()
+        api.force_authenticate(self.user)
+        for parametri, attesi in (
+            ({"consulente": self.anna.pk}, 1),
+            ({"minuti": "abc"}, 2),          # non valido: 30 minuti
+            ({"minuti": 24 * 60}, 3),
+        ):
+            pagina = self.client.get(reverse("lead_richiami"), parametri)
+            risposta_api = api.get("/api/leads/richiami/", parametri)
+            self.assertEqual(len(pagina.context["richiami"]), attesi)
+            self.assertEqual(len(risposta_api.data), attesi)
+
+
+# ==============================
+# Azioni massive sui lead
+# ==============================
+class AzioniMassaTest(TestCase):
+    def test_aggiornato_il_per_blocco(self):
+        leads = [Lead.objects.create(nome=f"N{i}", cognome="C", telefono=f"3330{i}") for i in range(3)]
+        inizio = timezone.now()
+        orari = iter([inizio + timedelta(seconds=10 * i) for i in range(3)])
+        with mock.patch("crm.services.timezone.now", side_effect=lambda: next(orari)):
+            aggiornati = aggiorna_lead_in_massa(Lead.objects.all(), chunk_size=1, stato_operativo="segreteria")
+        self.assertEqual(aggiornati, 3)
+        # ogni blocco ha l'ora del proprio UPDATE, non quella d'inizio dell'azione
+        self.assertEqual(
+            [Lead.objects.get(pk=l.pk).aggiornato_il for l in leads],
+            [inizio + timedelta(seconds=10 * i) for i in range(3)],
+        )
+
+
+# ==============================
+# Dati di riferimento (crm/riferimenti.py)
+# ==============================
+class RiferimentiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.consulente = Consulente.objects.create(nome="Anna")
+        self.assertEqual(consulenti_attivi(), [self.consulente])  # elenco in cache
+
+    def disattiva(self, *, invalida):
+        self.consulente.is_active = False
+        # nei TestCase gli on_commit non girano: senza execute la cache resta quella di prima
+        with self.captureOnCommitCallbacks(execute=invalida):
+            self.consulente.save()
+
+    def test_validazione_senza_cache_condivisa_legge_il_db(self):
+        self.disattiva(invalida=False)
+        self.assertEqual(consulenti_attivi(), [self.consulente])  # render: ancora dalla cache
+        with self.assertRaises(ValidationError):
+            ConsulenteAttivoField().clean(self.consulente.pk)
+
+        self.client.force_login(User.objects.create_superuser("admin", password="x"))
+        lead = Lead.objects.create(nome="Mario", cognome="Rossi")
+        response = self.client.post(
+            reverse("lead_azioni_massa"),
+            {"ids": [lead.pk], "azione": "consulente", "valore": self.consulente.pk},
+            HTTP_ACCEPT="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(Lead.objects.get(pk=lead.pk).consulente_id)
+
+    def test_cache_condivisa_invalidata_dal_salvataggio(self):
+        with mock.patch("crm.riferimenti.cache_condivisa", return_value=True):
+            self.assertEqual(ConsulenteAttivoField().clean(self.consulente.pk), self.consulente)
+            self.disattiva(invalida=True)
+            self.assertEqual(consulenti_attivi(), [])
+            with self.assertRaises(ValidationError):
+                ConsulenteAttivoField().clean(self.consulente.pk)
+
+
+# ==============================
+# Archivio lead
+# ==============================
+class ArchiviaLeadTest(TestCase):
+    def test_copia_campo_per_campo(self):
+        consulente = Consulente.objects.create(nome="Anna")
+        adesso = timezone.now()
+        lead = Lead.objects.create(
+            nome="Mario", cognome="Rossi", telefono="3331234567", email="m@x.it",
+            creditore_legale="altro", creditore_legale_altro="Banca X",
+            stato="negativo", stato_operativo="segreteria", appuntamento_previsto=adesso,
+            motivazione_negativa="no", note_operatori="note", provenienza="meta", consulente=consulente,
+            primo_contatto=adesso, is_archiviato=True, consulenza_effettuata=True, no_risposta=True,
+            messaggio_inviato=True, in_acquisizione=True, richiamare_il=adesso, ricontatti_count=3,
+        )
+        nota = NotaLead.objects.create(lead=lead, testo="nota")
+        originale = Lead.objects.get(pk=lead.pk)
+
+        self.assertEqual(archivia_lead(prima_di=adesso + timedelta(days=1)), (1, 1))
+
+        archiviato = LeadArchivio.objects.get(pk=lead.pk)
+        for campo in Lead._meta.concrete_fields:
+            if campo.attname in LEAD_CAMPI_NON_ARCHIVIATI:
+                continue
+            self.assertEqual(getattr(archiviato, campo.attname), getattr(originale, campo.attname), campo.name)
+        self.assertEqual(NotaLeadArchivio.objects.get(pk=nota.pk).testo, "nota")
+        self.assertFalse(Lead.objects.filter(pk=lead.pk).exists())
+
+
+# ==============================
+# Cache applicativa e notifiche
+# ==============================
+class CacheApplicativaTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "TIMEOUT": 0}})
+    def test_ttl_dal_backend(self):
+        # TIMEOUT 0 (CACHE_TTL=0) = non memorizzare: ricorda ricalcola a ogni chiamata
+        calcola = mock.Mock(return_value=1)
+        ricorda("prova", "x", calcola=calcola)
+        ricorda("prova", "x", calcola=calcola)
+        self.assertEqual(calcola.call_count, 2)
+
+    def test_segna_tutte_lette_fino_all_ultima_nel_db(self):
+        user = User.objects.create_user("op", password="x")
+        Notifica.objects.create(testo="prima")
+        lettura_notifiche(user)
+        # nei TestCase l'invalidazione on_commit non scatta: come una cache di un altro processo
+        ultima = [Notifica.objects.create(testo=f"n{i}") for i in range(3)][-1]
+        segna_tutte_notifiche_lette(user)
+        self.assertEqual(lettura_notifiche(user).letto_fino_a, ultima.pk)
+        self.assertEqual(conta_notifiche_non_lette(user), 0)
+
+
+# ==============================
+# Migrazioni con dati
+# ==============================
+class LettureNotificheMigrazioneTest(TransactionTestCase):
+    """0042: da is_read globale a watermark per utente, con poche o nessuna eccezione."""
+
+    prima = [("crm", "0041_notifica_indice_letta_data")]
+    dopo = [("crm", "0042_notifiche_lettura_per_utente")]
+
+    def migra(self, obiettivo):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(obiettivo)
+        return executor.loader.project_state(obiettivo).apps
+
+    def tearDown(self):
+        self.migra(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def prepara(self, letture):
+        apps = self.migra(self.prima)
+        User = apps.get_model("auth", "User")
+        Notifica = apps.get_model("crm", "Notifica")
+        for i in range(2):
+            User.objects.create(username=f"u{i}")
+        for letta in letture:
+            Notifica.objects.create(testo="n", is_read=letta)
+        return Notifica.objects.filter(is_read=False).count()
+
+    def non_lette_dopo(self):
+        apps = self.migra(self.dopo)
+        User = apps.get_model("auth", "User")
+        Notifica = apps.get_model("crm", "Notifica")
+        NotificaLettura = apps.get_model("crm", "NotificaLettura")
+        NotificaLetta = apps.get_model("crm", "NotificaLetta")
+        conteggi = set()
+        for user in User.objects.all():
+            watermark = NotificaLettura.objects.get(utente=user).letto_fino_a
+            oltre = Notifica.objects.filter(pk__gt=watermark).count()
+            conteggi.add(oltre - NotificaLetta.objects.filter(utente=user, notifica_id__gt=watermark).count())
+        return conteggi, NotificaLetta.objects.count()
+
+    def test_poche_lette_oltre_la_prima_non_letta(self):
+        non_lette = self.prepara([True, True, False, True, False, True])
+        conteggi, eccezioni = self.non_lette_dopo()
+        self.assertEqual(conteggi, {non_lette})
+        self.assertEqual(eccezioni, 2 * 2)
+
+    def test_molte_lette_nessuna_eccezione(self):
+        # una vecchia non letta e 250 lette dopo: niente 2 × 250 righe, restano da leggere
+        self.prepara([True, False] + [True] * 250)
+        conteggi, eccezioni = self.non_lette_dopo()
+        self.assertEqual(conteggi, {251})
+        self.assertEqual(eccezioni, 0)
+
+
+# ==============================
+# Revoca JWT alla disattivazione
+# ==============================
+class RevocaTokenDisattivazioneTest(TestCase):
+    def versione(self, user):
+        return ProfiloUtente.objects.get(utente=user).versione_token
+
+    def test_revoca_solo_al_passaggio_a_inattivo(self):
+        user = User.objects.create_user("op", password="x")
+        user.save()
+        self.assertEqual(self.versione(user), 0)
+
+        user = User.objects.get(pk=user.pk)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.versione(user), 1)
+
+        # utente già inattivo: altri salvataggi non toccano versione_token
+        user.first_name = "Mario"
+        user.save()
+        user = User.objects.get(pk=user.pk)
+        user.last_name = "Rossi"
+        user.save()
+        user.save(update_fields=["last_login"])
+        self.assertEqual(self.versione(user), 1)
+
+        user.is_active = True
+        user.save()
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.versione(user), 2)
+
+
+# ==============================
+# Feed calendario e sincronizzazione API
+# ==============================
+class CalendarioLastModifiedTest(TestCase):
+    def test_lead_riassegnato_non_da_304(self):
+        cache.clear()
+        anna = Consulente.objects.create(nome="Anna")
+        luca = Consulente.objects.create(nome="Luca")
+        domani = timezone.now() + timedelta(days=1)
+        Lead.objects.create(nome="Mario", cognome="Rossi", consulente=anna, appuntamento_previsto=domani)
+        spostato = Lead.objects.create(nome="Ugo", cognome="Verdi", consulente=anna, appuntamento_previsto=domani)
+        url = reverse("consulente_calendario_ics", args=[anna.calendario_token])
+
+        prima = self.client.get(url)
+        self.assertContains(prima, "Verdi")
+        # stesso contenuto: 304 anche con il solo If-Modified-Since
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=prima["Last-Modified"]).status_code, 304)
+
+        # il lead esce dal feed senza far crescere Max(aggiornato_il) dei lead rimasti
+        Lead.objects.filter(pk=spostato.pk).update(consulente=luca)
+        dopo = self.client.get(url, HTTP_IF_MODIFIED_SINCE=prima["Last-Modified"])
+        self.assertEqual(dopo.status_code, 200)
+        self.assertNotContains(dopo, "Verdi")
+
+
+class CancellazioniTest(TestCase):
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_superuser("admin", password="x"))
+
+    def test_pulizia_e_cursore_scaduto(self):
+        lead = Lead.objects.create(nome="Mario", cognome="Rossi")
+        lead.delete()
+        vecchio = timezone.now() - timedelta(days=settings.CANCELLAZIONI_RETENTION_GIORNI + 1)
+        Cancellazione.objects.update(eliminato_il=vecchio)
+        Cancellazione.objects.create(modello="crm.lead", oggetto_id=999)
+
+        call_command("pulisci_cancellazioni", stdout=StringIO())
+        self.assertEqual(list(Cancellazione.objects.values_list("oggetto_id", flat=True)), [999])
+
+        # cursore emesso prima della retention: i tombstone intermedi possono mancare
+        scaduto = codifica_cursore([None, None, vecchio])
+        self.assertEqual(self.api.get("/api/leads/changes/", {"since": scaduto}).status_code, 410)
+        since = self.api.get("/api/leads/changes/").data["since"]
+        self.assertEqual(self.api.get("/api/leads/changes/", {"since": since}).status_code, 200)
+
+
+# ==============================
+# Limiti di richieste dell'API (crm/api/throttling.py)
+# ==============================
+# login a vuoto: l'hasher predefinito renderebbe lenti i tentativi
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class ThrottlingAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+
+    def _login(self, **extra):
+        return self.api.post("/api/token/", {"username": "nessuno", "password": "x"}, format="json", **extra)
+
+    def test_login_429_con_retry_after(self):
+        for _ in range(10):
+            self.assertEqual(self._login().status_code, 401)
+        response = self._login()
+        self.assertEqual(response.status_code, 429)
+        # 10/min: un gettone ogni 6 s
+        self.assertIn(int(response["Retry-After"]), range(1, 7))
+
+    def test_x_forwarded_for_non_cambia_secchio(self):
+        for i in range(10):
+            self._login(HTTP_X_FORWARDED_FOR=f"10.0.0.{i}")
+        self.assertEqual(self._login(HTTP_X_FORWARDED_FOR="10.0.0.99").status_code, 429)
+
+    def test_x_forwarded_for_con_proxy_fidato(self):
+        rest_framework = {**settings.REST_FRAMEWORK, "NUM_PROXIES": 1}
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            for _ in range(10):
+                self._login(HTTP_X_FORWARDED_FOR="10.0.0.1")
+            self.assertEqual(self._login(HTTP_X_FORWARDED_FOR="10.0.0.1").status_code, 429)
+            self.assertEqual(self._login(HTTP_X_FORWARDED_FOR="10.0.0.2").status_code, 401)
+
+    def test_costo_ricerca(self):
+        rest_framework = {
+            **settings.REST_FRAMEWORK,
+            "DEFAULT_THROTTLE_RATES": {**settings.REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"], "leads": "10/min"},
+        }
+        self.api.force_authenticate(User.objects.create_superuser("admin", password="x"))
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            # ?search= costa 1 + 5: dopo una ricerca ne resta solo una parte
+            self.assertEqual(self.api.get("/api/leads/", {"search": "rossi"}).status_code, 200)
+            self.assertEqual(self.api.get("/api/leads/", {"search": "rossi"}).status_code, 429)
+            for _ in range(4):
+                self.assertEqual(self.api.get("/api/leads/").status_code, 200)
+            self.assertEqual(self.api.get("/api/leads/").status_code, 429)
+
+
+# ==============================
+# Upsert massivo dei lead (POST /api/leads/bulk/)
+# ==============================
+class LeadBulkAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create_superuser("admin", password="x"))
+
+    def test_inserimento_aggiornamento_e_conflitto(self):
+        esistente = Lead.objects.create(nome="Mario", cognome="Rossi", telefono="+39 333 1234567", note_operatori="vecchie")
+        response = self.api.post("/api/leads/bulk/", [
+            {"nome": "Anna", "cognome": "Bianchi", "email": "Anna@Example.com"},
+            # chiave già presente: bastano la chiave e i campi da cambiare
+            {"telefono": "3331234567", "note_operatori": "nuove"},
+            # chiave nuova senza i campi obbligatori: errore solo per questa riga
+            {"telefono": "3339999999"},
+            # stessa chiave della prima riga: vale l'ultima
+            {"nome": "Anna", "cognome": "Verdi", "email": "anna@example.com"},
+        ], format="json")
+        self.assertEqual(response.status_code, 200)
+        esiti = response.data["results"]
+        self.assertEqual([e["status"] for e in esiti], ["skipped", "updated", "error", "created"])
+        self.assertIn("nome", esiti[2]["errors"])
+        self.assertEqual((response.data["created"], response.data["updated"], response.data["error"]), (1, 1, 1))
+
+        esistente.refresh_from_db()
+        self.assertEqual((esistente.nome, esistente.note_operatori), ("Mario", "nuove"))
+        self.assertEqual(esiti[1]["id"], esistente.pk)
+        nuovo = Lead.objects.get(pk=esiti[3]["id"])
+        self.assertEqual((nuovo.cognome, nuovo.chiave_naturale), ("Verdi", "e:anna@example.com"))
+        self.assertEqual(Lead.objects.count(), 2)
+
+    def test_limite_righe(self):
+        from .api.views import LEAD_BULK_MAX
+
+        riga = {"nome": "Anna", "cognome": "Bianchi", "email": "anna@example.com"}
+        response = self.api.post("/api/leads/bulk/", [riga] * (LEAD_BULK_MAX + 1), format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Lead.objects.exists())
+        response = self.api.post("/api/leads/bulk/", [riga] * LEAD_BULK_MAX, format="json")
+        self.assertEqual(response.status_code, 200)
+        # stessa chiave ripetuta: creata nel primo blocco, aggiornata dall'ultima riga di ogni blocco successivo
+        self.assertEqual((response.data["created"], response.data["error"]), (1, 0))
+        self.assertEqual(len(response.data["results"]), LEAD_BULK_MAX)
+        self.assertEqual(Lead.objects.count(), 1)
+
+
+# ==============================
+# GET condizionali delle pagine di dettaglio
+# ==============================
+class DettaglioCondizionaleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser("admin", password="x"))
+        self.url = reverse("cliente_dettaglio", args=[Cliente.objects.create(nome="Mario", cognome="Rossi").pk])
+
+    def test_solo_etag_e_sidebar_aggiornata(self):
+        self.client.get(self.url)  # primo accesso: stato notifiche e ruolo in sessione
+        prima = self.client.get(self.url)
+        self.assertNotIn("Last-Modified", prima)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=prima["ETag"]).status_code, 304)
+
+        # nuova notifica: il cliente non cambia, la sidebar sì
+        Notifica.objects.create(testo="nuova")
+        dopo = self.client.get(self.url, HTTP_IF_NONE_MATCH=prima["ETag"])
+        self.assertEqual(dopo.status_code, 200)
+        self.assertContains(dopo, "nuova")
+        # un If-Modified-Since (anche nel futuro) da solo non basta per un 304
+        dopo = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(dopo.status_code, 200)
@@ -18,16 +18,21 @@ from .views import (
     # lead
     lead_lista, lead_nuovo, lead_modifica, lead_dettaglio, lead_elimina, lead_ricontatta, lead_nota_aggiungi,
     lead_toggle_consulenza, lead_toggle_no_risposta, lead_toggle_msg, lead_aggiorna_stato_operativo,
+    lead_azioni_massa, lead_richiami, lead_richiami_attendi, lead_archivio, lead_archivio_dettaglio,
+    lead_filtro_salva, lead_filtro_apri, lead_filtro_elimina,
+    # calendario
+    consulente_calendario_ics,
     # schede consulenza
     scheda_consulenza_nuova, scheda_consulenza_dettaglio,
     scheda_consulenza_modifica, scheda_consulenza_elimina, scheda_consulenza_pdf,
     # notifiche
     notifiche_segna_letto, notifiche_segna_tutte_lette, notifiche_lista,
+    # eventi
+    eventi_stream,
 )
 
 from rest_framework.routers import DefaultRouter
-from crm.api.views import ClienteViewSet, LeadViewSet
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from crm.api.views import ClienteViewSet, LeadViewSet, TokenRefreshView, TokenView
 
 router = DefaultRouter()
 router.register(r"clienti", ClienteViewSet, basename="api-clienti")
@@ -85,6 +90,14 @@ urlpatterns = [
     path("leads/", lead_lista, name="lead_lista"),
     path("leads/stato/<slug:stato_slug>/", lead_lista, name="lead_lista_stato"),
     path("leads/nuovo/", lead_nuovo, name="lead_nuovo"),
+    path("leads/azioni-massa/", lead_azioni_massa, name="lead_azioni_massa"),
+    path("leads/filtri/salva/", lead_filtro_salva, name="lead_filtro_salva"),
+    path("leads/filtri/<int:filtro_id>/", lead_filtro_apri, name="lead_filtro_apri"),
+    path("leads/filtri/<int:filtro_id>/elimina/", lead_filtro_elimina, name="lead_filtro_elimina"),
+    path("leads/richiami/", lead_richiami, name="lead_richiami"),
+    path("leads/richiami/attendi/", lead_richiami_attendi, name="lead_richiami_attendi"),
+    path("leads/archivio/", lead_archivio, name="lead_archivio"),
+    path("leads/archivio/<int:lead_id>/", lead_archivio_dettaglio, name="lead_archivio_dettaglio"),
     path("leads/<int:lead_id>/modifica/", lead_modifica, name="lead_modifica"),
     path("leads/<int:lead_id>/", lead_dettaglio, name="lead_dettaglio"),
     path("leads/<int:lead_id>/toggle-consulenza/", lead_toggle_consulenza, name="lead_toggle_consulenza"),
@@ -95,6 +108,9 @@ urlpatterns = [
     path("leads/<int:lead_id>/ricontatta/", lead_ricontatta, name="lead_ricontatta"),
     path("leads/<int:lead_id>/note/", lead_nota_aggiungi, name="lead_nota_aggiungi"),
 
+    # Calendario appuntamenti per consulente (feed .ics con token)
+    path("calendario/<str:token>.ics", consulente_calendario_ics, name="consulente_calendario_ics"),
+
     # Schede di consulenza
     # — crea per CLIENTE (nome che il tuo template già usa)
     path("clienti/<int:cliente_id>/consulenza/nuova/", scheda_consulenza_nuova, name="scheda_consulenza_nuova"),
@@ -112,9 +128,10 @@ urlpatterns = [
     path("notifiche/<int:notifica_id>/letto/", notifiche_segna_letto, name="notifiche_segna_letto"),
     path("notifiche/letto/tutte/", notifiche_segna_tutte_lette, name="notifiche_segna_tutte_lette"),
     path("notifiche/", notifiche_lista, name="notifiche_lista"),
+    path("eventi/", eventi_stream, name="eventi_stream"),
 
     # API / JWT
     path("api/", include(router.urls)),
-    path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
+    path("api/token/", TokenView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
 ]
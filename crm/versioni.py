@@ -0,0 +1,177 @@
+# crm/versioni.py
+"""
+Versione economica di un Cliente / Lead per le GET condizionali (ETag / Last-Modified).
+
+La versione è `aggiornato_il` del record più l'ultimo timestamp di ogni relazione
+figlia (documenti, note, pratiche, schede), letti con una sola query a subquery.
+Le modifiche ai figli senza timestamp proprio (es. testo di una nota) e le
+cancellazioni "toccano" l'aggiornato_il del padre (vedi signals.tocca_padre).
+
+- condizionale_html: decoratore per le view di dettaglio; l'ETag include anche
+  utente, ruolo, stato notifiche, contatori lead della sidebar e cookie CSRF,
+  perché la pagina li contiene (per questo solo ETag, senza Last-Modified).
+- VersioneAPIMixin: retrieve dell'API con 304 e, opzionale, cache della risposta
+  serializzata per versione e ruolo (API_CACHE_RISPOSTE_TTL).
+"""
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db.models import Max, OuterRef, Subquery
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .ruoli import is_admin, ruolo_utente
+
+# relazione inversa -> campo timestamp del figlio
+FIGLI_CLIENTE = (
+    ("documenti", "caricato_il"),
+    ("note_entries", "creata_il"),
+    ("pratiche", "aggiornata_il"),
+    ("schede_consulenza", "created_at"),
+)
+FIGLI_LEAD = (
+    ("note_entries", "creato_il"),
+    ("schede_consulenza", "created_at"),
+)
+
+
+@dataclass(frozen=True)
+class Versione:
+    firma: str
+    ultima_modifica: datetime | None
+
+    def etag(self, *extra) -> str:
+        testo = ":".join([self.firma, *(str(e) for e in extra)])
+        return quote_etag(hashlib.md5(testo.encode()).hexdigest())
+
+    @property
+    def last_modified(self) -> int | None:
+        return int(self.ultima_modifica.timestamp()) if self.ultima_modifica else None
+
+
+def versione_oggetto(qs, pk, figli) -> Versione | None:
+    """Versione del record `pk` di `qs` (None se non esiste / non è nel queryset)."""
+    modello = qs.model
+    annotazioni = {}
+    for relazione, campo in figli:
+        rel = modello._meta.get_field(relazione)
+        fk = rel.field.name
+        annotazioni[f"_v_{relazione}"] = Subquery(
+            rel.related_model.objects.filter(**{fk: OuterRef("pk")})
+            .order_by()
+            .values(fk)
+            .annotate(ultimo=Max(campo))
+            .values("ultimo")
+        )
+    riga = qs.filter(pk=pk).annotate(**annotazioni).values_list("aggiornato_il", *annotazioni).first()
+    if riga is None:
+        return None
+    date = [d for d in riga if d is not None]
+    firma = f"{modello._meta.label_lower}:{pk}:" + ":".join(d.isoformat() if d else "-" for d in riga)
+    return Versione(firma=firma, ultima_modifica=max(date) if date else None)
+
+
+def versione_cliente(cliente_id, qs=None) -> Versione | None:
+    from .models import Cliente
+
+    return versione_oggetto(qs if qs is not None else Cliente.objects.all(), cliente_id, FIGLI_CLIENTE)
+
+
+def versione_lead(lead_id, qs=None) -> Versione | None:
+    from .models import Lead
+
+    return versione_oggetto(qs if qs is not None else Lead.objects.filter(is_archiviato=False), lead_id, FIGLI_LEAD)
+
+
+def _firma_pagina(request) -> tuple:
+    """Parti della pagina che non dipendono dall'oggetto: utente, ruolo, notifiche, contatori sidebar, CSRF."""
+    from .services import _ultima_notifica_id, conta_notifiche_non_lette, conteggi_lead_per_stato
+
+    user = request.user
+    return (
+        user.pk,
+        ruolo_utente(user),
+        is_admin(user),
+        _ultima_notifica_id(),
+        conta_notifiche_non_lette(user),
+        sorted(conteggi_lead_per_stato().items()),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ""),
+    )
+
+
+def condizionale_html(calcola_versione):
+    """
+    Decoratore per view di dettaglio: `calcola_versione(**kwargs_url)` -> Versione | None.
+    Con If-None-Match ancora valido risponde 304 senza eseguire la view. Niente Last-Modified:
+    la data dice solo quando è cambiato l'oggetto, non sidebar, notifiche o ruolo, e un
+    If-Modified-Since darebbe 304 su una pagina con quelle parti ormai vecchie.
+    """
+
+    def decoratore(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # messaggi in coda (es. dopo un redirect): la pagina va renderizzata per mostrarli
+            if request.method not in ("GET", "HEAD") or len(messages.get_messages(request)):
+                return view(request, *args, **kwargs)
+            versione = calcola_versione(**kwargs)
+            if versione is None:
+                return view(request, *args, **kwargs)
+
+            etag = versione.etag(*_firma_pagina(request))
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response["ETag"] = etag
+                response["Cache-Control"] = "private, no-cache"
+                patch_vary_headers(response, ("Cookie",))
+            return response
+
+        return wrapper
+
+    return decoratore
+
+
+class VersioneAPIMixin:
+    """
+    retrieve() condizionale per i ViewSet: `versione_oggetto(qs, pk)` della sottoclasse
+    calcola la versione sul queryset della view (stessi filtri di get_object).
+    """
+
+    figli_versione: tuple = ()
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        versione = versione_oggetto(self.get_queryset(), pk, self.figli_versione) if str(pk).isdigit() else None
+        if versione is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        # la rappresentazione dipende dai parametri (?fields=, ...) e dal ruolo
+        # (?expand=documenti nasconde i "Privato Admin" ai non admin)
+        admin = is_admin(request.user)
+        etag = versione.etag(request.GET.urlencode(), admin)
+        response = get_conditional_response(request, etag=etag, last_modified=versione.last_modified)
+        if response is None:
+            ttl = getattr(settings, "API_CACHE_RISPOSTE_TTL", 0)
+            chiave = f"crm:api:{self.basename}:{pk}:{int(admin)}:{etag}"
+            dati = cache.get(chiave) if ttl else None
+            if dati is None:
+                response = super().retrieve(request, *args, **kwargs)
+                if ttl and response.status_code == 200:
+                    cache.set(chiave, response.data, ttl)
+            else:
+                response = Response(dati)
+        response["ETag"] = etag
+        if versione.last_modified:
+            response["Last-Modified"] = http_date(versione.last_modified)
+        response["Cache-Control"] = "private, no-cache"
+        patch_vary_headers(response, ("Authorization",))
+        return response
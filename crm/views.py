@@ -1,6 +1,6 @@
 from __future__ import annotations
 from datetime import datetime, date, timedelta
-import io, os, zipfile
+import hashlib, json, os, shutil, tempfile, time, zipfile
 from django.utils import timezone
 
 from reportlab.lib.pagesizes import A4
@@ -14,13 +14,31 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.views import LoginView
 from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator
-from django.db.models import Q, Exists, OuterRef, Case, When, Value, IntegerField, Prefetch
-from django.http import HttpResponse, HttpResponseForbidden
-from django.shortcuts import get_object_or_404, redirect, render
+from django.db.models import Q, Exists, OuterRef, Case, When, Value, IntegerField, Prefetch, Count, Max, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, QueryDict, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, redirect, render
 from django.urls import reverse
-from django.views.decorators.http import require_http_methods, require_POST
-
-from .services import converti_lead_in_cliente
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET, require_http_methods, require_POST
+from asgiref.sync import sync_to_async
+
+from .calendario import genera_ics
+from .costanti import STATO_SLUG_MAP
+from .eventi import broker, sse_attivo
+from .cache import ricorda
+from .paginazione import pagina_keyset
+from .ricerca import filtra_ricerca
+from .riferimenti import consulenti_attivi, elenco, per_pk
+from .ruoli import has_portal_access, is_admin
+from .versioni import condizionale_html, versione_cliente, versione_lead
+from .services import converti_lead_in_cliente, aggiorna_lead_in_massa, parametri_richiami, richiami_in_scadenza
+from .services import (
+    conta_notifiche_non_lette, marca_stato_lettura, notifiche_non_lette,
+    segna_notifica_letta, segna_tutte_notifiche_lette, statistiche_report_lead,
+)
 from .services import notifica_documento_caricato as _notify_doc_raw
 from .forms import ClienteForm, DocumentoForm, PraticaForm, NotaForm, LeadForm, SchedaConsulenzaForm, DocumentoClienteEditForm
 from .models import (
@@ -29,29 +47,21 @@ from .models import (
     Pratiche,
     Nota,
     Lead,
+    LeadArchivio,
     NotaLead,
     Consulente,
+    FiltroSalvato,
     Notifica,
     SchedaConsulenza,
     CreditoreLegale
 )
 
 
-# Slug URL -> stato_operativo Lead (lead_lista_stato)
-STATO_SLUG_MAP = {
-    "nuovo": "nuovo",
-    "no-risposta": "no_risposta",
-    "segreteria": "segreteria",
-    "non-fascia-oraria": "non_fascia_oraria",
-    "ha-staccato-lui": "ha_staccato_lui",
-    "consulenza-effettuata": "consulenza_eff",
-    "attesa-contatti": "attesa_contatti",
-    "non-contattare": "non_contattare",
-    "numero-errato": "numero_errato",
-    "blocco-chiamate": "blocco_chiamate",
-    "cliente-non-interessato": "cliente_non_interessato",
-    "non-competenza": "non_competenza",
-}
+# Dizionari delle scelte, costruiti una volta sola (prima venivano ricreati a ogni controllo)
+FASI_CLIENTE = dict(Cliente.FaseStato.choices)
+PRATICHE_CLIENTE = dict(Cliente.PraticaStato.choices)
+CREDITORI_LEGALI = dict(CreditoreLegale.choices)
+STATI_OPERATIVI_LEAD = dict(Lead.StatoOperativo.choices)
 
 
 def notify_doc(actor, cliente, documento):
@@ -186,79 +196,96 @@ def dashboard(request):
     return render(request, "crm/dashboard.html")
 
 
-def is_operatore(user):
-    prof = getattr(user, "profiloutente", None)
-    return user.is_authenticated and bool(prof and prof.ruolo in ["operatore", "legale"])
-
-
-def has_portal_access(user):
-    if not user.is_authenticated:
-        return False
-    if user.is_superuser:
-        return True
-    prof = getattr(user, "profiloutente", None)
-    return bool(prof and prof.ruolo in ["admin", "operatore", "legale"])
-
-
-def is_admin(user):
-    if not user.is_authenticated:
-        return False
-    if user.is_superuser:
-        return True
-    prof = getattr(user, "profiloutente", None)
-    return bool(prof and prof.ruolo == "admin")
-
-
 @login_required
 @user_passes_test(is_admin)
 def report_giornaliero_lead(request):
-    """Dashboard statistiche lead, solo admin."""
+    """Dashboard statistiche lead, solo admin (numeri in cache per pochi minuti, vedi services)."""
     oggi = timezone.localdate()
-    qs_oggi = Lead.objects.filter(is_archiviato=False, creato_il__date=oggi)
-    qs_tutti = Lead.objects.filter(is_archiviato=False)
-
-    # Statistiche per stato (solo lead creati oggi)
-    stats = [(label, qs_oggi.filter(stato_operativo=val).count()) for val, label in Lead.StatoOperativo.choices]
-
-    # Trend ultimi 7 giorni (lead creati per giorno)
-    trend_labels = []
-    trend_values = []
-    for i in range(6, -1, -1):
-        d = oggi - timedelta(days=i)
-        cnt = Lead.objects.filter(is_archiviato=False, creato_il__date=d).count()
-        trend_labels.append(d.strftime("%d/%m"))
-        trend_values.append(cnt)
-
-    # Ieri per confronto
-    ieri = oggi - timedelta(days=1)
-    totale_ieri = Lead.objects.filter(is_archiviato=False, creato_il__date=ieri).count()
-    totale_oggi = qs_oggi.count()
-    delta_ieri = totale_oggi - totale_ieri if totale_ieri else totale_oggi
-
     return render(request, "crm/report_giornaliero_lead.html", {
         "data_report": oggi,
-        "totale_oggi": totale_oggi,
-        "totale_attivi": qs_tutti.count(),
-        "stats_stato": stats,
-        "trend_labels": trend_labels,
-        "trend_values": trend_values,
-        "delta_ieri": delta_ieri,
-        "totale_ieri": totale_ieri,
+        **statistiche_report_lead(oggi),
     })
 
 
 # ==============================
 # Clienti – lista/filtri
 # ==============================
-@login_required
-@user_passes_test(has_portal_access)
-def clienti_tutti(request):
-    qs = (
-        Cliente.objects.all()
-        .select_related("consulente")
-        .prefetch_related("documenti", "pratiche")
+# Dimensioni a faccette di clienti_tutti -> campo del modello
+FACCETTE_CLIENTI = {
+    "stato": "stato",
+    "fase": "fase",
+    "pratica": "pratica",
+    "consulente": "consulente_id",
+    "creditore_legale": "creditore_legale",
+}
+FACCETTE_CLIENTI_TTL = 120
+
+
+def _faccette_clienti(qs, selezioni: dict, *, firma) -> dict:
+    """
+    Conteggi per ogni opzione di ogni filtro a faccette, ciascuna calcolata con tutti
+    gli altri filtri attivi (come se si cambiasse solo quella tendina).
+
+    Una sola query: GROUP BY su tutte le dimensioni sul queryset senza filtri a
+    faccette (in cache per `firma` = filtri non a faccette); poi ogni faccetta somma
+    in Python le combinazioni compatibili con le altre selezioni.
+    Ritorna {dimensione: {valore: n}, "totale": n} (+ "fase_vuota"/"pratica_vuota" per i template).
+    """
+    dimensioni = list(FACCETTE_CLIENTI)
+    combinazioni = ricorda(
+        "clienti", "faccette", hashlib.md5(repr(firma).encode()).hexdigest(),
+        calcola=lambda: list(
+            qs.order_by().values_list(*FACCETTE_CLIENTI.values()).annotate(n=Count("pk"))
+        ),
+        timeout=FACCETTE_CLIENTI_TTL,
     )
 
+    faccette = {d: {} for d in dimensioni}
+    totale = 0
+    for *valori, n in combinazioni:
+        riga = dict(zip(dimensioni, valori))
+        esclusi = [d for d in dimensioni if d in selezioni and riga[d] != selezioni[d]]
+        if not esclusi:
+            totale += n
+        # la riga conta per una faccetta solo se rispetta le selezioni delle altre dimensioni
+        if len(esclusi) > 1:
+            continue
+        for d in esclusi or dimensioni:
+            faccette[d][riga[d]] = faccette[d].get(riga[d], 0) + n
+    faccette["totale"] = totale
+    faccette["fase_vuota"] = faccette["fase"].get("", 0)
+    faccette["pratica_vuota"] = faccette["pratica"].get("", 0)
+    return faccette
+
+
+def _conta_figli(modello, fk: str):
+    """COUNT dei figli di ogni riga come subquery correlata (usa l'indice sulla FK, niente GROUP BY sul padre)."""
+    conteggio = modello.objects.filter(**{fk: OuterRef("pk")}).order_by().values(fk).annotate(n=Count("pk")).values("n")
+    return Coalesce(Subquery(conteggio), 0)
+
+
+def _con_conteggi(choices, conteggi: dict) -> list[tuple]:
+    return [(valore, label, conteggi.get(valore, 0)) for valore, label in choices]
+
+
+# Ordinamenti serviti a cursore (keyset) invece che con OFFSET: coperti dagli indici
+# (data_creazione) e (stato|fase, data_creazione) di Cliente
+ORDINAMENTI_KEYSET_CLIENTI = {
+    "data_creazione": ["data_creazione", "id"],
+    "-data_creazione": ["-data_creazione", "-id"],
+}
+
+
+def _lista_clienti(request, *, fissi=None, titolo="Tutti i clienti", sort_predefinito="cognome"):
+    """
+    Motore delle liste clienti (clienti_tutti e le viste per stato / fase).
+    `fissi` = filtri a faccette imposti dalla vista (es. {"fase": "legale"}): la relativa
+    tendina non compare e le faccette contano solo dentro quel sottoinsieme.
+    Ordinando per data la paginazione è a cursore (?cursore=), altrimenti a pagine (?page=).
+    """
+    fissi = fissi or {}
+    qs = Cliente.objects.filter(**{FACCETTE_CLIENTI[d]: v for d, v in fissi.items()})
+
     # --- FILTRI ---
     q = request.GET.get("q", "").strip()
     stato_cliente = request.GET.get("stato", "").strip()   # active/inactive
@@ -271,26 +298,10 @@ def clienti_tutti(request):
     has_prat = request.GET.get("has_prat", "").strip()     # "si"
     creditore_legale = request.GET.get("creditore_legale", "").strip()
 
+    # ricerca dall'indice a trigrammi (crm/ricerca.py); la rilevanza ordina solo se non c'è un sort esplicito
+    rilevanza = None
     if q:
-        qs = qs.filter(
-            Q(nome__icontains=q)
-            | Q(cognome__icontains=q)
-            | Q(email__icontains=q)
-            | Q(telefono__icontains=q)
-        )
-
-    if stato_cliente in {"active", "inactive"}:
-        qs = qs.filter(stato=stato_cliente)
-    if fase_sel == "__empty__":
-        qs = qs.filter(fase="")
-    elif fase_sel and fase_sel in dict(Cliente.FaseStato.choices):
-        qs = qs.filter(fase=fase_sel)
-    if pratica_sel in dict(Cliente.PraticaStato.choices):
-        qs = qs.filter(pratica=pratica_sel)
-    elif pratica_sel == "__empty__":
-        qs = qs.filter(pratica="")
-    if consulente_id.isdigit():
-        qs = qs.filter(consulente_id=int(consulente_id))
+        qs, rilevanza = filtra_ricerca(qs, q)
 
     # Filtro date (l'avevi tolto per errore)
     dal = _parse_date(dal_raw)
@@ -300,10 +311,6 @@ def clienti_tutti(request):
     if al:
         qs = qs.filter(data_creazione__date__lte=al)
 
-    # Filtro creditore legale
-    if creditore_legale in dict(CreditoreLegale.choices):
-        qs = qs.filter(creditore_legale=creditore_legale)
-
     if has_docs == "si":
         sub_docs = DocumentoCliente.objects.filter(cliente=OuterRef("pk"))
         qs = qs.annotate(_has_docs=Exists(sub_docs)).filter(_has_docs=True)
@@ -312,14 +319,47 @@ def clienti_tutti(request):
         sub_prat = Pratiche.objects.filter(cliente=OuterRef("pk"))
         qs = qs.annotate(_has_prat=Exists(sub_prat)).filter(_has_prat=True)
 
+    # Filtri a faccette: dimensione -> valore della colonna
+    selezioni = {}
+    if stato_cliente in {"active", "inactive"}:
+        selezioni["stato"] = stato_cliente
+    if fase_sel == "__empty__":
+        selezioni["fase"] = ""
+    elif fase_sel and fase_sel in FASI_CLIENTE:
+        selezioni["fase"] = fase_sel
+    if pratica_sel in PRATICHE_CLIENTE:
+        selezioni["pratica"] = pratica_sel
+    elif pratica_sel == "__empty__":
+        selezioni["pratica"] = ""
+    if consulente_id.isdigit():
+        selezioni["consulente"] = int(consulente_id)
+    # Filtro creditore legale
+    if creditore_legale in CREDITORI_LEGALI:
+        selezioni["creditore_legale"] = creditore_legale
+    for d in fissi:
+        selezioni.pop(d, None)
+
+    faccette = _faccette_clienti(qs, selezioni, firma=(sorted(fissi.items()), q, dal, al, has_docs, has_prat))
+    qs = (
+        qs.filter(**{FACCETTE_CLIENTI[d]: v for d, v in selezioni.items()})
+        .select_related("consulente")
+        # la lista mostra solo quanti documenti / pratiche ha il cliente: niente prefetch delle righe
+        .annotate(
+            num_documenti=_conta_figli(DocumentoCliente, "cliente"),
+            num_pratiche=_conta_figli(Pratiche, "cliente"),
+        )
+    )
+
     # --- SORT ---
     sort = (request.GET.get("sort") or "").strip()
 
-    # default: cognome A-Z
+    # default: cognome A-Z (le viste per stato / fase: più recenti prima); cercando, i più rilevanti
     if not sort:
-        sort = "cognome"
+        sort = "rilevanza" if rilevanza is not None else sort_predefinito
 
-    if sort == "cognome":
+    if sort == "rilevanza" and rilevanza is not None:
+        qs = qs.annotate(_rilevanza=rilevanza).order_by("-_rilevanza", "cognome", "nome", "id")
+    elif sort == "cognome":
         qs = qs.order_by("cognome", "nome")
     elif sort == "-cognome":
         qs = qs.order_by("-cognome", "-nome")
@@ -341,13 +381,23 @@ def clienti_tutti(request):
 
     # --- PAGINAZIONE ---
     per_page = _get_per_page(request, 20, 100)
-    paginator = Paginator(qs, per_page)
-    page_obj = paginator.get_page(request.GET.get("page"))
-    consulenti = Consulente.objects.filter(is_active=True).order_by("nome")
+    page_obj = pagina = None
+    if sort in ORDINAMENTI_KEYSET_CLIENTI:
+        pagina = pagina_keyset(
+            qs, ORDINAMENTI_KEYSET_CLIENTI[sort], cursore=request.GET.get("cursore"), per_page=per_page,
+        )
+        clienti = pagina.oggetti
+    else:
+        page_obj = Paginator(qs, per_page).get_page(request.GET.get("page"))
+        clienti = page_obj.object_list
+    consulenti = consulenti_attivi()
 
     ctx = {
-        "clienti": page_obj.object_list,
+        "titolo": titolo,
+        "fissi": fissi,
+        "clienti": clienti,
         "page_obj": page_obj,
+        "pagina": pagina,
         "q": q,
         "stato_cliente": stato_cliente,
         "fase_sel": fase_sel,
@@ -362,34 +412,41 @@ def clienti_tutti(request):
 
         # filtro creditore
         "creditore_legale": creditore_legale,
-        "CONSULENTI": consulenti,
-        "CREDITORI_LEGALI": CreditoreLegale.choices,  # <-- nome corretto (plurale)
-        "FASI_CLIENTE": Cliente.FaseStato.choices,
-        "PRATICHE_CLIENTE": Cliente.PraticaStato.choices,
+        # opzioni dei filtri con il numero di clienti che ciascuna darebbe: (valore, label, n)
+        "CONSULENTI": [(c, faccette["consulente"].get(c.pk, 0)) for c in consulenti],
+        "CREDITORI_LEGALI": _con_conteggi(CreditoreLegale.choices, faccette["creditore_legale"]),  # <-- nome corretto (plurale)
+        "FASI_CLIENTE": _con_conteggi(Cliente.FaseStato.choices, faccette["fase"]),
+        "PRATICHE_CLIENTE": _con_conteggi(Cliente.PraticaStato.choices, faccette["pratica"]),
+        "faccette": faccette,
     }
     return render(request, "crm/clienti_tutti.html", ctx)
 
 
+@login_required
+@user_passes_test(has_portal_access)
+def clienti_tutti(request):
+    return _lista_clienti(request)
+
+
 
 @login_required
 @user_passes_test(has_portal_access)
 def clienti_legali(request):
-    clienti = Cliente.objects.filter(fase="legale").order_by("-data_creazione")
-    return render(request, "crm/clienti_legali.html", {"clienti": clienti})
+    return _lista_clienti(request, fissi={"fase": "legale"}, titolo="Clienti legali", sort_predefinito="-data_creazione")
 
 
 @login_required
 @user_passes_test(has_portal_access)
 def clienti_attivi(request):
-    clienti = Cliente.objects.filter(stato="active").order_by("-data_creazione")
-    return render(request, "crm/clienti_attivi.html", {"clienti": clienti})
+    return _lista_clienti(request, fissi={"stato": "active"}, titolo="Clienti attivi", sort_predefinito="-data_creazione")
 
 
 @login_required
 @user_passes_test(has_portal_access)
 def clienti_non_attivi(request):
-    clienti = Cliente.objects.filter(stato="inactive").order_by("-data_creazione")
-    return render(request, "crm/clienti_non_attivi.html", {"clienti": clienti})
+    return _lista_clienti(
+        request, fissi={"stato": "inactive"}, titolo="Clienti non attivi", sort_predefinito="-data_creazione"
+    )
 
 
 # ==============================
@@ -406,7 +463,7 @@ def cliente_nuovo(request):
 
             if cliente.perizia_inviata and cliente.stato != "active":
                 cliente.stato = "active"
-                cliente.save(update_fields=["stato"])
+                cliente.save(update_fields=["stato", "aggiornato_il"])
 
             _allega_visure(request, cliente)
 
@@ -430,12 +487,14 @@ def cliente_nuovo(request):
 @login_required
 @user_passes_test(has_portal_access)
 def clienti_possibili(request):
-    clienti = Cliente.objects.filter(fase="istanza").order_by("-data_creazione")
-    return render(request, "crm/clienti_tutti.html", {"clienti": clienti, "page_obj": None})
+    return _lista_clienti(
+        request, fissi={"fase": "istanza"}, titolo="Possibili clienti", sort_predefinito="-data_creazione"
+    )
 
 
 @login_required
 @user_passes_test(has_portal_access)
+@condizionale_html(lambda cliente_id: versione_cliente(cliente_id))
 def clienti_dettaglio(request, cliente_id):
     cliente = get_object_or_404(Cliente, pk=cliente_id)
     is_admin_user = is_admin(request.user)
@@ -608,7 +667,7 @@ def cliente_modifica(request, cliente_id):
 
             if cliente.perizia_inviata and cliente.stato != "active":
                 cliente.stato = "active"
-                cliente.save(update_fields=["stato"])
+                cliente.save(update_fields=["stato", "aggiornato_il"])
 
             _allega_visure(request, cliente)
 
@@ -765,19 +824,22 @@ def documento_elimina(request, doc_id):
 
 
 
-@login_required
-@user_passes_test(has_portal_access)
-def documenti_zip_cliente(request, cliente_id):
-    cliente = get_object_or_404(Cliente, pk=cliente_id)
-    buffer = io.BytesIO()
-    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-        for d in cliente.documenti.all():
+ZIP_BLOCCO = 64 * 1024
+ZIP_MAX_RAM = 10 * 1024 * 1024  # oltre, il file temporaneo passa su disco
+
+
+def _crea_zip_documenti(documenti):
+    """Zip su file temporaneo, copiando ogni documento a blocchi dallo storage."""
+    tmp = tempfile.SpooledTemporaryFile(max_size=ZIP_MAX_RAM)
+    with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+        for d in documenti:
             if not getattr(d, "file", None):
                 continue
             arcname = f"{d.categoria}/{os.path.basename(d.file.name)}"
             try:
                 d.file.open("rb")
-                zf.writestr(arcname, d.file.read())
+                with zf.open(arcname, "w") as dest:
+                    shutil.copyfileobj(d.file, dest, ZIP_BLOCCO)
             except Exception:
                 pass
             finally:
@@ -785,9 +847,31 @@ def documenti_zip_cliente(request, cliente_id):
                     d.file.close()
                 except Exception:
                     pass
-    buffer.seek(0)
+    tmp.seek(0)
+    return tmp
+
+
+@login_required
+@user_passes_test(has_portal_access)
+async def documenti_zip_cliente(request, cliente_id):
+    """
+    Async: lettura dallo storage e compressione in un thread, poi invio a blocchi.
+    Un client lento tiene aperta solo la connessione, non un worker.
+    """
+    cliente = await aget_object_or_404(Cliente, pk=cliente_id)
+    documenti = [d async for d in cliente.documenti.all()]
+    tmp = await sync_to_async(_crea_zip_documenti, thread_sensitive=False)(documenti)
+    leggi = sync_to_async(tmp.read, thread_sensitive=False)
+
+    async def blocchi():
+        try:
+            while blocco := await leggi(ZIP_BLOCCO):
+                yield blocco
+        finally:
+            tmp.close()
+
     filename = f"documenti_cliente_{cliente.id}.zip"
-    resp = HttpResponse(buffer.getvalue(), content_type="application/zip")
+    resp = StreamingHttpResponse(blocchi(), content_type="application/zip")
     resp["Content-Disposition"] = f'attachment; filename="{filename}"'
     return resp
 
@@ -910,19 +994,14 @@ def nota_elimina(request, nota_id):
 # Lead – lista/filtri/CRUD
 # ==============================
 
-@login_required
-@user_passes_test(has_portal_access)
-def lead_lista(request, stato_slug=None):
-    qs = (
-        Lead.objects.filter(is_archiviato=False)
-        .select_related("consulente")
-        .prefetch_related(
-            Prefetch(
-                "note_entries",
-                queryset=NotaLead.objects.order_by("-creato_il").select_related("autore"),
-            )
-        )
-    )
+def _lead_filtrati(params, stato_slug=None, *, ricerca_esatta=False):
+    """
+    Applica ai Lead non archiviati i filtri di lead_lista letti da `params` (QueryDict).
+    Ritorna (qs, filtri): qs senza ordinamento, filtri = valori grezzi per il template.
+    Usata anche dalle azioni massive ("tutti i risultati filtrati"), con `ricerca_esatta`:
+    lì `q` seleziona solo le sottostringhe vere, non i risultati tolleranti ai refusi.
+    """
+    qs = Lead.objects.filter(is_archiviato=False)
 
     stato_vista = None
     stato_vista_label = None
@@ -931,31 +1010,28 @@ def lead_lista(request, stato_slug=None):
         stato_operativo_forzato = STATO_SLUG_MAP[stato_slug]
         qs = qs.filter(stato_operativo=stato_operativo_forzato)
         stato_vista = stato_operativo_forzato
-        stato_vista_label = dict(Lead.StatoOperativo.choices).get(stato_operativo_forzato, stato_slug)
+        stato_vista_label = STATI_OPERATIVI_LEAD.get(stato_operativo_forzato, stato_slug)
         stato_slug_actual = stato_slug
     else:
         # Nella lista generale escludi i "Non contattare"
         qs = qs.exclude(stato_operativo="non_contattare")
 
     # --- Filtri ---
-    q = request.GET.get("q", "").strip()
-    primo_contatto_raw = request.GET.get("primo_contatto", "").strip()
-    appuntamento_raw = request.GET.get("appuntamento", "").strip()
+    q = params.get("q", "").strip()
+    primo_contatto_raw = params.get("primo_contatto", "").strip()
+    appuntamento_raw = params.get("appuntamento", "").strip()
 
-
-    stato_operativo = request.GET.get("stato_operativo", "").strip() or (stato_vista if stato_vista else "")
-    richiamo_da_raw = request.GET.get("richiamo_da", "").strip()
-    richiamo_a_raw = request.GET.get("richiamo_a", "").strip()
-    consulente_id = request.GET.get("consulente", "").strip()
-    esiti_list = request.GET.getlist("esiti")
+    stato_operativo = params.get("stato_operativo", "").strip() or (stato_vista if stato_vista else "")
+    richiamo_da_raw = params.get("richiamo_da", "").strip()
+    richiamo_a_raw = params.get("richiamo_a", "").strip()
+    consulente_id = params.get("consulente", "").strip()
+    esiti_list = params.getlist("esiti")
 
     if q:
-        qs = qs.filter(
-            Q(nome__icontains=q) |
-            Q(cognome__icontains=q) |
-            Q(email__icontains=q) |
-            Q(telefono__icontains=q)
-        )
+        # indice a trigrammi (crm/ricerca.py): _rilevanza serve all'ordinamento di lead_lista
+        qs, rilevanza = filtra_ricerca(qs, q, esatta=ricerca_esatta)
+        if rilevanza is not None:
+            qs = qs.annotate(_rilevanza=rilevanza)
     primo_contatto = _parse_date(primo_contatto_raw)
     appuntamento = _parse_date(appuntamento_raw)
 
@@ -965,13 +1041,13 @@ def lead_lista(request, stato_slug=None):
     if appuntamento:
         qs = qs.filter(appuntamento_previsto__date=appuntamento)
 
-    if stato_operativo in dict(Lead.StatoOperativo.choices) and not stato_vista:
+    if stato_operativo in STATI_OPERATIVI_LEAD and not stato_vista:
         qs = qs.filter(stato_operativo=stato_operativo)
     elif stato_vista:
         pass  # già filtrato per stato_vista
 
     if esiti_list and not stato_vista:
-        validi = [e for e in esiti_list if e in dict(Lead.StatoOperativo.choices)]
+        validi = [e for e in esiti_list if e in STATI_OPERATIVI_LEAD]
         if validi:
             qs = qs.filter(stato_operativo__in=validi)
 
@@ -983,7 +1059,7 @@ def lead_lista(request, stato_slug=None):
         qs = qs.filter(richiamare_il__date__lte=richiamo_a)
 
     # Quick filter appuntamenti
-    appt = request.GET.get("appt", "").strip()
+    appt = params.get("appt", "").strip()
     start, end = _appt_range(appt)
     if start and end:
         qs = qs.filter(
@@ -994,6 +1070,39 @@ def lead_lista(request, stato_slug=None):
     if consulente_id.isdigit():
         qs = qs.filter(consulente_id=int(consulente_id))
 
+    filtri = {
+        "q": q,
+        "primo_contatto": primo_contatto_raw,
+        "appuntamento": appuntamento_raw,
+        "stato_operativo": stato_operativo,
+        "stato_vista": stato_vista,
+        "stato_vista_label": stato_vista_label,
+        "stato_slug_actual": stato_slug_actual,
+        "richiamo_da": richiamo_da_raw,
+        "richiamo_a": richiamo_a_raw,
+        "consulente_sel": consulente_id,
+        "appt": appt,
+        "esiti_selezionati": esiti_list,
+    }
+    return qs, filtri
+
+
+def _lead_per_lista(qs):
+    """Relazioni mostrate nelle righe di lead_lista."""
+    return qs.select_related("consulente").prefetch_related(
+        Prefetch(
+            "note_entries",
+            queryset=NotaLead.objects.order_by("-creato_il").select_related("autore"),
+        )
+    )
+
+
+@login_required
+@user_passes_test(has_portal_access)
+def lead_lista(request, stato_slug=None):
+    qs, filtri = _lead_filtrati(request.GET, stato_slug)
+    qs = _lead_per_lista(qs)
+
     # --- SORT: appuntamenti prossimi prima, con esito/chiusi dopo ---
     sort_raw = request.GET.get("sort", "").strip()
     sort_map = {
@@ -1005,9 +1114,11 @@ def lead_lista(request, stato_slug=None):
         "primo_contatto": "primo_contatto", "-primo_contatto": "-primo_contatto",
         "consulente": "consulente__nome", "-consulente": "-consulente__nome",
     }
-    # Default: appuntamenti prossimi prima, esitati in fondo
+    # Default: appuntamenti prossimi prima, esitati in fondo (cercando: prima i più rilevanti)
     sort = sort_map.get(sort_raw)
-    if sort is None:
+    if sort is None and filtri["q"] and "_rilevanza" in qs.query.annotations:
+        qs = qs.order_by("-_rilevanza", "-creato_il", "pk")
+    elif sort is None:
         stati_chiusi = {"consulenza_eff", "non_competenza", "non_contattare", "numero_errato", "blocco_chiamate", "cliente_non_interessato"}
         qs = qs.annotate(
             _ordine_fase=Case(
@@ -1024,35 +1135,132 @@ def lead_lista(request, stato_slug=None):
         qs = qs.order_by(sort)
 
 
-    ha_negativi = qs.filter(stato="negativo").exists()
+    # --- Filtro salvato (?filtro=<id>): con memorizza_risultati gli id sono in cache ---
+    filtri_salvati = list(request.user.filtri_salvati.all())
+    filtro_id = request.GET.get("filtro", "")
+    filtro = next((f for f in filtri_salvati if str(f.pk) == filtro_id), None)
 
     # --- Paginazione ---
     per_page = _get_per_page(request, 20, 100)
-    paginator = Paginator(qs, per_page)
-    page_obj = paginator.get_page(request.GET.get("page"))
+    if filtro is not None and filtro.memorizza_risultati:
+        # la chiave segue i parametri correnti: se l'utente cambia un filtro, è un'altra lista
+        firma = hashlib.md5(f"{stato_slug}?{_parametri_filtro(request.GET)}".encode()).hexdigest()
+        ids, totale, ha_negativi = ricorda(
+            "filtri", filtro.pk, firma, calcola=lambda: _calcola_ids_filtro(qs), timeout=FILTRI_SALVATI_IDS_TTL,
+        )
+        page_obj = Paginator(_IdsFiltro(ids, totale, qs), per_page).get_page(request.GET.get("page"))
+        # la pagina si legge per pk, senza rieseguire filtri e ordinamento
+        # (archiviati dopo il calcolo degli id esclusi: il loro dettaglio non è più raggiungibile)
+        per_pk = _lead_per_lista(Lead.objects.filter(is_archiviato=False)).in_bulk(page_obj.object_list)
+        leads = [per_pk[pk] for pk in page_obj.object_list if pk in per_pk]
+    else:
+        ha_negativi = qs.filter(stato="negativo").exists()
+        page_obj = Paginator(qs, per_page).get_page(request.GET.get("page"))
+        leads = page_obj.object_list
 
-    consulenti = Consulente.objects.filter(is_active=True).order_by("nome")
+    consulenti = consulenti_attivi()
 
     return render(request, "crm/lead_lista.html", {
-        "leads": page_obj.object_list,
+        **filtri,
+        "leads": leads,
         "page_obj": page_obj,
-        "q": q,
-        "primo_contatto": primo_contatto_raw, 
-        "appuntamento": appuntamento_raw,
-        "stato_operativo": stato_operativo,
-        "stato_vista": stato_vista,
-        "stato_vista_label": stato_vista_label,
-        "stato_slug_actual": stato_slug_actual,
         "STATI_OPERATIVI": Lead.StatoOperativo.choices,
-        "richiamo_da": richiamo_da_raw, "richiamo_a": richiamo_a_raw,
         "sort": sort_raw, "ha_negativi": ha_negativi, "per": per_page,
-        "consulente_sel": consulente_id,
         "consulenti": consulenti,
-        "appt": appt,
-        "esiti_selezionati": esiti_list,
+        "filtri_salvati": filtri_salvati,
+        "filtro_attivo": filtro,
+        "parametri_filtro": _parametri_filtro(request.GET),
     })
 
 
+# ==============================
+# Lead – filtri salvati
+# ==============================
+# Parametri di lead_lista che non fanno parte di un filtro salvato
+PARAMETRI_NON_SALVATI = ("page", "filtro")
+# Durata della cache degli id di un filtro salvato (memorizza_risultati): i lead modificati
+# nel frattempo possono comparire nella lista sbagliata al massimo per questo tempo
+FILTRI_SALVATI_IDS_TTL = 120
+# Id messi in cache per filtro (le prime pagine): oltre si legge dal queryset
+FILTRI_SALVATI_IDS_MAX = 1000
+
+
+def _calcola_ids_filtro(qs) -> tuple[list[int], int, bool]:
+    """(primi FILTRI_SALVATI_IDS_MAX id, totale, ci sono negativi) per la cache di memorizza_risultati."""
+    ids = list(qs.values_list("pk", flat=True)[:FILTRI_SALVATI_IDS_MAX])
+    totale = qs.count() if len(ids) == FILTRI_SALVATI_IDS_MAX else len(ids)
+    return ids, totale, qs.filter(stato="negativo").exists()
+
+
+class _IdsFiltro:
+    """Sequenza per Paginator: le pagine dentro gli id in cache da lì, le successive dal queryset."""
+
+    def __init__(self, ids, totale, qs):
+        self.ids, self.totale, self.qs = ids, totale, qs
+
+    def count(self):
+        return self.totale
+
+    def __getitem__(self, fetta):
+        if fetta.stop <= len(self.ids) or len(self.ids) == self.totale:
+            return self.ids[fetta]
+        return list(self.qs.values_list("pk", flat=True)[fetta])
+
+
+def _parametri_filtro(params) -> str:
+    params = params.copy()
+    for nome in PARAMETRI_NON_SALVATI:
+        params.pop(nome, None)
+    return params.urlencode()
+
+
+def _url_filtro(filtro) -> str:
+    if filtro.stato_slug:
+        base = reverse("lead_lista_stato", kwargs={"stato_slug": filtro.stato_slug})
+    else:
+        base = reverse("lead_lista")
+    parametri = f"{filtro.parametri}&" if filtro.parametri else ""
+    return f"{base}?{parametri}filtro={filtro.pk}"
+
+
+@login_required
+@user_passes_test(has_portal_access)
+@require_POST
+def lead_filtro_salva(request):
+    """Salva (o aggiorna, se il nome esiste già) i filtri correnti di lead_lista per l'utente."""
+    nome = request.POST.get("nome", "").strip()[:80]
+    if not nome:
+        messages.error(request, "Dai un nome al filtro.")
+        return _back(request)
+    stato_slug = request.POST.get("stato_slug", "")
+    filtro, creato = FiltroSalvato.objects.update_or_create(
+        utente=request.user, nome=nome,
+        defaults={
+            "stato_slug": stato_slug if stato_slug in STATO_SLUG_MAP else "",
+            "parametri": _parametri_filtro(QueryDict(request.POST.get("parametri", ""))),
+            "memorizza_risultati": request.POST.get("memorizza_risultati") == "1",
+        },
+    )
+    messages.success(request, "Filtro salvato." if creato else "Filtro aggiornato.")
+    return redirect(_url_filtro(filtro))
+
+
+@login_required
+@user_passes_test(has_portal_access)
+def lead_filtro_apri(request, filtro_id):
+    filtro = get_object_or_404(FiltroSalvato, pk=filtro_id, utente=request.user)
+    return redirect(_url_filtro(filtro))
+
+
+@login_required
+@user_passes_test(has_portal_access)
+@require_POST
+def lead_filtro_elimina(request, filtro_id):
+    get_object_or_404(FiltroSalvato, pk=filtro_id, utente=request.user).delete()
+    messages.success(request, "Filtro eliminato.")
+    return redirect("lead_lista")
+
+
 @login_required
 @user_passes_test(has_portal_access)
 @require_http_methods(["GET", "POST"])
@@ -1097,6 +1305,7 @@ def lead_modifica(request, lead_id):
 
 @login_required
 @user_passes_test(has_portal_access)
+@condizionale_html(lambda lead_id: versione_lead(lead_id))
 def lead_dettaglio(request, lead_id):
     lead = get_object_or_404(
         Lead.objects.prefetch_related(
@@ -1140,7 +1349,7 @@ def lead_aggiorna_stato_operativo(request, lead_id):
 
     if nuovo_stato in stati_validi:
         lead.stato_operativo = nuovo_stato
-        lead.save(update_fields=["stato_operativo"])
+        lead.save(update_fields=["stato_operativo", "aggiornato_il"])
         messages.success(request, "Stato lavorazione aggiornato.")
     else:
         messages.error(request, "Stato lavorazione non valido.")
@@ -1148,6 +1357,272 @@ def lead_aggiorna_stato_operativo(request, lead_id):
     return redirect(_back(request))
 
 
+@login_required
+@user_passes_test(has_portal_access)
+@require_POST
+def lead_azioni_massa(request):
+    """
+    Azione massiva su lead selezionati (ids) o su tutti quelli che rispettano i filtri
+    correnti di lead_lista (tutti=1 + filtri=<querystring> + stato_slug).
+    Azioni: stato (stato_operativo), consulente (assegna/rimuovi), archivia.
+    """
+    azione = (request.POST.get("azione") or "").strip()
+    valore = (request.POST.get("valore") or "").strip()
+
+    if request.POST.get("tutti") == "1":
+        filtri = QueryDict(request.POST.get("filtri", ""))
+        qs, _ = _lead_filtrati(filtri, request.POST.get("stato_slug") or None, ricerca_esatta=True)
+    else:
+        ids = [int(i) for i in request.POST.getlist("ids") if i.isdigit()]
+        qs = Lead.objects.filter(is_archiviato=False, pk__in=ids)
+
+    errore = None
+    valori = {}
+    if azione == "stato":
+        if valore in STATI_OPERATIVI_LEAD:
+            valori = {"stato_operativo": valore}
+        else:
+            errore = "Stato lavorazione non valido."
+    elif azione == "consulente":
+        if not valore:
+            valori = {"consulente": None}
+        elif valore.isdigit() and int(valore) in per_pk("consulenti_attivi", convalida=True):
+            valori = {"consulente_id": int(valore)}
+        else:
+            errore = "Consulente non valido."
+    elif azione == "archivia":
+        valori = {"is_archiviato": True}
+    else:
+        errore = "Azione non valida."
+
+    aggiornati = 0 if errore else aggiorna_lead_in_massa(qs, **valori)
+
+    if "application/json" in request.headers.get("Accept", ""):
+        if errore:
+            return JsonResponse({"errore": errore}, status=400)
+        return JsonResponse({"aggiornati": aggiornati})
+
+    if errore:
+        messages.error(request, errore)
+    else:
+        messages.success(request, f"Aggiornati {aggiornati} lead.")
+    return redirect(_back(request))
+
+
+# ==============================
+# Lead – coda richiami
+# ==============================
+RICHIAMI_ATTESA_MAX = 25        # secondi massimi di long-poll
+
+
+def _firma_richiami(richiami) -> str:
+    base = "|".join(f"{r['lead'].pk}:{r['tipo']}:{r['scadenza'].isoformat()}:{int(r['scaduto'])}" for r in richiami)
+    return hashlib.md5(base.encode()).hexdigest()
+
+
+def _richiamo_json(r):
+    lead = r["lead"]
+    return {
+        "lead_id": lead.pk,
+        "nome": f"{lead.nome} {lead.cognome}".strip(),
+        "telefono": lead.telefono or "",
+        "consulente": str(lead.consulente) if lead.consulente_id else "",
+        "tipo": r["tipo"],
+        "scadenza": r["scadenza"].isoformat(),
+        "scaduto": r["scaduto"],
+        "url": reverse("lead_dettaglio", args=[lead.pk]),
+    }
+
+
+@login_required
+@user_passes_test(has_portal_access)
+def lead_richiami(request):
+    """Coda richiami/appuntamenti in scadenza nei prossimi N minuti, per consulente."""
+    parametri = parametri_richiami(request.GET)
+    richiami = richiami_in_scadenza(**parametri)
+    return render(request, "crm/lead_richiami.html", {
+        "richiami": richiami,
+        "versione": _firma_richiami(richiami),
+        "minuti": parametri["minuti"],
+        "consulente_sel": str(parametri["consulente_id"] or ""),
+        "consulenti": consulenti_attivi(),
+    })
+
+
+async def _attendi_evento_lead(iscrizione, scadenza: float) -> bool:
+    """True appena arriva un evento lead dal broker, False allo scadere del tempo."""
+    while True:
+        restante = scadenza - time.monotonic()
+        if restante <= 0:
+            return False
+        evento = await iscrizione.prossimo(restante)
+        if evento is None:
+            return False
+        if evento.tipo in ("lead", "lead_massa"):
+            return True
+
+
+@login_required
+@user_passes_test(has_portal_access)
+async def lead_richiami_attendi(request):
+    """
+    Long-poll della coda richiami: risponde appena la coda cambia rispetto a `versione`
+    (nuovo richiamo in scadenza, lead modificato) oppure allo scadere di `attendi` secondi.
+    Async: in attesa non occupa thread né fa query; ricalcola la coda solo quando il broker
+    segnala una modifica ai lead e un'ultima volta a timeout (richiami entrati nella finestra
+    col passare del tempo, modifiche arrivate da altri processi).
+    """
+    parametri = parametri_richiami(request.GET)
+    versione_client = request.GET.get("versione", "")
+    try:
+        attendi = max(0, min(int(request.GET.get("attendi", RICHIAMI_ATTESA_MAX)), RICHIAMI_ATTESA_MAX))
+    except (TypeError, ValueError):
+        attendi = RICHIAMI_ATTESA_MAX
+
+    calcola = sync_to_async(richiami_in_scadenza)
+    scadenza = time.monotonic() + attendi
+    iscrizione = broker.iscrivi()
+    try:
+        scaduto = False
+        while True:
+            richiami = await calcola(**parametri)
+            versione = _firma_richiami(richiami)
+            if versione != versione_client or scaduto:
+                break
+            scaduto = not await _attendi_evento_lead(iscrizione, scadenza)
+    finally:
+        broker.disiscrivi(iscrizione)
+
+    return JsonResponse({
+        "versione": versione,
+        "cambiata": versione != versione_client,
+        "richiami": [_richiamo_json(r) for r in richiami],
+    })
+
+
+# ==============================
+# Archivio lead (sola lettura, popolato dal comando archivia_lead)
+# ==============================
+@login_required
+@user_passes_test(has_portal_access)
+def lead_archivio(request):
+    """Ricerca nei lead spostati in archivio: nome/cognome/telefono/email, consulente, stato."""
+    q = (request.GET.get("q") or "").strip()
+    consulente_sel = (request.GET.get("consulente") or "").strip()
+    stato_sel = (request.GET.get("stato") or "").strip()
+
+    qs = LeadArchivio.objects.select_related("consulente")
+    if q:
+        for parola in q.split():
+            qs = qs.filter(
+                Q(nome__icontains=parola) | Q(cognome__icontains=parola)
+                | Q(telefono__icontains=parola) | Q(email__icontains=parola)
+            )
+    if consulente_sel.isdigit():
+        qs = qs.filter(consulente_id=int(consulente_sel))
+    if stato_sel in dict(Lead.STATO_CHOICES):
+        qs = qs.filter(stato=stato_sel)
+
+    per_page = _get_per_page(request, 20, 100)
+    page_obj = Paginator(qs.order_by("-archiviato_il", "-id"), per_page).get_page(request.GET.get("page"))
+
+    return render(request, "crm/lead_archivio.html", {
+        "leads": page_obj.object_list,
+        "page_obj": page_obj,
+        "q": q,
+        "consulente_sel": consulente_sel,
+        "stato_sel": stato_sel,
+        "per": per_page,
+        "STATI": Lead.STATO_CHOICES,
+        "consulenti": elenco("consulenti"),
+    })
+
+
+@login_required
+@user_passes_test(has_portal_access)
+def lead_archivio_dettaglio(request, lead_id):
+    lead = get_object_or_404(
+        LeadArchivio.objects.select_related("consulente", "convertito_cliente", "convertito_da"),
+        pk=lead_id,
+    )
+    note = lead.note_entries.select_related("autore").order_by("-creato_il")
+    return render(request, "crm/lead_archivio_dettaglio.html", {"lead": lead, "note": note})
+
+
+# ==============================
+# Calendario appuntamenti (feed iCalendar per consulente)
+# ==============================
+CALENDARIO_GIORNI_PASSATI = 30
+CALENDARIO_CACHE_TTL = 60 * 60
+
+
+def _last_modified_calendario(consulente_id, etag, ultimo) -> int:
+    """
+    Last-Modified del feed = la prima volta che l'ETag corrente è stato servito (in cache).
+    Max(aggiornato_il) non basta: un lead cancellato, riassegnato o archiviato esce dal feed
+    senza spostarlo, e un client con solo If-Modified-Since terrebbe l'evento rimosso.
+    Cresce a ogni cambio di ETag (almeno di un secondo); se la cache lo perde riparte da adesso.
+    """
+    chiave = f"crm:ics:lm:{consulente_id}"
+    precedente = cache.get(chiave)
+    if precedente and precedente[0] == etag:
+        return precedente[1]
+    last_modified = max(
+        int(time.time()),
+        int(ultimo.timestamp()) if ultimo else 0,
+        precedente[1] + 1 if precedente else 0,
+    )
+    cache.set(chiave, (etag, last_modified), None)
+    return last_modified
+
+
+@require_GET
+def consulente_calendario_ics(request, token):
+    """
+    Feed .ics degli appuntamenti di un consulente, accessibile senza login tramite token.
+    ETag dal contenuto del feed (numero, id e ultima modifica dei lead): i client che
+    ricontrollano ogni pochi minuti ricevono 304 con una sola query aggregata.
+    """
+    consulente = get_object_or_404(
+        Consulente.objects.only("id", "nome"), calendario_token=token, is_active=True
+    )
+    # inizio finestra a giorno fisso, così l'ETag resta stabile durante la giornata
+    inizio = timezone.make_aware(
+        datetime.combine(timezone.localdate() - timedelta(days=CALENDARIO_GIORNI_PASSATI), datetime.min.time())
+    )
+    qs = Lead.objects.filter(consulente=consulente, is_archiviato=False, appuntamento_previsto__gte=inizio)
+
+    stato = qs.aggregate(n=Count("pk"), somma=Sum("pk"), ultimo=Max("aggiornato_il"))
+    ultimo = stato["ultimo"]
+    firma = f"{consulente.pk}:{inizio.date()}:{stato['n']}:{stato['somma']}:{ultimo.isoformat() if ultimo else ''}"
+    etag = quote_etag(hashlib.md5(firma.encode()).hexdigest())
+    last_modified = _last_modified_calendario(consulente.pk, etag, ultimo)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        chiave = f"crm:ics:{consulente.pk}:{etag}"
+        body = cache.get(chiave)
+        if body is None:
+            leads = qs.only(
+                "id", "nome", "cognome", "telefono", "email", "stato_operativo",
+                "appuntamento_previsto", "aggiornato_il",
+            ).order_by("appuntamento_previsto")
+            body = genera_ics(
+                consulente,
+                leads,
+                dominio=request.get_host().split(":")[0],
+                url_lead=lambda lead: request.build_absolute_uri(reverse("lead_dettaglio", args=[lead.pk])),
+            )
+            cache.set(chiave, body, CALENDARIO_CACHE_TTL)
+        response = HttpResponse(body, content_type="text/calendar; charset=utf-8")
+        response["Content-Disposition"] = f'inline; filename="appuntamenti_{consulente.pk}.ics"'
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = "private, max-age=300"
+    return response
+
+
 @login_required
 @user_passes_test(has_portal_access)
 @require_POST
@@ -1166,7 +1641,7 @@ def lead_ricontatta(request, lead_id):
     lead.ricontatti_count = (lead.ricontatti_count or 0) + 1
     if lead.ricontatti_count >= 3:
         lead.stato_operativo = Lead.StatoOperativo.NON_CONTATTARE
-    lead.save(update_fields=["ricontatti_count", "stato_operativo"])
+    lead.save(update_fields=["ricontatti_count", "stato_operativo", "aggiornato_il"])
     if lead.ricontatti_count >= 3:
         messages.info(request, f"Lead contattato 3 volte senza risposta → spostato in \"Non contattare\".")
     else:
@@ -1215,7 +1690,7 @@ def scheda_consulenza_nuova(request, *, cliente_id=None, lead_id=None):
 def lead_toggle_msg(request, lead_id):
     lead = get_object_or_404(Lead, pk=lead_id)
     lead.messaggio_inviato = not lead.messaggio_inviato
-    lead.save(update_fields=["messaggio_inviato"])
+    lead.save(update_fields=["messaggio_inviato", "aggiornato_il"])
     return redirect(_back(request))
 
 
@@ -1227,9 +1702,9 @@ def lead_toggle_no_risposta(request, lead_id):
     lead.no_risposta = not lead.no_risposta
     if not lead.no_risposta:
         lead.messaggio_inviato = False
-        lead.save(update_fields=["no_risposta", "messaggio_inviato"])
+        lead.save(update_fields=["no_risposta", "messaggio_inviato", "aggiornato_il"])
     else:
-        lead.save(update_fields=["no_risposta"])
+        lead.save(update_fields=["no_risposta", "aggiornato_il"])
     return redirect(_back(request))
 
 
@@ -1239,7 +1714,7 @@ def lead_toggle_no_risposta(request, lead_id):
 def lead_toggle_consulenza(request, lead_id):
     lead = get_object_or_404(Lead, pk=lead_id)
     lead.consulenza_effettuata = not lead.consulenza_effettuata
-    lead.save(update_fields=["consulenza_effettuata"])
+    lead.save(update_fields=["consulenza_effettuata", "aggiornato_il"])
     return redirect(_back(request))
 
 # NOTIFICHE
@@ -1252,25 +1727,82 @@ def _go_back(request, fallback="dashboard"):
 @require_POST
 @login_required
 def notifiche_segna_letto(request, notifica_id):
-    Notifica.objects.filter(pk=notifica_id).update(is_read=True)
+    segna_notifica_letta(request.user, notifica_id)
     messages.success(request, "Notifica segnata come letta.")
     return _go_back(request)
 
 @require_POST
 @login_required
 def notifiche_segna_tutte_lette(request):
-    Notifica.objects.filter(is_read=False).update(is_read=True)
+    segna_tutte_notifiche_lette(request.user)
     messages.success(request, "Tutte le notifiche segnate come lette.")
     return _go_back(request)
 
 
+NOTIFICHE_ORDINE = ["-id"]
+
+
 @login_required
 def notifiche_lista(request):
     """
-    Pagina semplice con tutte le notifiche (opzionale).
+    Notifiche paginate a cursore sulla pk, con lo stato di lettura dell'utente corrente.
+    ?stato=non_lette|tutte, ?cursore=... per spostarsi tra le pagine.
+    """
+    stato = request.GET.get("stato") or "tutte"
+    if stato == "non_lette":
+        qs = notifiche_non_lette(request.user)
+    else:
+        stato = "tutte"
+        qs = Notifica.objects.all()
+
+    per_page = _get_per_page(request, 30, 100)
+    pagina = pagina_keyset(
+        qs.select_related("cliente", "actor"), NOTIFICHE_ORDINE,
+        cursore=request.GET.get("cursore"), per_page=per_page,
+    )
+    return render(request, "crm/notifiche_lista.html", {
+        "notifiche": marca_stato_lettura(request.user, pagina.oggetti),
+        "pagina": pagina,
+        "stato": stato,
+        "per": per_page,
+    })
+
+# ==============================
+# Canale eventi (Server-Sent Events)
+# ==============================
+SSE_HEARTBEAT = 20  # secondi: commento keep-alive per proxy e load balancer
+
+
+@login_required
+@user_passes_test(has_portal_access)
+async def eventi_stream(request):
     """
-    qs = Notifica.objects.select_related("cliente", "actor").order_by("-created_at")
-    return render(request, "crm/notifiche_lista.html", {"notifiche": qs})
+    Stream text/event-stream con le nuove notifiche e le modifiche ai lead.
+    Alla connessione invia lo stato iniziale (non lette); poi attende sul broker
+    in-process, senza query finché non arriva un evento.
+    """
+    if not sse_attivo(request):
+        # WSGI (runserver, gunicorn sync): StreamingHttpResponse accumulerebbe il generatore
+        # async fino alla fine, cioè mai; 204 dice a EventSource di non riconnettersi
+        return HttpResponse(status=204)
+    user = await request.auser()
+    non_lette = await sync_to_async(conta_notifiche_non_lette)(user)
+    iscrizione = broker.iscrivi()
+
+    async def flusso():
+        try:
+            yield f"retry: 5000\nevent: stato\ndata: {json.dumps({'non_lette': non_lette})}\n\n"
+            while True:
+                evento = await iscrizione.prossimo(SSE_HEARTBEAT)
+                yield evento.sse() if evento else ": ping\n\n"
+        finally:
+            broker.disiscrivi(iscrizione)
+
+    response = StreamingHttpResponse(flusso(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx: niente buffering della risposta
+    return response
+
 
 # ==============================
 # Schede di consulenza
@@ -1438,7 +1970,7 @@ def scheda_consulenza_modifica(request, scheda_id: int):
 def scheda_consulenza_elimina(request, scheda_id: int):
     scheda = get_object_or_404(SchedaConsulenza, pk=scheda_id)
     # Solo admin può eliminare
-    if not (request.user.is_superuser or getattr(getattr(request.user, "profiloutente", None), "ruolo", "") == "admin"):
+    if not is_admin(request.user):
         return HttpResponseForbidden("Solo gli admin possono eliminare le schede.")
     if request.method == "POST":
         dst = "dashboard"
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os 
+import sys
 import dj_database_url
 from dotenv import load_dotenv
 
@@ -69,6 +70,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'crm.middleware.RuoloSessioneMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     "corsheaders.middleware.CorsMiddleware",
@@ -77,10 +79,40 @@ MIDDLEWARE = [
 
 CORS_ALLOW_ALL_ORIGINS = True
 
+# API_JWT_STATELESS=True: l'API si fida dei claim del JWT e non carica User/ProfiloUtente
+# a ogni richiesta (revoca via versione token in cache, vedi crm/api/autenticazione.py)
+API_JWT_STATELESS = os.environ.get("API_JWT_STATELESS", "False").lower() in ("true", "1", "yes")
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-    )
+        "crm.api.autenticazione.JWTAuthenticationStateless"
+        if API_JWT_STATELESS
+        else "crm.api.autenticazione.JWTAuthenticationConRuolo",
+    ),
+    # liste a cursore (keyset) con ?fields= per i campi sparsi, vedi crm/api/paginazione.py
+    "DEFAULT_PAGINATION_CLASS": "crm.api.paginazione.PaginazioneCursore",
+    "PAGE_SIZE": 50,
+    # token bucket per utente/endpoint (crm/api/throttling.py): "<scope>:<ruolo>", "<scope>", "<ruolo>", "default"
+    "DEFAULT_THROTTLE_CLASSES": ("crm.api.throttling.TokenBucketThrottle",),
+    "DEFAULT_THROTTLE_RATES": {
+        "default": "300/min",
+        "admin": "600/min",
+        "anonimo": "30/min",
+        "token": "10/min",
+    },
+    # proxy fidati davanti a Django: l'IP dei client anonimi è quello aggiunto dall'ultimo
+    # di loro in X-Forwarded-For; 0 = REMOTE_ADDR (un X-Forwarded-For inviato dal client è ignorato)
+    "NUM_PROXIES": int(os.environ.get("API_NUM_PROXIES", "0")),
+}
+
+# Cache (secondi) delle risposte API di dettaglio per versione dell'oggetto (crm/versioni.py); 0 = disattivata
+API_CACHE_RISPOSTE_TTL = int(os.environ.get("API_CACHE_RISPOSTE_TTL", "0"))
+
+# JWT con claim di ruolo (crm/ruoli.py): nessuna query per i controlli di permesso
+SIMPLE_JWT = {
+    "TOKEN_OBTAIN_SERIALIZER": "crm.api.autenticazione.TokenConRuoloSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "crm.api.autenticazione.TokenRefreshConRuoloSerializer",
+    "TOKEN_USER_CLASS": "crm.api.autenticazione.UtenteToken",
 }
 
 ROOT_URLCONF = 'debiti_stop.urls'
@@ -96,6 +128,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'crm.context_processors.notifiche_sidebar', # <--- context processor custom per notifiche  
+                'crm.context_processors.ruolo',
             ],
         },
     },
@@ -120,6 +153,27 @@ else:
         "NAME": BASE_DIR / "db.sqlite3",
     }
 
+# Cache: CACHE_URL sceglie il backend
+#   redis://host:6379/0           Redis (condivisa tra worker; richiede il pacchetto `redis`)
+#   file:///var/tmp/debiti_stop   su file (condivisa tra i worker della stessa macchina)
+#   vuota / locmem://             in memoria, per processo (sviluppo e test)
+# I test usano sempre la cache in memoria.
+CACHE_URL = os.environ.get("CACHE_URL", "")
+CACHE_TTL = int(os.environ.get("CACHE_TTL", "300"))
+
+if CACHE_URL.startswith(("redis://", "rediss://")) and "test" not in sys.argv:
+    _cache_backend = {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": CACHE_URL}
+elif CACHE_URL.startswith("file://") and "test" not in sys.argv:
+    _cache_backend = {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": CACHE_URL[len("file://"):],
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+else:
+    _cache_backend = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "debiti-stop"}
+
+CACHES = {"default": {**_cache_backend, "TIMEOUT": CACHE_TTL, "KEY_PREFIX": "debiti_stop"}}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -174,3 +228,15 @@ MEDIA_URL = "/media/"
 
 MEDIA_ROOT= os.path.join(BASE_DIR,"media")
 
+
+# Archiviazione lead: età minima (giorni dall'ultima modifica) per il comando archivia_lead
+LEAD_ARCHIVIO_GIORNI = int(os.environ.get("LEAD_ARCHIVIO_GIORNI", "180"))
+
+# Notifiche (comando pulisci_notifiche): cancellate dopo N giorni se lette da tutti gli utenti attivi,
+# e comunque dopo MAX giorni
+NOTIFICHE_RETENTION_GIORNI = int(os.environ.get("NOTIFICHE_RETENTION_GIORNI", "60"))
+NOTIFICHE_RETENTION_MAX_GIORNI = int(os.environ.get("NOTIFICHE_RETENTION_MAX_GIORNI", "365"))
+
+# Tombstone delle cancellazioni per gli endpoint `changes` (comando pulisci_cancellazioni): un client
+# che non sincronizza da più di N giorni riceve 410 e deve ripartire da una sincronizzazione completa
+CANCELLAZIONI_RETENTION_GIORNI = int(os.environ.get("CANCELLAZIONI_RETENTION_GIORNI", "90"))